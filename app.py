@@ -4,8 +4,8 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (DEBUG also logs every PIL chunk and SQL pool event)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Create SQLAlchemy base class
@@ -27,16 +27,132 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Largest accepted request body (image uploads)
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_BYTES", str(32 * 1024 * 1024)))
+
+# Number of prepared baselines (preprocessed image + features) kept in memory
+app.config["BASELINE_CACHE_SIZE"] = int(os.environ.get("BASELINE_CACHE_SIZE", "32"))
+
+# Default feature backend for image alignment and its keypoint budget
+# (empty for the backend's own default); locations and requests may override
+app.config["ALIGNMENT_BACKEND"] = os.environ.get("ALIGNMENT_BACKEND", "sift-bf")
+app.config["ALIGNMENT_KEYPOINT_BUDGET"] = (
+    int(os.environ["ALIGNMENT_KEYPOINT_BUDGET"]) if os.environ.get("ALIGNMENT_KEYPOINT_BUDGET") else None
+)
+
+# Residual misalignment (pixels) below which the current image, or the last
+# homography estimated for its location, is used without feature matching
+# (0 always runs full alignment)
+app.config["ALIGNMENT_RESIDUAL_THRESHOLD"] = float(os.environ.get("ALIGNMENT_RESIDUAL_THRESHOLD", "1.5"))
+
+# Default change detection mode: "standard" (downscaled to 800px) or
+# "pyramid" (coarse-to-fine at full resolution, for high resolution cameras)
+app.config["DETECTION_MODE"] = os.environ.get("DETECTION_MODE", "standard")
+# Engine extracting changed regions from the change mask: "contours" or
+# "components" (connected components, statistics computed in bulk)
+app.config["DETECTION_ENGINE"] = os.environ.get("DETECTION_ENGINE", "contours")
+
+# Most frames accepted by one /api/scan/compare-batch request
+app.config["COMPARE_BATCH_MAX_FRAMES"] = int(os.environ.get("COMPARE_BATCH_MAX_FRAMES", "64"))
+
+# Minimum overlap (IoU) for a change to continue a region track, and the
+# number of locations whose trackers are kept in memory
+app.config["TRACK_IOU_THRESHOLD"] = float(os.environ.get("TRACK_IOU_THRESHOLD", "0.3"))
+app.config["TRACKER_CACHE_SIZE"] = int(os.environ.get("TRACKER_CACHE_SIZE", "64"))
+# Days a track may go unmatched, counted back from the location's newest
+# change, before it retires and stops being matched (0 never retires tracks)
+app.config["TRACK_MAX_IDLE_DAYS"] = float(os.environ.get("TRACK_MAX_IDLE_DAYS", "30"))
+
+# Process pool running CPU-bound vision work (0 workers runs it inline)
+app.config["COMPUTE_WORKERS"] = int(os.environ.get("COMPUTE_WORKERS", os.cpu_count() or 1))
+# Maximum comparisons queued or running before requests are rejected with 503
+app.config["COMPUTE_MAX_PENDING"] = int(os.environ.get("COMPUTE_MAX_PENDING", "0")) or None
+# Seconds a request waits for a free slot, and for its result
+app.config["COMPUTE_QUEUE_TIMEOUT"] = float(os.environ.get("COMPUTE_QUEUE_TIMEOUT", "0"))
+app.config["COMPUTE_TIMEOUT"] = float(os.environ.get("COMPUTE_TIMEOUT", "60"))
+# Tiled execution: each comparison preprocesses and diffs its frame in
+# TILE_SIZE pixel tiles on TILE_THREADS threads (0 disables it). Pays off
+# on many-core machines running fewer comparisons at once than they have
+# cores; the threads default to the cores left per compute worker
+app.config["TILE_SIZE"] = int(os.environ.get("TILE_SIZE", "0"))
+app.config["TILE_THREADS"] = int(os.environ.get(
+    "TILE_THREADS", max(1, (os.cpu_count() or 1) // max(1, app.config["COMPUTE_WORKERS"]))
+))
+
+# Background workers for asynchronous compare jobs
+app.config["COMPARE_JOB_THREADS"] = int(os.environ.get("COMPARE_JOB_THREADS", "1"))
+app.config["COMPARE_JOB_POLL_INTERVAL"] = float(os.environ.get("COMPARE_JOB_POLL_INTERVAL", "1.0"))
+# Seconds before a running job is considered abandoned and retried
+app.config["COMPARE_JOB_LEASE"] = int(os.environ.get("COMPARE_JOB_LEASE", "300"))
+app.config["COMPARE_JOB_MAX_ATTEMPTS"] = int(os.environ.get("COMPARE_JOB_MAX_ATTEMPTS", "3"))
+
+# Directory of the content-addressed scan image store
+app.config["IMAGE_STORE_PATH"] = os.environ.get(
+    "IMAGE_STORE_PATH", os.path.join(app.instance_path, "scan_images")
+)
+
+# Rendered comparison visualizations and their default format (jpeg, webp or png)
+app.config["VISUALIZATION_CACHE_PATH"] = os.environ.get(
+    "VISUALIZATION_CACHE_PATH", os.path.join(app.instance_path, "visualizations")
+)
+app.config["VISUALIZATION_FORMAT"] = os.environ.get("VISUALIZATION_FORMAT", "jpeg")
+
+# Stage latency histograms served at /metrics, and per-response
+# Server-Timing headers; both cost nothing when disabled
+app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+# "No change" pre-screen, off by default (-1): a comparison whose image
+# signature is at most this far (0-255) from the baseline's is reported
+# unchanged without running the pipeline. Locations and requests may
+# override it. Signatures are 32x32 cell means, in which small changes are
+# diluted, so a skipped comparison can miss a real change (a false
+# negative). The bound applied is therefore capped by the distance the
+# smallest detectable change produces (utils.prescreen.detectable_distance),
+# which at 800x600 only skips frames practically identical to the
+# baseline; pyramid mode, meant for small objects, is never pre-screened.
+app.config["PRESCREEN_MAX_DISTANCE"] = int(os.environ.get("PRESCREEN_MAX_DISTANCE", "-1"))
+# Whether comparisons skipped by the pre-screen refer to the baseline's image
+# instead of keeping the (unchanged) upload
+app.config["PRESCREEN_DISCARD_IMAGES"] = os.environ.get("PRESCREEN_DISCARD_IMAGES", "0").lower() in ("1", "true", "yes")
+
+# Longest side (pixels) of the scan thumbnails and previews kept in the image store
+app.config["THUMBNAIL_SIZE"] = int(os.environ.get("THUMBNAIL_SIZE", "160"))
+app.config["PREVIEW_SIZE"] = int(os.environ.get("PREVIEW_SIZE", "640"))
+
+# Per-location change heatmaps (see utils.heatmap): directory of their
+# memory-mapped files, grid cells per side, and the time buckets kept for
+# windowed queries (by default a day each, for 90 days)
+app.config["HEATMAP_PATH"] = os.environ.get("HEATMAP_PATH", os.path.join(app.instance_path, "heatmaps"))
+app.config["HEATMAP_GRID_SIZE"] = int(os.environ.get("HEATMAP_GRID_SIZE", "64"))
+app.config["HEATMAP_BUCKET_SECONDS"] = int(os.environ.get("HEATMAP_BUCKET_SECONDS", "86400"))
+app.config["HEATMAP_BUCKETS"] = int(os.environ.get("HEATMAP_BUCKETS", "90"))
+
 # Initialize the app with the extension
 db.init_app(app)
 
-# Import routes after app is created to avoid circular imports
-with app.app_context():
-    # Import models and create tables
-    import models
-    db.create_all()
+def create_app():
+    """
+    Set up the application and return it
+    
+    Importing this module only configures the app. The models, routes and
+    CLI commands, which register themselves on the shared app object, are
+    imported here to avoid circular imports. Neither step touches the
+    database or loads the vision stack (OpenCV, NumPy): the schema is
+    upgraded by `flask --app main upgrade-db` (gunicorn.conf.py runs it
+    before the workers start), and the vision modules are imported by the
+    first comparison or preloaded by the gunicorn master.
+    
+    Returns:
+        The Flask app
+    """
+    with app.app_context():
+        import models
+        import routes
+        
+        # Register the CLI commands not pulled in by the routes
+        import migrations
+        import streaming
     
-    # Import routes
-    from routes import *
-
     logger.debug("Application initialized successfully")
+    return app
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the SpaceScanner pipeline.
+
+Run a benchmark module from the repository root, for example:
+
+    python -m benchmarks.changelog_insert
+"""
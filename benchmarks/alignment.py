@@ -0,0 +1,69 @@
+"""
+Latency and accuracy of the alignment feature backends.
+
+Each fixture is a synthetic scene and a copy warped by a random homography.
+The baseline side is prepared once (as the baseline cache does) and the
+timed part is what every comparison pays: detecting features on the current
+image, matching and RANSAC. Accuracy is the reprojection error of the
+estimated homography against the known one.
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from benchmarks.common import use_temporary_instance
+from benchmarks.fixtures import textured_scene, random_homography, warp, reprojection_error
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fixtures', type=int, default=10, help='Number of scene pairs')
+    parser.add_argument('--backends', nargs='+', default=None, help='Backends to compare (default: all available)')
+    parser.add_argument('--budget', type=int, default=None, help='Keypoint budget (default: per backend)')
+    parser.add_argument('--width', type=int, default=960)
+    parser.add_argument('--height', type=int, default=720)
+    args = parser.parse_args()
+
+    use_temporary_instance()
+    from utils.feature_backends import available_backends
+    from utils.image_processor import preprocess_image, prepare_baseline, estimate_homography
+
+    size = (args.width, args.height)
+    rng = np.random.default_rng(0)
+    fixtures = []
+    for seed in range(args.fixtures):
+        scene = textured_scene(seed, size)
+        H_true = random_homography(rng, size)
+        fixtures.append((scene, warp(scene, H_true), H_true))
+
+    print(f"{'backend':>8} {'p50 ms':>8} {'p95 ms':>8} {'mean err px':>12} {'max err px':>11} {'failures':>9}")
+    for backend in args.backends or available_backends():
+        latencies, errors, failures = [], [], 0
+        for baseline, current, H_true in fixtures:
+            features = prepare_baseline(baseline, backend, args.budget)
+            current_processed = preprocess_image(current)
+            # The preprocessed images may be downscaled, so measure error in their coordinates
+            processed_size = (features.image.shape[1], features.image.shape[0])
+            scale = np.diag([processed_size[0] / size[0], processed_size[1] / size[1], 1.0])
+            H_scaled = scale @ H_true @ np.linalg.inv(scale)
+
+            start = time.perf_counter()
+            H = estimate_homography(features, current_processed)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            error = reprojection_error(H_scaled, H, processed_size)
+            if np.isfinite(error):
+                errors.append(error)
+            else:
+                failures += 1
+
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))]
+        mean_error = statistics.mean(errors) if errors else float('nan')
+        max_error = max(errors) if errors else float('nan')
+        print(f"{backend:>8} {statistics.median(latencies):>8.1f} {p95:>8.1f} "
+              f"{mean_error:>12.2f} {max_error:>11.2f} {failures:>9}")
+
+if __name__ == '__main__':
+    main()
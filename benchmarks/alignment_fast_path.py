@@ -0,0 +1,76 @@
+"""
+Steady-state comparison latency for a fixed camera: full feature alignment
+on every frame versus the residual check fast path (align_to_baseline).
+
+Frames are the baseline scene with noise and a new object, either exactly
+in place (static camera) or all moved by the same small camera shift, in
+which case the first frame estimates a homography and later frames reuse it.
+"""
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+
+from benchmarks.common import use_temporary_instance, time_call
+from benchmarks.fixtures import textured_scene, random_homography, warp
+
+def make_frames(baseline, count, H=None, seed=0):
+    """Noisy JPEG copies of the baseline with an added object, optionally warped by H"""
+    from utils.pipeline import encode_image
+
+    rng = np.random.default_rng(seed)
+    height, width = baseline.shape[:2]
+    frames = []
+    for _ in range(count):
+        frame = baseline.copy()
+        center = (int(rng.integers(width // 4, 3 * width // 4)), int(rng.integers(height // 4, 3 * height // 4)))
+        cv2.circle(frame, center, 50, (250, 250, 250), -1)
+        frame = np.clip(frame + rng.normal(0, 3, frame.shape), 0, 255).astype(np.uint8)
+        frames.append(encode_image(warp(frame, H) if H is not None else frame, 'jpeg', 95))
+    return frames
+
+def run(baseline_features, frames, residual_threshold):
+    """Compare every frame, carrying the homography like the routes do"""
+    from utils.pipeline import run_comparison
+
+    latencies, methods, hint = [], {}, None
+    for frame in frames:
+        result, elapsed = time_call(
+            run_comparison, baseline_features, frame,
+            homography_hint=hint, residual_threshold=residual_threshold
+        )
+        latencies.append(elapsed * 1000)
+        methods[result['alignment']] = methods.get(result['alignment'], 0) + 1
+        if result['homography'] is not None:
+            hint = result['homography']
+    return latencies, methods
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=20, help='Frames per scenario')
+    parser.add_argument('--backend', default='sift-bf')
+    args = parser.parse_args()
+
+    use_temporary_instance()
+    from utils.image_processor import prepare_baseline
+
+    baseline = textured_scene(0)
+    features = prepare_baseline(baseline, args.backend, None)
+    H = random_homography(np.random.default_rng(1), (baseline.shape[1], baseline.shape[0]),
+                          max_shift=0.01, max_rotation=1.0)
+    scenarios = {
+        'static': make_frames(baseline, args.frames),
+        'shifted': make_frames(baseline, args.frames, H)
+    }
+
+    print(f"{'scenario':>9} {'mode':>10} {'p50 ms':>8} {'mean ms':>8}  alignment")
+    for name, frames in scenarios.items():
+        for mode, residual_threshold in (('full', 0), ('fast-path', 1.5)):
+            latencies, methods = run(features, frames, residual_threshold)
+            summary = ', '.join(f'{method}={count}' for method, count in sorted(methods.items()))
+            print(f"{name:>9} {mode:>10} {statistics.median(latencies):>8.1f} "
+                  f"{statistics.mean(latencies):>8.1f}  {summary}")
+
+if __name__ == '__main__':
+    main()
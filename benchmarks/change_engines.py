@@ -0,0 +1,61 @@
+"""
+Cost of turning the change mask into regions with each detection engine
+(findContours versus connectedComponentsWithStats) on a cluttered scene.
+
+The current image is the baseline with many small shapes added and removed,
+already aligned, so the timed part is thresholding, morphology and region
+extraction. Agreement is the share of boxes found by both engines.
+"""
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+
+from benchmarks.common import use_temporary_instance, time_call
+from benchmarks.fixtures import textured_scene
+
+def cluttered_changes(baseline, count, seed=0):
+    """Copy of baseline with count small bright and dark shapes drawn on it"""
+    rng = np.random.default_rng(seed)
+    height, width = baseline.shape[:2]
+    current = baseline.copy()
+    for _ in range(count):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(8, 24))
+        color = (250, 250, 250) if rng.random() < 0.5 else (5, 5, 5)
+        cv2.rectangle(current, (x, y), (x + size, y + size), color, -1)
+    return current
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--changes', type=int, nargs='+', default=[50, 200, 800], help='Shapes drawn per scene')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=600)
+    args = parser.parse_args()
+
+    use_temporary_instance()
+    from utils.change_detector import detect_changes, DETECTION_ENGINES
+
+    baseline = textured_scene(0, (args.width, args.height))
+
+    print(f"{'shapes':>7} {'engine':>11} {'p50 ms':>8} {'regions':>8} {'agreement':>10}")
+    for count in args.changes:
+        current = cluttered_changes(baseline, count)
+        boxes = {}
+        for engine in DETECTION_ENGINES:
+            latencies = []
+            for _ in range(args.repeat):
+                (changes, _, _), elapsed = time_call(
+                    detect_changes, baseline, current, render=False, aligned_current=current, engine=engine
+                )
+                latencies.append(elapsed * 1000)
+            boxes[engine] = {(c['x'], c['y'], c['width'], c['height'], c['type']) for c in changes}
+
+            agreement = len(boxes[engine] & boxes[DETECTION_ENGINES[0]]) / max(1, len(boxes[engine]))
+            print(f"{count:>7} {engine:>11} {statistics.median(latencies):>8.2f} "
+                  f"{len(changes):>8} {agreement:>10.1%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Per-change cost of persisting a comparison: the original pattern (commit the
+scan, add each ChangeLog through the ORM, commit again) versus the
+single-transaction bulk insert in persistence.save_comparison.
+"""
+import argparse
+import random
+from unittest import mock
+
+from benchmarks.common import use_temporary_instance, load_app, time_call
+from benchmarks.fixtures import textured_scene
+
+def make_changes(count, seed=0):
+    """Random change boxes with matching detected objects"""
+    rng = random.Random(seed)
+    changes, objects = [], []
+    for i in range(count):
+        changes.append({
+            'id': i,
+            'type': rng.choice(['added', 'removed', 'changed']),
+            'x': rng.randrange(800), 'y': rng.randrange(600),
+            'width': rng.randrange(10, 200), 'height': rng.randrange(10, 200)
+        })
+        objects.append({'label': 'unknown', 'confidence': 0.5})
+    return changes, objects
+
+def save_per_row(baseline, image_fields, changes, objects):
+    """The original compare_scans persistence: two commits, one add per change"""
+    from app import db
+    from models import Scan, ChangeLog
+
+    new_scan = Scan(name='bench', description='', is_baseline=False,
+                    location=baseline.location, **image_fields)
+    db.session.add(new_scan)
+    db.session.commit()
+
+    for i, change in enumerate(changes):
+        db.session.add(ChangeLog(
+            scan_id=new_scan.id,
+            baseline_id=baseline.id,
+            change_type=change['type'],
+            object_type=objects[i]['label'],
+            confidence=objects[i]['confidence'],
+            position_x=change['x'],
+            position_y=change['y'],
+            size_w=change['width'],
+            size_h=change['height']
+        ))
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--changes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    use_temporary_instance()
+    app = load_app()
+    from app import db
+    from models import Scan
+    from persistence import save_comparison
+    from derivatives import derivative_worker
+    from tracks import track_worker
+    from routes import image_store, stored_image_fields
+    from utils.pipeline import encode_image
+
+    # Thumbnails and region tracks of the saved scans are updated on
+    # background threads, which would compete with the timed inserts
+    with app.app_context(), mock.patch.object(derivative_worker, 'enqueue'), \
+            mock.patch.object(track_worker, 'enqueue'):
+        image_fields = stored_image_fields(image_store.put(encode_image(textured_scene(size=(800, 600)), 'png')))
+        baseline = Scan(name='baseline', is_baseline=True, location='bench', **image_fields)
+        db.session.add(baseline)
+        db.session.commit()
+
+        print(f"{'changes':>8} {'per-row us/change':>18} {'bulk us/change':>15} {'speedup':>8}")
+        for count in args.changes:
+            changes, objects = make_changes(count)
+            before = min(time_call(save_per_row, baseline, image_fields, changes, objects)[1]
+                         for _ in range(args.repeat))
+            after = min(time_call(save_comparison, baseline, image_fields['image_hash'], changes,
+                                  objects, {}, image_fields=image_fields)[1]
+                        for _ in range(args.repeat))
+            print(f"{count:>8} {before / count * 1e6:>18.1f} {after / count * 1e6:>15.1f} "
+                  f"{before / after:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import logging
+import tempfile
+
+def use_temporary_instance():
+    """
+    Point the app at a throwaway database and storage directory
+
+    Must be called before the app module is imported.
+
+    Returns:
+        Path of the temporary directory
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='spacescanner-bench-')
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    os.environ["IMAGE_STORE_PATH"] = os.path.join(tmp_dir, 'scan_images')
+    os.environ["VISUALIZATION_CACHE_PATH"] = os.path.join(tmp_dir, 'visualizations')
+    os.environ["HEATMAP_PATH"] = os.path.join(tmp_dir, 'heatmaps')
+    os.environ.setdefault("COMPARE_JOB_THREADS", "0")
+
+    # Make the repository importable when run as python -m benchmarks.<name>
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+
+    logging.disable(logging.INFO)
+    return tmp_dir
+
+def load_app():
+    """
+    Set up the app on the temporary instance, with its schema created
+
+    Returns:
+        The Flask app
+    """
+    from app import create_app
+    from migrations import upgrade_database
+
+    app = create_app()
+    with app.app_context():
+        upgrade_database()
+    return app
+
+def time_call(fn, *args, **kwargs):
+    """
+    Run fn once and measure it
+
+    Returns:
+        Tuple of the result and elapsed seconds
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
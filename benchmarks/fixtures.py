@@ -0,0 +1,139 @@
+"""Synthetic scenes with known ground truth for the benchmarks."""
+import cv2
+import numpy as np
+
+def textured_scene(seed=0, size=(960, 720), clutter=80):
+    """
+    Generate a cluttered RGB scene of random shapes over a noisy background
+
+    Args:
+        seed: Random seed
+        size: (width, height) of the scene
+        clutter: Number of shapes drawn
+
+    Returns:
+        uint8 RGB image
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+
+    scene = rng.normal(110, 12, (height, width, 3)).clip(0, 255).astype(np.uint8)
+    scene = cv2.GaussianBlur(scene, (0, 0), 3)
+
+    for _ in range(clutter):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        extent = int(rng.integers(8, max(9, min(width, height) // 8)))
+        if rng.random() < 0.5:
+            cv2.rectangle(scene, (x, y), (x + extent, y + int(rng.integers(8, extent + 9))), color, -1)
+        else:
+            cv2.circle(scene, (x, y), extent // 2, color, -1)
+
+    return scene
+
+def random_homography(rng, size, max_shift=0.03, max_rotation=3.0, max_scale=0.03, max_perspective=1e-5):
+    """
+    Random camera motion as a homography close to identity
+
+    Args:
+        rng: numpy Generator
+        size: (width, height) of the image
+        max_shift: Maximum translation as a fraction of the image size
+        max_rotation: Maximum rotation in degrees
+        max_scale: Maximum relative scale change
+        max_perspective: Maximum perspective coefficient
+
+    Returns:
+        3x3 float64 homography
+    """
+    width, height = size
+    angle = rng.uniform(-max_rotation, max_rotation)
+    scale = 1 + rng.uniform(-max_scale, max_scale)
+
+    H = np.eye(3)
+    H[:2] = cv2.getRotationMatrix2D((width / 2, height / 2), angle, scale)
+    H[0, 2] += rng.uniform(-max_shift, max_shift) * width
+    H[1, 2] += rng.uniform(-max_shift, max_shift) * height
+    H[2, :2] = rng.uniform(-max_perspective, max_perspective, 2)
+    return H
+
+def warp(image, H):
+    """Apply a homography, filling uncovered pixels by reflection"""
+    height, width = image.shape[:2]
+    return cv2.warpPerspective(image, H, (width, height), borderMode=cv2.BORDER_REFLECT)
+
+def reprojection_error(H_true, H_estimated, size, grid=10):
+    """
+    Mean distance between grid points and their round trip through the true
+    camera motion and the estimated alignment
+
+    Args:
+        H_true: Homography mapping the baseline onto the current image
+        H_estimated: Estimated homography mapping the current image back
+        size: (width, height) of the image
+        grid: Number of grid points per axis
+
+    Returns:
+        Mean error in pixels (inf when no estimate is available)
+    """
+    if H_estimated is None:
+        return float('inf')
+
+    width, height = size
+    xs, ys = np.meshgrid(np.linspace(0, width - 1, grid), np.linspace(0, height - 1, grid))
+    points = np.stack([xs.ravel(), ys.ravel()], axis=1).reshape(-1, 1, 2)
+
+    round_trip = cv2.perspectiveTransform(cv2.perspectiveTransform(points, H_true), H_estimated)
+    return float(np.linalg.norm(round_trip - points, axis=2).mean())
+
+def scene_pair(seed=0, size=(960, 720), clutter=80, inserted=3, removed=3, camera_shift=0.0):
+    """
+    Baseline and current scenes differing by known objects and camera motion
+
+    Args:
+        seed: Random seed
+        size: (width, height) of the scenes
+        clutter: Number of background shapes shared by both scenes
+        inserted: Objects present in the current scene only
+        removed: Objects present in the baseline only
+        camera_shift: Maximum camera translation (fraction of the size); the
+            current scene is warped accordingly, with a matching small
+            rotation
+
+    Returns:
+        Tuple of the baseline, the current scene, the homography mapping the
+        baseline onto the current scene (identity without camera motion) and
+        the ground truth as a list of (type, (x, y, width, height)) boxes in
+        baseline coordinates
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    scene = textured_scene(seed, size, clutter)
+    baseline, current = scene.copy(), scene.copy()
+
+    # Solid objects, well inside the frame and apart from each other
+    truth = []
+    extent = max(24, min(width, height) // 10)
+    occupied = []
+    while len(truth) < inserted + removed:
+        x = int(rng.integers(extent, width - 2 * extent))
+        y = int(rng.integers(extent, height - 2 * extent))
+        box = (x, y, extent, extent)
+        if any(abs(x - ox) < 2 * extent and abs(y - oy) < 2 * extent for ox, oy, _, _ in occupied):
+            continue
+        occupied.append(box)
+
+        change_type = 'added' if len(truth) < inserted else 'removed'
+        # Added objects are brighter than the scene and removed ones darker,
+        # which is how the change classifier tells them apart
+        target, color = (current, (250, 250, 250)) if change_type == 'added' else (baseline, (5, 5, 5))
+        cv2.rectangle(target, (x, y), (x + extent - 1, y + extent - 1), color, -1)
+        truth.append((change_type, box))
+
+    H = np.eye(3)
+    if camera_shift:
+        H = random_homography(rng, size, max_shift=camera_shift, max_rotation=camera_shift * 50,
+                              max_scale=0, max_perspective=0)
+        current = warp(current, H)
+
+    return baseline, current, H, truth
@@ -0,0 +1,300 @@
+"""
+Stage by stage and end-to-end benchmark of the scan comparison pipeline.
+
+Each scenario is a set of synthetic scene pairs (benchmarks.fixtures
+.scene_pair) with known added and removed objects, at a given resolution,
+amount of clutter and camera shift. For every pair the baseline is prepared
+once, as the baseline cache does, and each stage a comparison pays is timed
+separately: decoding the upload, preprocess_image, align_to_baseline
+(without a homography hint, so shifted scenes pay a full estimate),
+detect_changes and detect_objects. The whole /api/scan/compare route is
+then timed through the Flask test client.
+
+Reported per scenario and stage: p50 and p95 latency and the peak memory
+traced by tracemalloc (measured in a separate pass, as tracing slows the
+code down). Detection accuracy is the precision and recall of the detected
+boxes against the ground truth, matched at IoU >= 0.3.
+
+Results can be saved as JSON and later compared with, for example:
+
+    python -m benchmarks.pipeline --save before.json
+    python -m benchmarks.pipeline --compare before.json
+
+The comparison exits with status 1 when a p50 latency grows by more than
+--tolerance or a score drops by more than 0.05.
+
+--tile-size and --tile-threads run preprocessing and detection tiled (see
+utils.tiling), in the stage timings and through the app alike, e.g.:
+
+    python -m benchmarks.pipeline --save serial.json
+    python -m benchmarks.pipeline --tile-size 256 --tile-threads 8 --compare serial.json
+"""
+import argparse
+import io
+import os
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.common import use_temporary_instance, load_app
+from benchmarks.fixtures import scene_pair
+
+# (name, (width, height), clutter, camera shift)
+SCENARIOS = [
+    ('vga-static', (640, 480), 40, 0.0),
+    ('hd-static', (1280, 720), 80, 0.0),
+    ('hd-shifted', (1280, 720), 80, 0.01),
+    ('hd-cluttered', (1280, 720), 240, 0.0),
+    ('fhd-shifted', (1920, 1080), 120, 0.01),
+]
+
+STAGES = ('decode', 'preprocess', 'align', 'detect', 'objects', 'end_to_end')
+
+def percentile(values, q):
+    """q-th percentile of a list of numbers"""
+    return float(np.percentile(values, q)) if values else float('nan')
+
+def match_accuracy(changes, truth, scale, iou_threshold=0.3):
+    """
+    Precision and recall of detected changes against ground truth boxes
+
+    Args:
+        changes: Changes returned by detect_changes
+        truth: Ground truth (type, box) list in original image coordinates
+        scale: Factor from original to preprocessed image coordinates
+        iou_threshold: Overlap counting a detection as a hit
+
+    Returns:
+        Tuple of true positives, detections and ground truth objects
+    """
+    from utils.region_tracker import box_iou
+
+    truth_boxes = [tuple(v * scale for v in box) for _, box in truth]
+    matched = set()
+    for change in changes:
+        box = (change['x'], change['y'], change['width'], change['height'])
+        for index, truth_box in enumerate(truth_boxes):
+            if index not in matched and box_iou(box, truth_box) >= iou_threshold:
+                matched.add(index)
+                break
+    return len(matched), len(changes), len(truth_boxes)
+
+def make_fixtures(scenario, count):
+    """Encoded scene pairs and ground truth of a scenario"""
+    from utils.pipeline import encode_image
+
+    _, size, clutter, shift = scenario
+    fixtures = []
+    for seed in range(count):
+        baseline, current, _, truth = scene_pair(seed, size, clutter, camera_shift=shift)
+        fixtures.append({
+            'baseline': baseline,
+            'baseline_png': encode_image(baseline, 'png'),
+            'current_jpeg': encode_image(current, 'jpeg', 92),
+            'truth': truth
+        })
+    return fixtures
+
+def run_stages(features, current_jpeg, tiling=None):
+    """Run the comparison stages once, returning their timings and the changes"""
+    from utils.pipeline import load_image_array
+    from utils.image_processor import preprocess_image, align_to_baseline
+    from utils.change_detector import detect_changes
+    from utils.object_detector import detect_objects
+
+    timings = {}
+
+    def timed(stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        timings[stage] = (time.perf_counter() - start) * 1000
+        return result
+
+    array = timed('decode', load_image_array, current_jpeg)
+    processed = timed('preprocess', preprocess_image, array, tiling=tiling)
+    aligned, _, _ = timed('align', align_to_baseline, features, processed)
+    changes, _, _ = timed('detect', detect_changes, features.image, processed, render=False, aligned_current=aligned,
+                          tiling=tiling)
+    timed('objects', detect_objects, processed, changes)
+    return timings, changes
+
+def peak_memory(fn, *args, **kwargs):
+    """Peak memory in MiB traced while running fn once"""
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+def benchmark_scenario(client, scenario, args):
+    """Measure one scenario, returning its summary"""
+    from routes import image_store, stored_image_fields
+    from persistence import create_scan
+    from utils.pipeline import load_image_array
+    from utils.image_processor import prepare_baseline, preprocess_image, align_to_baseline
+    from utils.change_detector import detect_changes
+    from utils.object_detector import detect_objects
+    from utils.tiling import Tiling
+
+    tiling = Tiling(args.tile_size, args.tile_threads) if args.tile_size else None
+    fixtures = make_fixtures(scenario, args.fixtures)
+    latencies = {stage: [] for stage in STAGES}
+    memory = {stage: 0.0 for stage in STAGES}
+    hits = detections = objects = 0
+
+    for fixture in fixtures:
+        features = prepare_baseline(fixture['baseline'], args.backend, None)
+        scale = features.image.shape[1] / fixture['baseline'].shape[1]
+
+        for _ in range(args.repeat):
+            timings, changes = run_stages(features, fixture['current_jpeg'], tiling)
+            for stage, elapsed in timings.items():
+                latencies[stage].append(elapsed)
+
+        found, detected, expected = match_accuracy(changes, fixture['truth'], scale)
+        hits, detections, objects = hits + found, detections + detected, objects + expected
+
+        baseline_scan = create_scan(stored_image_fields(image_store.put(fixture['baseline_png'])),
+                                    {'location': scenario[0]}, is_baseline=True)
+        for attempt in range(args.repeat + 1):
+            start = time.perf_counter()
+            response = client.post('/api/scan/compare', data={
+                'baseline_id': str(baseline_scan.id),
+                'alignment_backend': args.backend,
+                'current_image': (io.BytesIO(fixture['current_jpeg']), 'current.jpg')
+            }, content_type='multipart/form-data')
+            elapsed = (time.perf_counter() - start) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(f'/api/scan/compare failed: {response.get_json()}')
+            # The first request also prepares and caches the baseline
+            if attempt:
+                latencies['end_to_end'].append(elapsed)
+
+        memory['end_to_end'] = max(memory['end_to_end'], peak_memory(
+            client.post, '/api/scan/compare', data={
+                'baseline_id': str(baseline_scan.id),
+                'alignment_backend': args.backend,
+                'current_image': (io.BytesIO(fixture['current_jpeg']), 'current.jpg')
+            }, content_type='multipart/form-data'
+        ))
+
+        # Per stage memory: trace one more pass, one stage at a time
+        array = load_image_array(fixture['current_jpeg'])
+        processed = preprocess_image(array, tiling=tiling)
+        aligned, _, _ = align_to_baseline(features, processed)
+        stage_calls = {
+            'decode': (load_image_array, (fixture['current_jpeg'],), {}),
+            'preprocess': (preprocess_image, (array,), {'tiling': tiling}),
+            'align': (align_to_baseline, (features, processed), {}),
+            'detect': (detect_changes, (features.image, processed),
+                       {'render': False, 'aligned_current': aligned, 'tiling': tiling}),
+            'objects': (detect_objects, (processed, changes), {})
+        }
+        for stage, (fn, fn_args, fn_kwargs) in stage_calls.items():
+            memory[stage] = max(memory[stage], peak_memory(fn, *fn_args, **fn_kwargs))
+
+    return {
+        'stages': {stage: {
+            'p50_ms': percentile(latencies[stage], 50),
+            'p95_ms': percentile(latencies[stage], 95),
+            'peak_mib': memory[stage]
+        } for stage in STAGES},
+        'precision': hits / detections if detections else 0.0,
+        'recall': hits / objects if objects else 0.0
+    }
+
+def print_results(results):
+    print(f"{'scenario':>13} {'stage':>11} {'p50 ms':>8} {'p95 ms':>8} {'peak MiB':>9}")
+    for name, summary in results['scenarios'].items():
+        for stage, stats in summary['stages'].items():
+            print(f"{name:>13} {stage:>11} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['peak_mib']:>9.1f}")
+        print(f"{name:>13} {'accuracy':>11} precision {summary['precision']:.2f}, recall {summary['recall']:.2f}")
+
+def compare_results(results, saved, tolerance):
+    """
+    Print the differences with saved results
+
+    Returns:
+        List of regressions found
+    """
+    regressions = []
+    print(f"\n{'scenario':>13} {'metric':>18} {'saved':>9} {'now':>9} {'change':>8}")
+    for name, summary in results['scenarios'].items():
+        previous = saved['scenarios'].get(name)
+        if previous is None:
+            continue
+
+        for stage, stats in summary['stages'].items():
+            before, now = previous['stages'][stage]['p50_ms'], stats['p50_ms']
+            change = (now - before) / before if before else 0.0
+            flag = ''
+            if change > tolerance:
+                flag = '  REGRESSION'
+                regressions.append(f'{name} {stage} p50')
+            print(f"{name:>13} {stage + ' p50 ms':>18} {before:>9.2f} {now:>9.2f} {change:>+8.0%}{flag}")
+
+        for score in ('precision', 'recall'):
+            before, now = previous[score], summary[score]
+            flag = ''
+            if now < before - 0.05:
+                flag = '  REGRESSION'
+                regressions.append(f'{name} {score}')
+            print(f"{name:>13} {score:>18} {before:>9.2f} {now:>9.2f} {now - before:>+8.2f}{flag}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=None,
+                        help=f"Scenarios to run (default: all of {', '.join(s[0] for s in SCENARIOS)})")
+    parser.add_argument('--fixtures', type=int, default=3, help='Scene pairs per scenario')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per scene pair')
+    parser.add_argument('--backend', default='sift-bf')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with results saved by --save')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Accepted relative p50 slowdown')
+    parser.add_argument('--tile-size', type=int, default=0, help='Tile side in pixels (0 runs untiled)')
+    parser.add_argument('--tile-threads', type=int, default=os.cpu_count() or 1, help='Threads per tiled comparison')
+    args = parser.parse_args()
+
+    # Run comparisons inline so the timings don't include process hops
+    os.environ.setdefault("COMPUTE_WORKERS", "0")
+    os.environ["TILE_SIZE"] = str(args.tile_size)
+    os.environ["TILE_THREADS"] = str(args.tile_threads)
+    use_temporary_instance()
+    app = load_app()
+
+    scenarios = [s for s in SCENARIOS if args.scenarios is None or s[0] in args.scenarios]
+    client = app.test_client()
+    results = {
+        'backend': args.backend,
+        'fixtures': args.fixtures,
+        'repeat': args.repeat,
+        'tiling': [args.tile_size, args.tile_threads] if args.tile_size else None,
+        'scenarios': {}
+    }
+    with app.app_context():
+        for scenario in scenarios:
+            results['scenarios'][scenario[0]] = benchmark_scenario(client, scenario, args)
+
+    print_results(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        regressions = compare_results(results, saved, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Cold start of a web worker: the time from a fresh interpreter to its first
+responses.
+
+Every run starts a new Python process against the same (already migrated)
+database, as an autoscaled instance booting next to an existing deployment
+would, and measures:
+
+- import: importing main, which sets up the app
+- first page: the first GET / through the test client
+- first API call: a plain JSON endpoint (/api/scans)
+- first compare: the first /api/scan/compare, including loading the vision
+  stack when nothing preloaded it and preparing the baseline
+
+Modes: "lazy" starts the worker as is; "preload" first calls
+routes.preload_vision() as the gunicorn master does with --preload, and
+reports that time separately (workers forked afterwards don't pay it).
+
+With --baseline-ref, the tree of a git revision is extracted to a temporary
+directory and measured the same way, e.g.:
+
+    python -m benchmarks.startup --baseline-ref HEAD~1
+"""
+import argparse
+import io
+import os
+import json
+import subprocess
+import statistics
+import sys
+import tarfile
+import tempfile
+
+from benchmarks.common import use_temporary_instance, load_app
+from benchmarks.fixtures import scene_pair
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the measured process; prints the timings (ms) as JSON
+CHILD = r'''
+import json, os, sys, time
+start = time.perf_counter()
+timings = {}
+
+def mark(name, since):
+    now = time.perf_counter()
+    timings[name] = (now - since) * 1000
+    return now
+
+import main
+app = main.app
+now = mark('import', start)
+
+if os.environ['STARTUP_MODE'] == 'preload':
+    from routes import preload_vision
+    preload_vision()
+    now = mark('preload', now)
+
+client = app.test_client()
+response = client.get('/')
+assert response.status_code == 200, response.status_code
+now = mark('first_page', now)
+timings['to_first_page'] = (now - start) * 1000
+timings['vision_loaded'] = 'cv2' in sys.modules
+
+response = client.get('/api/scans?limit=1')
+assert response.status_code == 200, response.status_code
+now = mark('first_api', now)
+
+with open(os.environ['STARTUP_IMAGE'], 'rb') as f:
+    response = client.post('/api/scan/compare', data={
+        'baseline_id': os.environ['STARTUP_BASELINE_ID'],
+        'current_image': (f, 'current.jpg')
+    }, content_type='multipart/form-data')
+assert response.status_code == 200, response.get_json()
+mark('first_compare', now)
+
+print(json.dumps(timings))
+'''
+
+STAGES = ('import', 'preload', 'first_page', 'to_first_page', 'first_api', 'first_compare')
+
+def measure(tree, mode, env):
+    """Run one cold start in tree, returning its timings"""
+    env = dict(env, STARTUP_MODE=mode, PYTHONPATH=tree)
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD], cwd=tree, env=env, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def extract_tree(ref):
+    """Extract the tree of a git revision into a temporary directory"""
+    target = tempfile.mkdtemp(prefix='spacescanner-startup-')
+    archive = subprocess.run(['git', 'archive', ref], cwd=ROOT, check=True, stdout=subprocess.PIPE).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target)
+    return target
+
+def prepare_instance():
+    """Migrate the temporary database and store a baseline and a current image"""
+    from routes import image_store, stored_image_fields
+    from persistence import create_scan
+    from utils.pipeline import encode_image
+
+    app = load_app()
+    baseline, current, _, _ = scene_pair(0, (1280, 720), 80)
+    with app.app_context():
+        scan = create_scan(stored_image_fields(image_store.put(encode_image(baseline, 'png'))),
+                           {'location': 'startup'}, is_baseline=True)
+        baseline_id = scan.id
+
+    image_path = os.path.join(tempfile.mkdtemp(prefix='spacescanner-startup-'), 'current.jpg')
+    with open(image_path, 'wb') as f:
+        f.write(encode_image(current, 'jpeg', 92))
+    return baseline_id, image_path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Cold starts per tree and mode')
+    parser.add_argument('--baseline-ref', help='Also measure the tree of this git revision')
+    args = parser.parse_args()
+
+    # Run comparisons inline so first compare doesn't include starting the pool
+    os.environ.setdefault("COMPUTE_WORKERS", "0")
+    use_temporary_instance()
+    baseline_id, image_path = prepare_instance()
+    env = dict(os.environ, STARTUP_BASELINE_ID=str(baseline_id), STARTUP_IMAGE=image_path)
+
+    trees = [('current', ROOT, ('lazy', 'preload'))]
+    if args.baseline_ref:
+        # Older trees load everything on import, so preloading means nothing there
+        trees.insert(0, (args.baseline_ref, extract_tree(args.baseline_ref), ('lazy',)))
+
+    print(f"{'tree':>10} {'mode':>8} " + ' '.join(f'{stage:>13}' for stage in STAGES) + '  vision at first page')
+    for name, tree, modes in trees:
+        for mode in modes:
+            runs = [measure(tree, mode, env) for _ in range(args.repeat)]
+            medians = [statistics.median(run[stage] for run in runs) if stage in runs[0] else None
+                       for stage in STAGES]
+            cells = ' '.join(f'{value:>13.1f}' if value is not None else f"{'-':>13}" for value in medians)
+            loaded = 'loaded' if runs[0]['vision_loaded'] else 'not loaded'
+            print(f"{name:>10} {mode:>8} {cells}  {loaded}")
+    print('\nMedian milliseconds; to_first_page counts from the first line of the process')
+
+if __name__ == '__main__':
+    main()
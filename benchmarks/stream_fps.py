@@ -0,0 +1,64 @@
+"""
+Sustained frame rate of the streaming detector (running background, frame
+to frame homography reuse, persistence filter) against comparing every
+frame with the baseline from scratch (full alignment and detect_changes).
+
+Frames are the baseline scene slowly brightening, with sensor noise, a
+short-lived passer-by and an object that appears halfway and stays.
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.common import use_temporary_instance
+from benchmarks.fixtures import textured_scene
+
+def make_frames(baseline, count, seed=0):
+    """Synthetic RGB frames of a fixed camera watching the baseline scene"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        frame = baseline.astype(np.float32) * (1 + 0.002 * i)
+        if count // 4 <= i < count // 4 + 3:
+            x = 50 + 40 * (i - count // 4)
+            cv2.rectangle(frame, (x, 300), (x + 60, 400), (10, 10, 10), -1)
+        if i >= count // 2:
+            cv2.circle(frame, (500, 200), 50, (250, 250, 250), -1)
+        frames.append(np.clip(frame + rng.normal(0, 2, frame.shape), 0, 255).astype(np.uint8))
+    return frames
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--persistence', type=int, default=5)
+    parser.add_argument('--backend', default='sift-bf')
+    args = parser.parse_args()
+
+    use_temporary_instance()
+    from utils.image_processor import prepare_baseline, preprocess_image
+    from utils.change_detector import detect_changes
+    from utils.stream_detector import StreamDetector
+
+    baseline = textured_scene(0)
+    features = prepare_baseline(baseline, args.backend, None)
+    frames = make_frames(baseline, args.frames)
+
+    start = time.perf_counter()
+    reported = 0
+    for frame in frames:
+        changes, _, _ = detect_changes(features.image, preprocess_image(frame), baseline_features=features,
+                                       render=False)
+        reported += len(changes)
+    per_frame = time.perf_counter() - start
+    print(f"{'per-frame':>10} {len(frames) / per_frame:>8.1f} fps {reported:>6} changes reported")
+
+    detector = StreamDetector(features, persistence=args.persistence)
+    start = time.perf_counter()
+    reported = sum(len(changes) for _, _, _, changes in detector.run(enumerate(frames)))
+    streaming = time.perf_counter() - start
+    print(f"{'streaming':>10} {len(frames) / streaming:>8.1f} fps {reported:>6} changes reported")
+
+if __name__ == '__main__':
+    main()
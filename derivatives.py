@@ -0,0 +1,144 @@
+import os
+import time
+import queue
+import threading
+import logging
+
+import click
+from sqlalchemy import or_
+
+from app import app, db
+from models import Scan
+from utils.compute_executor import ExecutorSaturated
+
+logger = logging.getLogger(__name__)
+
+# Downscaled copies kept for each scan, by Scan column prefix
+DERIVATIVES = ('thumbnail', 'preview')
+
+def has_derivatives(scan):
+    """Check whether a scan's thumbnail and preview were generated"""
+    return all(getattr(scan, f'{kind}_hash') for kind in DERIVATIVES)
+
+def store_derivatives(scan, store, run):
+    """
+    Generate a scan's thumbnail and preview and record them on the scan
+
+    The caller commits the session.
+
+    Args:
+        scan: Scan whose image is downscaled
+        store: ImageStore holding the scan images
+        run: Callable running fn(*args) and returning its result, e.g. on the
+            compute pool
+    """
+    source = store.path_for(scan.image_hash) if scan.image_hash else scan.image_data
+    if source is None:
+        raise ValueError(f'Scan {scan.id} has no image')
+
+    # Imported here so the app starts without loading the vision stack
+    from utils.pipeline import generate_derivatives
+
+    sizes = {kind: app.config[f'{kind.upper()}_SIZE'] for kind in DERIVATIVES}
+    for kind, data in run(generate_derivatives, source, sizes).items():
+        setattr(scan, f'{kind}_hash', store.put(data))
+
+def backfill_derivatives(store, run, batch_size=20):
+    """
+    Generate the missing derivatives of every scan
+
+    Scans are visited once in ID order; a scan whose image cannot be
+    downscaled is logged and skipped.
+
+    Args:
+        store: ImageStore holding the scan images
+        run: Callable running fn(*args) and returning its result
+        batch_size: Scans processed per transaction
+
+    Returns:
+        Number of scans given derivatives
+    """
+    generated = last_id = 0
+    while True:
+        scans = (Scan.query
+                 .filter(Scan.id > last_id, or_(*(getattr(Scan, f'{kind}_hash').is_(None) for kind in DERIVATIVES)))
+                 .order_by(Scan.id)
+                 .limit(batch_size)
+                 .all())
+        if not scans:
+            break
+
+        for scan in scans:
+            last_id = scan.id
+            try:
+                store_derivatives(scan, store, run)
+                generated += 1
+            except Exception as e:
+                logger.error(f"Error generating derivatives of scan {scan.id}: {str(e)}")
+
+        db.session.commit()
+        logger.info(f"Generated derivatives of {generated} scans")
+
+    return generated
+
+class DerivativeWorker:
+    """
+    Background thread generating the derivatives of newly saved scans.
+
+    Scans are queued in the process that saved them. The queue is not
+    persisted: derivatives missed by a restart are generated when first
+    requested, or in bulk by the backfill-thumbnails command.
+    """
+
+    def __init__(self, retry_interval=1.0):
+        self.retry_interval = retry_interval
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """Start the worker thread once per process"""
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            # Threads don't survive a fork, so track the owning process
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='derivative-worker', daemon=True).start()
+
+    def enqueue(self, scan_id):
+        """Queue a saved scan for derivative generation"""
+        self.start()
+        self._queue.put(scan_id)
+
+    def _run(self):
+        # Imported here because routes imports this module
+        from routes import image_store, run_compute
+
+        while True:
+            scan_id = self._queue.get()
+            try:
+                with app.app_context():
+                    scan = db.session.get(Scan, scan_id)
+                    if scan and not has_derivatives(scan):
+                        store_derivatives(scan, image_store, run_compute)
+                        db.session.commit()
+            except ExecutorSaturated:
+                # Derivatives yield to comparisons; try again once the pool drains
+                time.sleep(self.retry_interval)
+                self._queue.put(scan_id)
+            except Exception as e:
+                logger.error(f"Error generating derivatives of scan {scan_id}: {str(e)}")
+
+derivative_worker = DerivativeWorker()
+
+@app.cli.command('backfill-thumbnails')
+@click.option('--batch-size', default=20, help='Scans processed per transaction')
+def backfill_thumbnails_command(batch_size):
+    """Generate the thumbnails and previews of existing scans"""
+    from routes import image_store
+
+    generated = backfill_derivatives(image_store, lambda fn, *args: fn(*args), batch_size=batch_size)
+    click.echo(f'Generated derivatives of {generated} scans')
@@ -0,0 +1,28 @@
+"""
+gunicorn hooks, read from the working directory by `gunicorn main:app`.
+
+The app no longer upgrades the database schema on import, so the master
+does it once before any worker starts. Deployments run with --preload: the
+master then also imports the vision stack, and workers fork with it loaded
+instead of each importing it on its first comparison.
+"""
+import sys
+import subprocess
+
+def on_starting(server):
+    """Upgrade the schema, and preload the vision stack when the app is preloaded"""
+    if not server.cfg.preload_app:
+        # Keep the app out of the master so --reload picks up code changes
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'upgrade-db'], check=True)
+        return
+
+    from app import db
+    from migrations import upgrade_database
+    from routes import preload_vision
+
+    with server.app.wsgi().app_context():
+        upgrade_database()
+        # Workers must open their own connections rather than share these
+        db.engine.dispose()
+
+    preload_vision()
@@ -0,0 +1,127 @@
+import logging
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
+
+import click
+from sqlalchemy.orm import aliased
+
+from app import app, db
+from models import Scan, ChangeLog, Comparison
+
+logger = logging.getLogger(__name__)
+
+# Largest side of the images changes are found on in the standard detection
+# mode (preprocess_image's max_dim); pyramid mode reports original pixels
+STANDARD_MAX_DIM = 800
+
+@lru_cache(maxsize=None)
+def heatmap_store():
+    """The process's HeatmapStore, opened on first use"""
+    # Imported here so starting the app doesn't load NumPy
+    from utils.heatmap import HeatmapStore
+
+    return HeatmapStore(
+        app.config["HEATMAP_PATH"],
+        grid_size=app.config["HEATMAP_GRID_SIZE"],
+        bucket_seconds=app.config["HEATMAP_BUCKET_SECONDS"],
+        buckets=app.config["HEATMAP_BUCKETS"]
+    )
+
+def epoch_seconds(timestamp):
+    """Seconds since the epoch of a naive UTC datetime (as stored by the models)"""
+    return (timestamp - datetime(1970, 1, 1)).total_seconds()
+
+def change_frame_size(image_width, image_height, detection_mode='standard'):
+    """
+    Width and height of the frame a comparison's change boxes refer to
+
+    Changes are found on the current image aligned with the baseline, so
+    the dimensions passed are the baseline's.
+    """
+    if detection_mode != 'pyramid' and max(image_width, image_height) > STANDARD_MAX_DIM:
+        scale = STANDARD_MAX_DIM / max(image_width, image_height)
+        return int(image_width * scale), int(image_height * scale)
+    return image_width, image_height
+
+def update_location_heatmap(location, changes_per_batch=1000):
+    """
+    Add a location's changes not yet applied to its heatmap
+
+    The heatmap records the last ChangeLog id applied to it and every later
+    change of the location is read, in id order, so each change counts once
+    and an update that failed is caught up by the next one; the first call
+    for a location also applies its existing history. Boxes are placed in
+    the frame of the baseline the scan was aligned with, whatever the
+    scan's own resolution; changes whose baseline has no dimensions can't
+    be placed and are passed over.
+
+    The mark assumes ids grow in commit order, as with SQLite's serialized
+    writes; where concurrent transactions draw ids from a sequence, a
+    change committed after a later id was applied is missed until
+    rebuild-heatmaps is run.
+
+    Args:
+        location: Scan location
+        changes_per_batch: ChangeLog rows read per query
+
+    Returns:
+        Number of changes recorded
+    """
+    baseline = aliased(Scan)
+    recorded = 0
+    with heatmap_store().updating(location) as heatmap:
+        while True:
+            changes = db.session.query(ChangeLog.id, ChangeLog.scan_id, ChangeLog.position_x, ChangeLog.position_y,
+                                       ChangeLog.size_w, ChangeLog.size_h, ChangeLog.timestamp,
+                                       baseline.image_width, baseline.image_height, Comparison.detection_mode) \
+                .join(Scan, ChangeLog.scan_id == Scan.id) \
+                .join(baseline, ChangeLog.baseline_id == baseline.id) \
+                .outerjoin(Comparison, Comparison.scan_id == Scan.id) \
+                .filter(Scan.location == location, ChangeLog.id > heatmap.applied) \
+                .order_by(ChangeLog.id).limit(changes_per_batch).all()
+            if not changes:
+                return recorded
+
+            # A scan's changes share their frame and timestamp
+            for _, rows in groupby(changes, key=lambda change: change.scan_id):
+                rows = list(rows)
+                first = rows[0]
+                if first.image_width and first.image_height:
+                    width, height = change_frame_size(first.image_width, first.image_height,
+                                                      first.detection_mode or 'standard')
+                    heatmap.add(
+                        [(row.position_x / width, row.position_y / height,
+                          (row.position_x + row.size_w) / width, (row.position_y + row.size_h) / height)
+                         for row in rows],
+                        epoch_seconds(first.timestamp)
+                    )
+                    recorded += len(rows)
+                heatmap.applied = rows[-1].id
+
+def rebuild_location_heatmap(location):
+    """
+    Rebuild a location's heatmap from its ChangeLog rows
+
+    Heatmaps are kept up to date as comparisons are saved; this rereads the
+    whole history, after the heatmap settings changed or to recover changes
+    the high-water mark passed over.
+
+    Returns:
+        Number of changes recorded
+    """
+    heatmap_store().reset(location)
+    return update_location_heatmap(location)
+
+@app.cli.command('rebuild-heatmaps')
+@click.option('--location', default=None, help='Location to rebuild (default: every location with changes)')
+def rebuild_heatmaps_command(location):
+    """Rebuild the change heatmaps of locations from their change history"""
+    if location:
+        locations = [location]
+    else:
+        locations = [value for (value,) in db.session.query(Scan.location).distinct()
+                     .filter(Scan.id.in_(db.session.query(ChangeLog.scan_id)))]
+
+    for value in filter(None, locations):
+        click.echo(f'{value}: {rebuild_location_heatmap(value)} changes')
@@ -0,0 +1,209 @@
+import os
+import json
+import uuid
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, or_, and_
+
+from app import app, db
+from models import CompareJob, Scan, Comparison
+from utils.compute_executor import ExecutorSaturated
+from persistence import save_comparison
+
+logger = logging.getLogger(__name__)
+
+def enqueue_compare_job(baseline_id, image_hash, options):
+    """
+    Queue a comparison for the background worker
+
+    Args:
+        baseline_id: ID of the baseline scan
+        image_hash: ImageStore hash of the current image
+        options: Request options (save_scan, name, description, location, session_id)
+
+    Returns:
+        The new CompareJob
+    """
+    job = CompareJob(
+        id=uuid.uuid4().hex,
+        baseline_id=baseline_id,
+        image_hash=image_hash,
+        options=json.dumps(options)
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    job_worker.notify()
+    return job
+
+def _claimable():
+    """Jobs that are pending, or running but abandoned by a dead worker"""
+    lease_cutoff = datetime.utcnow() - timedelta(seconds=app.config["COMPARE_JOB_LEASE"])
+    return or_(
+        CompareJob.status == 'pending',
+        and_(CompareJob.status == 'running', CompareJob.started_at < lease_cutoff)
+    )
+
+def claim_next_job():
+    """
+    Atomically claim the oldest claimable job
+
+    Returns:
+        The claimed CompareJob, or None if the queue is empty
+    """
+    candidates = (db.session.query(CompareJob.id)
+                  .filter(_claimable())
+                  .order_by(CompareJob.created_at)
+                  .limit(5)
+                  .all())
+
+    for (job_id,) in candidates:
+        # Only one worker can move the job to running
+        claimed = db.session.execute(
+            update(CompareJob)
+            .where(CompareJob.id == job_id, _claimable())
+            .values(status='running', started_at=datetime.utcnow(), attempts=CompareJob.attempts + 1)
+        )
+        db.session.commit()
+        if claimed.rowcount == 1:
+            return db.session.get(CompareJob, job_id)
+
+    return None
+
+def _finish_job(job, status, result=None, error=None):
+    job.status = status
+    job.result = json.dumps(result) if result is not None else None
+    job.error = error[:255] if error else None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+def _saved_result(job):
+    """Result of a job whose comparison was saved before its worker stopped"""
+    comparison = db.session.get(Comparison, job.comparison_id)
+    return dict(json.loads(job.result), scan_id=comparison.scan_id, comparison_id=comparison.id)
+
+def run_job(job):
+    """
+    Run a claimed comparison job and record its outcome
+
+    The comparison is saved together with the job's comparison_id and
+    result, so a job re-claimed after its worker died between saving and
+    finishing is finished from the saved comparison instead of being saved
+    twice.
+    """
+    # Imported here because routes imports this module
+    from routes import compare_with_baseline, stored_image_fields, parse_bool
+
+    if job.comparison_id is not None:
+        _finish_job(job, 'completed', result=_saved_result(job))
+        return
+
+    if job.attempts > app.config["COMPARE_JOB_MAX_ATTEMPTS"]:
+        _finish_job(job, 'failed', error='Too many attempts')
+        return
+
+    try:
+        options = json.loads(job.options or '{}')
+        baseline_scan = db.session.get(Scan, job.baseline_id)
+        if not baseline_scan:
+            _finish_job(job, 'failed', error='Baseline scan not found')
+            return
+
+        result = compare_with_baseline(baseline_scan, job.image_hash, options)
+
+        image_fields = None
+        if parse_bool(options.get('save_scan', False)):
+            image_fields = stored_image_fields(result['image_hash'])
+
+        # Committed along with the comparison, see _saved_result
+        job.result = json.dumps({
+            'changes': result['changes'],
+            'objects': result['objects'],
+            'change_count': len(result['changes']),
+            'alignment': result['alignment'],
+            'detection_mode': result['detection_mode'],
+            'prescreen': result['prescreen']
+        })
+        save_comparison(
+            baseline_scan,
+            result['image_hash'],
+            result['changes'],
+            result['objects'],
+            options,
+            image_fields=image_fields,
+            detection_mode=result['detection_mode'],
+            prescreen=result['prescreen'],
+            job=job
+        )
+
+        _finish_job(job, 'completed', result=_saved_result(job))
+
+    except ExecutorSaturated:
+        # Give the job back and let the pool drain before retrying
+        db.session.rollback()
+        job.status = 'pending'
+        job.attempts -= 1
+        db.session.commit()
+        time.sleep(app.config["COMPARE_JOB_POLL_INTERVAL"])
+
+    except Exception as e:
+        logger.error(f"Error running compare job {job.id}: {str(e)}")
+        db.session.rollback()
+        _finish_job(job, 'failed', error=str(e))
+
+class JobWorker:
+    """
+    Background threads draining the compare job queue.
+
+    Jobs live in the database, so anything queued or interrupted survives a
+    restart: a job left running by a dead process is claimed again once its
+    lease expires.
+    """
+
+    def __init__(self, threads=1, poll_interval=1.0):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """Start the worker threads once per process"""
+        if self._pid == os.getpid() or self.threads <= 0:
+            return
+
+        with self._lock:
+            # Threads don't survive a fork, so track the owning process
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.threads):
+                threading.Thread(target=self._run, name=f'compare-job-worker-{i}', daemon=True).start()
+            logger.debug(f"Started {self.threads} compare job worker threads")
+
+    def notify(self):
+        """Wake the workers after a job was queued"""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            job = None
+            try:
+                with app.app_context():
+                    job = claim_next_job()
+                    if job:
+                        run_job(job)
+            except Exception as e:
+                logger.error(f"Error in compare job worker: {str(e)}")
+
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+job_worker = JobWorker(
+    threads=app.config["COMPARE_JOB_THREADS"],
+    poll_interval=app.config["COMPARE_JOB_POLL_INTERVAL"]
+)
@@ -1,4 +1,12 @@
-from app import app
+from app import create_app
+
+app = create_app()
 
 if __name__ == "__main__":
+    # The development server upgrades the schema itself; deployments run
+    # the upgrade-db command from gunicorn.conf.py
+    from migrations import upgrade_database
+    with app.app_context():
+        upgrade_database()
+
     app.run(host="0.0.0.0", port=5000, debug=True)
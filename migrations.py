@@ -0,0 +1,132 @@
+import io
+import logging
+
+import click
+from PIL import Image
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+from app import app, db
+
+logger = logging.getLogger(__name__)
+
+def upgrade_schema():
+    """
+    Bring an existing database in line with the models.
+
+    db.create_all() only creates missing tables, so this adds missing
+    columns and indexes and relaxes NOT NULL constraints that the models
+    no longer require.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column['name']: column for column in inspector.get_columns(table.name)}
+        relaxed = [
+            column.name for column in table.columns
+            if column.name in existing and column.nullable
+            and not column.primary_key and not existing[column.name]['nullable']
+        ]
+
+        if relaxed and engine.dialect.name == 'sqlite':
+            # SQLite cannot drop a NOT NULL constraint in place
+            _rebuild_sqlite_table(table, existing)
+        else:
+            with engine.begin() as conn:
+                for name in relaxed:
+                    conn.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN {name} DROP NOT NULL'))
+                    logger.info(f"Relaxed NOT NULL on {table.name}.{name}")
+
+                for column in table.columns:
+                    if column.name not in existing:
+                        column_type = column.type.compile(dialect=engine.dialect)
+                        conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                        logger.info(f"Added column {table.name}.{column.name}")
+
+        existing_indexes = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=engine)
+                logger.info(f"Created index {index.name}")
+
+def _rebuild_sqlite_table(table, existing):
+    """Recreate a SQLite table from its model definition, keeping its rows"""
+    new_name = f'_{table.name}_new'
+    create_sql = str(CreateTable(table).compile(db.engine)).strip()
+    create_sql = create_sql.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {new_name} ', 1)
+    columns = ', '.join(column.name for column in table.columns if column.name in existing)
+
+    with db.engine.begin() as conn:
+        conn.execute(text(create_sql))
+        conn.execute(text(f'INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}'))
+        conn.execute(text(f'DROP TABLE {table.name}'))
+        conn.execute(text(f'ALTER TABLE {new_name} RENAME TO {table.name}'))
+
+    logger.info(f"Rebuilt table {table.name}")
+
+def upgrade_database():
+    """Create missing tables and upgrade the existing ones to the models"""
+    # The tables are known to db.metadata once the models are imported
+    import models
+    
+    db.create_all()
+    upgrade_schema()
+
+def migrate_images_to_store(store, batch_size=50):
+    """
+    Move legacy inline scan images into the ImageStore
+
+    Args:
+        store: ImageStore receiving the image files
+        batch_size: Number of scans migrated per transaction
+
+    Returns:
+        Number of scans migrated
+    """
+    from models import Scan
+
+    migrated = 0
+    while True:
+        scans = (Scan.query
+                 .filter(Scan.image_hash.is_(None), Scan.image_data.isnot(None))
+                 .options(db.undefer(Scan.image_data))
+                 .limit(batch_size)
+                 .all())
+        if not scans:
+            break
+
+        for scan in scans:
+            scan.image_hash = store.put(scan.image_data)
+            scan.image_size = len(scan.image_data)
+            scan.image_width, scan.image_height = Image.open(io.BytesIO(scan.image_data)).size
+            scan.image_data = None
+
+        db.session.commit()
+        migrated += len(scans)
+        logger.info(f"Migrated {migrated} scan images to the image store")
+
+    return migrated
+
+@app.cli.command('upgrade-db')
+def upgrade_database_command():
+    """Create or upgrade the database schema to match the models"""
+    upgrade_database()
+    click.echo('Database schema is up to date')
+
+@app.cli.command('migrate-images')
+@click.option('--vacuum/--no-vacuum', default=True, help='Reclaim database space afterwards (SQLite only)')
+def migrate_images_command(vacuum):
+    """Move scan images from the database into the on-disk image store"""
+    from routes import image_store
+
+    migrated = migrate_images_to_store(image_store)
+    click.echo(f'Migrated {migrated} scan images')
+
+    if vacuum and migrated and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text('VACUUM'))
+        click.echo('Database vacuumed')
@@ -6,7 +6,16 @@ class Scan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(255))
-    image_data = db.Column(db.LargeBinary, nullable=False)  # Store base64 encoded image
+    # Legacy inline image bytes; new scans keep their image in the ImageStore
+    image_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    image_hash = db.Column(db.String(64), index=True)  # SHA-256 of the image in the ImageStore
+    image_width = db.Column(db.Integer)
+    image_height = db.Column(db.Integer)
+    image_size = db.Column(db.Integer)  # Size of the encoded image in bytes
+    thumbnail_hash = db.Column(db.String(64))  # Downscaled JPEG derivatives in the ImageStore
+    preview_hash = db.Column(db.String(64))
+    # Low-resolution signature compared by the "no change" pre-screen, see utils.prescreen
+    signature = db.deferred(db.Column(db.LargeBinary))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     is_baseline = db.Column(db.Boolean, default=False)
     location = db.Column(db.String(100))
@@ -17,6 +26,13 @@ class Scan(db.Model):
                              backref='scan', 
                              lazy=True)
 
+    __table_args__ = (
+        # Baseline lists, and newest-first pages of all or one location's scans
+        db.Index('ix_scan_is_baseline_timestamp', 'is_baseline', 'timestamp'),
+        db.Index('ix_scan_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_scan_location_timestamp_id', 'location', 'timestamp', 'id'),
+    )
+
     def __repr__(self):
         return f'<Scan {self.name}>'
 
@@ -32,14 +48,55 @@ class ChangeLog(db.Model):
     position_y = db.Column(db.Integer)  # Y coordinate of change
     size_w = db.Column(db.Integer)  # Width of the changed region
     size_h = db.Column(db.Integer)  # Height of the changed region
+    track_id = db.Column(db.Integer, db.ForeignKey('change_track.id'), index=True)  # Region across scans
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Reference to baseline scan
     baseline = db.relationship('Scan', foreign_keys=[baseline_id], backref='compared_changes')
     
+    __table_args__ = (
+        # Changes of a scan or baseline, newest first
+        db.Index('ix_change_log_scan_id_id', 'scan_id', 'id'),
+        db.Index('ix_change_log_baseline_id_id', 'baseline_id', 'id'),
+    )
+    
     def __repr__(self):
         return f'<ChangeLog {self.id} - {self.change_type}>'
 
+class ChangeTrack(db.Model):
+    """Model for a changed region followed across the scans of a location"""
+    id = db.Column(db.Integer, primary_key=True)
+    location = db.Column(db.String(100), nullable=False, index=True)
+    # Box the region was last seen at
+    position_x = db.Column(db.Integer, nullable=False)
+    position_y = db.Column(db.Integer, nullable=False)
+    size_w = db.Column(db.Integer, nullable=False)
+    size_h = db.Column(db.Integer, nullable=False)
+    first_scan_id = db.Column(db.Integer, db.ForeignKey('scan.id'), nullable=False)
+    last_scan_id = db.Column(db.Integer, db.ForeignKey('scan.id'), nullable=False)
+    first_seen = db.Column(db.DateTime)
+    last_seen = db.Column(db.DateTime)
+    observations = db.Column(db.Integer, nullable=False, default=0)  # Number of ChangeLogs in the track
+    last_change_type = db.Column(db.String(20))
+    
+    changes = db.relationship('ChangeLog', backref='track', lazy=True)
+
+    __table_args__ = (
+        # Live tracks of a location, loaded by the time they were last seen
+        db.Index('ix_change_track_location_last_seen', 'location', 'last_seen'),
+    )
+    
+    def __repr__(self):
+        return f'<ChangeTrack {self.id} at {self.location}>'
+
+class TrackState(db.Model):
+    """Model for the version of a location's tracks, bumped by every update"""
+    location = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<TrackState {self.location} v{self.version}>'
+
 class ScanSession(db.Model):
     """Model for grouping scans in a session"""
     id = db.Column(db.Integer, primary_key=True)
@@ -50,11 +107,63 @@ class ScanSession(db.Model):
     # Relationship with Scans
     scans = db.relationship('Scan', secondary='session_scan', backref='sessions')
     
+    __table_args__ = (
+        db.Index('ix_scan_session_created_at_id', 'created_at', 'id'),
+    )
+    
     def __repr__(self):
         return f'<ScanSession {self.name}>'
 
 # Association table for many-to-many relationship between sessions and scans
 session_scan = db.Table('session_scan',
     db.Column('session_id', db.Integer, db.ForeignKey('scan_session.id'), primary_key=True),
-    db.Column('scan_id', db.Integer, db.ForeignKey('scan.id'), primary_key=True)
+    db.Column('scan_id', db.Integer, db.ForeignKey('scan.id'), primary_key=True),
+    # The primary key covers lookups by session; this covers the sessions of a scan
+    db.Index('ix_session_scan_scan_id', 'scan_id')
 )
+
+class Comparison(db.Model):
+    """Model for the result of comparing an image with a baseline"""
+    id = db.Column(db.Integer, primary_key=True)
+    baseline_id = db.Column(db.Integer, db.ForeignKey('scan.id'), nullable=False)
+    scan_id = db.Column(db.Integer, db.ForeignKey('scan.id'))  # Set when the compared image was saved
+    image_hash = db.Column(db.String(64), nullable=False, index=True)  # Compared image in the ImageStore
+    changes = db.Column(db.Text, nullable=False)  # JSON encoded list of changes
+    change_count = db.Column(db.Integer, nullable=False, default=0)
+    prescreen_distance = db.Column(db.Integer)  # Signature distance to the baseline, when pre-screened
+    detection_mode = db.Column(db.String(20), default='standard')  # "standard" or "pyramid" (full resolution boxes)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Comparison {self.id}>'
+
+class CompareJob(db.Model):
+    """Model for queued asynchronous comparisons"""
+    id = db.Column(db.String(32), primary_key=True)  # Random hex job ID
+    baseline_id = db.Column(db.Integer, db.ForeignKey('scan.id'), nullable=False)
+    image_hash = db.Column(db.String(64), nullable=False)  # Current image in the ImageStore
+    options = db.Column(db.Text)  # JSON encoded request options (save_scan, name, ...)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # "pending", "running", "completed", "failed"
+    result = db.Column(db.Text)  # JSON encoded comparison result
+    comparison_id = db.Column(db.Integer, db.ForeignKey('comparison.id'))  # Set in the transaction saving it
+    error = db.Column(db.String(255))
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<CompareJob {self.id} - {self.status}>'
+
+class LocationProfile(db.Model):
+    """Model for per-location processing settings"""
+    location = db.Column(db.String(100), primary_key=True)
+    alignment_backend = db.Column(db.String(20))  # Feature backend name, see utils.feature_backends
+    keypoint_budget = db.Column(db.Integer)  # Maximum keypoints per image (0 for unlimited)
+    detection_mode = db.Column(db.String(20))  # "standard" or "pyramid", see utils.pipeline
+    prescreen_max_distance = db.Column(db.Integer)  # Pre-screen bound, see PRESCREEN_MAX_DISTANCE
+    zones = db.Column(db.Text)  # Monitored zones as JSON, see utils.zones
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<LocationProfile {self.location}>'
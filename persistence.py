@@ -0,0 +1,166 @@
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app import db
+from models import Scan, ChangeLog, ScanSession, Comparison, session_scan
+from tracks import track_worker
+from heatmaps import update_location_heatmap
+from derivatives import derivative_worker
+
+logger = logging.getLogger(__name__)
+
+def change_log_rows(scan_id, baseline_id, changes, objects_detected):
+    """
+    Build ChangeLog column values for a batch of detected changes
+
+    Args:
+        scan_id: ID of the compared scan
+        baseline_id: ID of the baseline scan
+        changes: Changes returned by detect_changes
+        objects_detected: Objects returned by detect_objects
+
+    Returns:
+        List of dictionaries, one per change
+    """
+    now = datetime.utcnow()
+    return [{
+        'scan_id': scan_id,
+        'baseline_id': baseline_id,
+        'change_type': change['type'],
+        'object_type': objects_detected[i]['label'] if i < len(objects_detected) else 'unknown',
+        'confidence': objects_detected[i]['confidence'] if i < len(objects_detected) else 0.0,
+        'position_x': change['x'],
+        'position_y': change['y'],
+        'size_w': change['width'],
+        'size_h': change['height'],
+        'timestamp': now
+    } for i, change in enumerate(changes)]
+
+def _add_scan(image_fields, data, defaults):
+    """Add a scan and its session association to the current transaction"""
+    new_scan = Scan(
+        name=data.get('name', defaults['name']),
+        description=data.get('description', ''),
+        is_baseline=defaults['is_baseline'],
+        location=data.get('location', defaults['location']),
+        **image_fields
+    )
+    db.session.add(new_scan)
+    # Assign the scan ID without committing
+    db.session.flush()
+
+    session_id = data.get('session_id')
+    if session_id and db.session.get(ScanSession, session_id):
+        # Insert the association directly rather than loading session.scans
+        db.session.execute(insert(session_scan).values(session_id=session_id, scan_id=new_scan.id))
+
+    return new_scan
+
+def create_scan(image_fields, data, is_baseline=False):
+    """
+    Save a scan and its session association in a single transaction
+
+    Args:
+        image_fields: Scan column values describing the stored image
+        data: Request options (name, description, location, session_id)
+        is_baseline: Whether the scan is a baseline
+
+    Returns:
+        The new Scan
+    """
+    try:
+        new_scan = _add_scan(image_fields, data, {
+            'name': f"Scan {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            'is_baseline': is_baseline,
+            'location': 'Unknown'
+        })
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    derivative_worker.enqueue(new_scan.id)
+    return new_scan
+
+def save_comparison(baseline_scan, image_hash, changes, objects_detected, data, image_fields=None,
+                    detection_mode='standard', prescreen=None, job=None):
+    """
+    Save the outcome of a comparison in a single transaction
+
+    The Comparison row is always written. When image_fields is given the
+    compared image is also saved as a scan, associated with its session,
+    and every detected change is bulk inserted as a ChangeLog row; the new
+    changes are then added to the location's heatmap, and the scan and its
+    location are queued for thumbnail generation and region tracking.
+
+    Args:
+        baseline_scan: Baseline the image was compared with
+        image_hash: ImageStore hash of the compared image
+        changes: Changes returned by detect_changes
+        objects_detected: Objects returned by detect_objects
+        data: Request options (name, description, location, session_id)
+        image_fields: Scan column values for the image, or None to not save
+            the scan
+        detection_mode: Detection mode the changes were found with
+        prescreen: Pre-screen outcome of the comparison, or None if it
+            wasn't pre-screened
+        job: CompareJob the comparison was run for, if any; its
+            comparison_id (and any other pending change to it) is written
+            in the same transaction, so a re-claimed job can tell it was saved
+
+    Returns:
+        The new Comparison (scan_id is set when the scan was saved)
+    """
+    try:
+        scan_id = location = rows = None
+        if image_fields is not None:
+            new_scan = _add_scan(image_fields, data, {
+                'name': f"Comparison with {baseline_scan.name}",
+                'is_baseline': False,
+                'location': baseline_scan.location
+            })
+            scan_id = new_scan.id
+            location = new_scan.location
+
+            rows = change_log_rows(scan_id, baseline_scan.id, changes, objects_detected)
+            if rows:
+                # One executemany instead of an ORM flush per change
+                db.session.execute(insert(ChangeLog), rows)
+
+        comparison = Comparison(
+            baseline_id=baseline_scan.id,
+            scan_id=scan_id,
+            image_hash=image_hash,
+            changes=json.dumps(changes),
+            change_count=len(changes),
+            detection_mode=detection_mode,
+            prescreen_distance=prescreen['distance'] if prescreen else None
+        )
+        db.session.add(comparison)
+        if job is not None:
+            # Assign the comparison ID without committing
+            db.session.flush()
+            job.comparison_id = comparison.id
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if scan_id is not None:
+        derivative_worker.enqueue(scan_id)
+
+    if changes and location:
+        track_worker.enqueue(location)
+
+    if rows and location:
+        try:
+            update_location_heatmap(location)
+        except Exception as e:
+            # The heatmap catches up on the next update of the location
+            logger.error(f"Error updating the change heatmap of {location}: {str(e)}")
+
+    return comparison
@@ -1,21 +1,696 @@
-import os
+import time
 import base64
+import hashlib
 import json
 import io
+import zlib
 import logging
-from datetime import datetime
-from flask import render_template, request, jsonify, redirect, url_for, Response
-import numpy as np
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from concurrent.futures import wait, FIRST_COMPLETED
+from flask import (render_template, request, jsonify, url_for, Response, send_file,
+                   stream_with_context, g)
 from PIL import Image
+from sqlalchemy import event, func, or_, and_, update
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app import app, db
-from models import Scan, ChangeLog, ScanSession
-from utils.image_processor import preprocess_image
-from utils.change_detector import detect_changes
-from utils.object_detector import detect_objects
+from models import Scan, ChangeLog, ScanSession, Comparison, CompareJob, LocationProfile, ChangeTrack, session_scan
+from utils.feature_cache import BaselineFeatureStore
+from utils.image_store import ImageStore
+from utils.compute_executor import ComputeExecutor, ExecutorSaturated
+from utils.visualization_cache import VisualizationCache
+from utils.prescreen import image_signature, signature_distance, signature_mask, detectable_distance, SkipRateWindow
+from utils.zones import parse_zones, load_zones, zones_data
+from utils import metrics
+from jobs import enqueue_compare_job, job_worker
+from persistence import create_scan, save_comparison
+from tracks import update_location_tracks, summarize_location_tracks, track_data
+from heatmaps import heatmap_store, epoch_seconds, change_frame_size
+from derivatives import DERIVATIVES, has_derivatives, store_derivatives
 
 logger = logging.getLogger(__name__)
 
+# Prepared baselines shared across comparisons in this worker
+baseline_cache = BaselineFeatureStore(app.config["BASELINE_CACHE_SIZE"])
+
+# Last homography aligning each location's camera with a baseline, keyed by
+# (baseline ID, location)
+homography_cache = BaselineFeatureStore(app.config["BASELINE_CACHE_SIZE"] * 8)
+
+# On-disk store holding the scan images
+image_store = ImageStore(app.config["IMAGE_STORE_PATH"])
+
+# Rendered comparison visualizations
+visualization_cache = VisualizationCache(app.config["VISUALIZATION_CACHE_PATH"])
+
+# Recent pre-screen decisions, for the skip rates reported with comparisons
+prescreen_stats = SkipRateWindow()
+
+# Stage latency histograms of this process
+metrics.registry.enabled = app.config["METRICS_ENABLED"]
+
+# Worker processes running the vision pipeline, created on first use
+_compute_executor = None
+_compute_executor_lock = threading.Lock()
+
+def vision():
+    """
+    The vision pipeline module (utils.pipeline), imported on first use
+    
+    It loads OpenCV and NumPy, which serving pages and plain API calls don't
+    need, so they are only imported by the first comparison; gunicorn
+    masters import them up front through preload_vision().
+    """
+    from utils import pipeline
+    return pipeline
+
+@lru_cache(maxsize=None)
+def alignment_backends():
+    """Feature backends usable with the installed OpenCV build"""
+    from utils.feature_backends import available_backends
+    return available_backends()
+
+def preload_vision():
+    """
+    Import the vision stack and probe the feature backends ahead of the
+    first comparison
+    
+    Called by the gunicorn master when the app is preloaded, so forked
+    workers share the loaded modules instead of each importing them.
+    """
+    vision()
+    alignment_backends()
+
+def get_compute_executor():
+    """Get or create the compute pool of this process"""
+    global _compute_executor
+    with _compute_executor_lock:
+        if _compute_executor is None:
+            _compute_executor = ComputeExecutor(
+                max_workers=app.config["COMPUTE_WORKERS"],
+                max_pending=app.config["COMPUTE_MAX_PENDING"],
+                initializer=vision().init_worker,
+                queue_timeout=app.config["COMPUTE_QUEUE_TIMEOUT"]
+            )
+        return _compute_executor
+
+def timings_enabled():
+    """Whether stage timings are collected, for /metrics or Server-Timing"""
+    return metrics.registry.enabled or app.config["SERVER_TIMING"]
+
+def record_worker_timings(result):
+    """Fold the stage timings a compute worker measured into this request's"""
+    seconds = result.pop('timings', None)
+    if not seconds:
+        return
+    timings = metrics.current_timings()
+    if timings is not None:
+        timings.merge(seconds)
+    elif metrics.registry.enabled:
+        # Work outside a request (jobs, streamed batch frames) is recorded directly
+        metrics.registry.observe_stages(seconds)
+
+def run_compute(fn, *args, **kwargs):
+    """Run vision work on the compute pool and wait for the result"""
+    return get_compute_executor().run(fn, *args, timeout=app.config["COMPUTE_TIMEOUT"], **kwargs)
+
+def busy_response(message):
+    """Response telling the client to retry once compute capacity frees up"""
+    response = jsonify({
+        'success': False,
+        'message': message
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+def stored_image_fields(digest):
+    """Scan column values describing an image already in the image store"""
+    with Image.open(image_store.path_for(digest)) as image:
+        width, height = image.size
+        signature = image_signature(image)
+    return {
+        'image_hash': digest,
+        'image_width': width,
+        'image_height': height,
+        'image_size': image_store.size(digest),
+        'signature': signature
+    }
+
+def parse_bool(value):
+    """Interpret a JSON or form/query string value as a boolean"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+def read_scan_upload(image_field):
+    """
+    Read the request fields and stream the uploaded image into the image store
+    
+    Accepts a JSON body with the image as a base64 data URL, a
+    multipart/form-data body with the image as a file part, or a raw
+    image/* body with the other fields in the query string.
+    
+    Args:
+        image_field: Name of the JSON key or form part holding the image
+        
+    Returns:
+        Tuple of the request fields and the image store hash of the image
+    """
+    if request.mimetype.startswith('image/'):
+        return request.args.to_dict(), stored_upload(image_store.add_stream(request.stream))
+    
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get(image_field)
+        if upload is None:
+            raise ValueError(f"Missing '{image_field}' file part")
+        return request.form.to_dict(), stored_upload(image_store.add_stream(upload.stream))
+    
+    data = request.json
+    image_data = base64.b64decode(data[image_field].split(',')[1])
+    return data, stored_upload(image_store.add(image_data))
+
+def read_batch_upload(images_field):
+    """
+    Read the request fields and store every uploaded frame of a batch
+    
+    Accepts a JSON body with a list of base64 data URLs, or a
+    multipart/form-data body with one file part per frame, all named
+    images_field.
+    
+    Args:
+        images_field: Name of the JSON key or form parts holding the frames
+        
+    Returns:
+        Tuple of the request fields and the image store hashes of the
+        frames, in upload order
+    """
+    if request.mimetype == 'multipart/form-data':
+        uploads = request.files.getlist(images_field)
+        return request.form.to_dict(), [stored_upload(image_store.add_stream(upload.stream)) for upload in uploads]
+    
+    data = request.json
+    images = data.get(images_field) or []
+    return data, [stored_upload(image_store.add(base64.b64decode(image.split(',')[1]))) for image in images]
+
+def stored_upload(stored):
+    """
+    Note an uploaded image the request created in the store
+    
+    Args:
+        stored: (digest, created) from ImageStore.add or add_stream
+        
+    Returns:
+        The image's digest
+    """
+    digest, created = stored
+    if created:
+        g.setdefault('created_images', set()).add(digest)
+    return digest
+
+def page_arguments(default_limit=50, max_limit=500):
+    """
+    Read the 'before' cursor and 'limit' query parameters of a paginated listing
+    
+    Raises:
+        ValueError: If either parameter is not an integer
+    """
+    before = request.args.get('before')
+    limit = int(request.args.get('limit', default_limit))
+    return (int(before) if before else None), max(1, min(limit, max_limit))
+
+def keyset_page(query, model, before, limit, order_column=None):
+    """
+    Fetch one newest-first page of a query using keyset pagination
+    
+    Rows are ordered by (order_column, id) descending, or by id alone. The
+    cursor is the ID of the last row of the previous page, so every page is
+    a range scan of the matching index however deep it is, unlike OFFSET.
+    
+    Args:
+        query: Query of model rows, already filtered
+        model: Model with an integer 'id' primary key
+        before: Cursor returned with the previous page, or None for the first
+        limit: Page size
+        order_column: Column of model ordering the rows, or None for the ID
+        
+    Returns:
+        Tuple of the page's rows and the cursor of the next page (None on the
+        last page)
+    """
+    if before is not None:
+        cursor = None
+        if order_column is not None:
+            cursor = db.session.query(order_column).filter(model.id == before).scalar()
+        if cursor is None:
+            # Ordered by ID, or the cursor row has since been deleted
+            query = query.filter(model.id < before)
+        else:
+            query = query.filter(or_(
+                order_column < cursor,
+                and_(order_column == cursor, model.id < before)
+            ))
+    
+    ordering = [model.id.desc()] if order_column is None else [order_column.desc(), model.id.desc()]
+    rows = query.order_by(*ordering).limit(limit + 1).all()
+    next_before = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_before
+
+def change_type_counts(scan_ids):
+    """Number of changes of each type per scan, counted in one query"""
+    counts = {}
+    if not scan_ids:
+        return counts
+    rows = db.session.query(ChangeLog.scan_id, ChangeLog.change_type, func.count(ChangeLog.id)).filter(
+        ChangeLog.scan_id.in_(scan_ids)
+    ).group_by(ChangeLog.scan_id, ChangeLog.change_type)
+    for scan_id, change_type, count in rows:
+        scan_counts = counts.setdefault(scan_id, {'total': 0})
+        scan_counts[change_type] = count
+        scan_counts['total'] += count
+    return counts
+
+def scan_image_source(scan):
+    """Path or bytes of a scan's image, suitable for the compute workers"""
+    if scan.image_hash:
+        return image_store.path_for(scan.image_hash)
+    # Scans saved before the image store keep their bytes in the database
+    return scan.image_data
+
+def _scan_version(scan):
+    """Version token that changes whenever the scan's image changes"""
+    return scan.image_hash or zlib.crc32(scan.image_data)
+
+def alignment_settings(data, location):
+    """
+    Resolve the feature backend and keypoint budget for a comparison
+    
+    Request fields ('alignment', 'keypoint_budget') take precedence over the
+    location's profile, which takes precedence over the app defaults.
+    
+    Returns:
+        Tuple of backend name and keypoint budget (None for the backend default)
+        
+    Raises:
+        ValueError: If the backend is unknown or unavailable
+    """
+    profile = db.session.get(LocationProfile, location) if location else None
+    
+    backend = (data.get('alignment')
+               or (profile.alignment_backend if profile else None)
+               or app.config["ALIGNMENT_BACKEND"])
+    if backend not in alignment_backends():
+        raise ValueError(f"Alignment backend '{backend}' is not available; use one of {', '.join(alignment_backends())}")
+    
+    max_features = data.get('keypoint_budget')
+    if max_features is None or max_features == '':
+        if profile and profile.keypoint_budget is not None:
+            max_features = profile.keypoint_budget
+        else:
+            max_features = app.config["ALIGNMENT_KEYPOINT_BUDGET"]
+    else:
+        max_features = int(max_features)
+        if max_features < 0:
+            raise ValueError('Keypoint budget must not be negative')
+    
+    return backend, max_features
+
+def detection_mode(data, location):
+    """
+    Resolve the change detection mode for a comparison
+    
+    The request's 'detection_mode' takes precedence over the location's
+    profile, which takes precedence over the app default.
+    
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    profile = db.session.get(LocationProfile, location) if location else None
+    
+    mode = (data.get('detection_mode')
+            or (profile.detection_mode if profile else None)
+            or app.config["DETECTION_MODE"])
+    modes = vision().DETECTION_MODES
+    if mode not in modes:
+        raise ValueError(f"Unknown detection mode '{mode}'; use one of {', '.join(modes)}")
+    return mode
+
+def detection_engine(data):
+    """
+    Resolve the change extraction engine for a comparison
+    
+    Raises:
+        ValueError: If the engine is unknown
+    """
+    engine = data.get('detection_engine') or app.config["DETECTION_ENGINE"]
+    engines = vision().DETECTION_ENGINES
+    if engine not in engines:
+        raise ValueError(f"Unknown detection engine '{engine}'; use one of {', '.join(engines)}")
+    return engine
+
+def location_zones(location):
+    """Monitored zones (utils.zones.Zones) of a location, or None for the whole frame"""
+    profile = db.session.get(LocationProfile, location) if location else None
+    return load_zones(profile.zones) if profile else None
+
+def get_baseline_features(scan, backend, max_features=None, zones=None):
+    """Get the prepared baseline for a scan, preparing it on first use"""
+    return baseline_cache.get_or_create(
+        (scan.id, backend, max_features, zones),
+        _scan_version(scan),
+        lambda: run_compute(vision().prepare_baseline_image, scan_image_source(scan), backend, max_features, zones)
+    )
+
+@event.listens_for(Scan, 'after_update')
+@event.listens_for(Scan, 'after_delete')
+def _invalidate_baseline_cache(mapper, connection, target):
+    """Drop cached features and transforms when a scan row changes"""
+    baseline_cache.invalidate(target.id)
+    homography_cache.invalidate(target.id)
+
+def tiling_settings():
+    """Tiled execution settings for the comparisons, or None when it's disabled"""
+    tile_size, threads = app.config["TILE_SIZE"], app.config["TILE_THREADS"]
+    if tile_size <= 0 or threads <= 1:
+        return None
+    return vision().Tiling(tile_size, threads)
+
+def comparison_arguments(baseline_scan, data):
+    """
+    Resolve the run_comparison arguments shared by every image compared with
+    a baseline under the same request options
+    
+    The last homography found for the image's location is passed along as a
+    hint so fixed cameras skip feature matching. The baseline location's
+    zones limit the comparison to its monitored area.
+    
+    Args:
+        baseline_scan: Baseline Scan
+        data: Request options (alignment, keypoint_budget, detection_mode,
+            detection_engine, location)
+        
+    Returns:
+        Keyword arguments for run_comparison (all but the current image)
+        
+    Raises:
+        ValueError: If the alignment settings or detection mode are invalid
+    """
+    backend, max_features = alignment_settings(data, baseline_scan.location)
+    mode = detection_mode(data, baseline_scan.location)
+    
+    homography_key = (baseline_scan.id, data.get('location') or baseline_scan.location)
+    return {
+        'baseline_features': get_baseline_features(baseline_scan, backend, max_features,
+                                                   location_zones(baseline_scan.location)),
+        'homography_hint': homography_cache.get(homography_key, _scan_version(baseline_scan)),
+        'residual_threshold': app.config["ALIGNMENT_RESIDUAL_THRESHOLD"],
+        'mode': mode,
+        'baseline_source': scan_image_source(baseline_scan) if mode == 'pyramid' else None,
+        'engine': detection_engine(data),
+        'tiling': tiling_settings()
+    }
+
+def remember_homography(baseline_scan, data, result):
+    """Cache the transform a comparison used for the next image from its location"""
+    if result['homography'] is not None:
+        homography_key = (baseline_scan.id, data.get('location') or baseline_scan.location)
+        homography_cache.put(homography_key, _scan_version(baseline_scan), result['homography'])
+
+def prescreen_max_distance(data, location):
+    """
+    Resolve the signature distance under which a comparison is skipped
+    
+    The request's 'prescreen_max_distance' takes precedence over the
+    location's profile, which takes precedence over the app default. A
+    negative bound, or 'prescreen' set to false, disables the pre-screen.
+    
+    Returns:
+        The bound, or None when the pre-screen is disabled
+        
+    Raises:
+        ValueError: If the bound isn't an integer
+    """
+    if not parse_bool(data.get('prescreen', True)):
+        return None
+    
+    bound = data.get('prescreen_max_distance')
+    if bound is None or bound == '':
+        profile = db.session.get(LocationProfile, location) if location else None
+        if profile and profile.prescreen_max_distance is not None:
+            bound = profile.prescreen_max_distance
+        else:
+            bound = app.config["PRESCREEN_MAX_DISTANCE"]
+    
+    try:
+        bound = int(bound)
+    except (TypeError, ValueError):
+        raise ValueError('prescreen_max_distance must be an integer')
+    return bound if bound >= 0 else None
+
+def baseline_signature(scan):
+    """Signature of a baseline, computed and stored on first use for older scans"""
+    if scan.signature is not None:
+        return scan.signature
+    
+    signature = image_signature(scan_image_source(scan))
+    try:
+        # Stored on its own connection, so the session's pending work and
+        # loaded objects are left alone and after_update (which would drop
+        # the prepared baseline) doesn't fire
+        with db.engine.begin() as connection:
+            connection.execute(update(Scan).where(Scan.id == scan.id).values(signature=signature))
+    except Exception as e:
+        logger.error(f"Error storing signature of scan {scan.id}: {str(e)}")
+    set_committed_value(scan, 'signature', signature)
+    return signature
+
+def prescreen(baseline_scan, image_hash, data):
+    """
+    Compare the signatures of a stored image and its baseline
+    
+    Reading the signatures costs a fraction of decoding the full image, so
+    frames of a static scene are recognized before the pipeline runs. With
+    location zones, only the cells over their monitored area count. An
+    image whose signature can't be computed is never skipped.
+    
+    The configured bound is capped by the distance of the smallest change
+    the pipeline detects, and frames too large for any bound to be safe, as
+    well as pyramid mode comparisons, which look for changes far smaller
+    than a signature cell, are not pre-screened.
+    
+    Returns:
+        Dictionary with the signature distance, the bound it was held to,
+        whether the comparison can be skipped and the recent skip rate of
+        the location; None when the pre-screen is disabled
+        
+    Raises:
+        ValueError: If the bound or the detection mode is invalid
+    """
+    max_distance = prescreen_max_distance(data, baseline_scan.location)
+    if max_distance is None or detection_mode(data, baseline_scan.location) == 'pyramid':
+        return None
+    if not baseline_scan.image_width or not baseline_scan.image_height:
+        return None
+    
+    # The threshold applies to contrast equalized frames, so a change can
+    # be detected from a somewhat smaller difference of the originals; but
+    # changes barely over it don't survive the noise filtering whole, and
+    # the smallest changes reported move the signature by 2 levels or more
+    pipeline = vision()
+    max_distance = min(max_distance, detectable_distance(
+        change_frame_size(baseline_scan.image_width, baseline_scan.image_height),
+        pipeline.DEFAULT_THRESHOLD,
+        pipeline.MIN_CHANGE_AREA
+    ))
+    if max_distance < 0:
+        return None
+    
+    zones = location_zones(baseline_scan.location)
+    with metrics.stage('prescreen'):
+        try:
+            distance = signature_distance(
+                baseline_signature(baseline_scan),
+                image_signature(image_store.path_for(image_hash)),
+                signature_mask(zones) if zones else None
+            )
+        except Exception as e:
+            logger.error(f"Error pre-screening image {image_hash}: {str(e)}")
+            distance = None
+    
+    skipped = distance is not None and distance <= max_distance
+    location = data.get('location') or baseline_scan.location
+    return {
+        'distance': distance,
+        'max_distance': max_distance,
+        'skipped': skipped,
+        'skip_rate': prescreen_stats.record(location, skipped)
+    }
+
+def discard_image(digest):
+    """
+    Remove an image the request uploaded from the store, unless a scan, a
+    comparison or an unfinished job refers to it
+    
+    The store keeps identical uploads once, so only an image this request
+    created is removed: an image that was there before may be in use by
+    another request's comparison. Compare jobs, which run outside the
+    request that uploaded their image, remove nothing.
+    """
+    if digest not in g.get('created_images', ()):
+        return
+    referenced = db.session.query(or_(
+        Scan.query.filter(Scan.image_hash == digest).exists(),
+        Comparison.query.filter(Comparison.image_hash == digest).exists(),
+        CompareJob.query.filter(CompareJob.image_hash == digest,
+                                CompareJob.status.in_(('pending', 'running'))).exists()
+    )).scalar()
+    if not referenced:
+        image_store.delete(digest)
+
+def skipped_comparison(baseline_scan, image_hash, data, screen):
+    """
+    Result of a comparison the pre-screen found unchanged, in the format of
+    compare_with_baseline
+    
+    With PRESCREEN_DISCARD_IMAGES the result refers to the baseline's image,
+    which the upload matches, and the upload is removed from the store when
+    nothing else may use it (see discard_image).
+    """
+    if app.config["PRESCREEN_DISCARD_IMAGES"] and baseline_scan.image_hash \
+            and image_hash != baseline_scan.image_hash:
+        discard_image(image_hash)
+        image_hash = baseline_scan.image_hash
+    
+    return {
+        'changes': [],
+        'objects': [],
+        'alignment': 'skipped',
+        'homography': None,
+        'detection_mode': detection_mode(data, baseline_scan.location),
+        'image_hash': image_hash,
+        'prescreen': screen
+    }
+
+def compare_with_baseline(baseline_scan, image_hash, data, render_format=None, render_quality=None):
+    """
+    Compare a stored image with a baseline on the compute pool
+    
+    Args:
+        baseline_scan: Baseline Scan
+        image_hash: ImageStore hash of the current image
+        data: Request options (alignment, keypoint_budget, detection_mode,
+            detection_engine, location)
+        render_format: Visualization format to render eagerly, or None
+        render_quality: Encoder quality for the visualization
+        
+    Returns:
+        Result dictionary of run_comparison, plus the detection mode used,
+        the pre-screen outcome ('prescreen') and the hash of the image the
+        comparison should be recorded with ('image_hash'). A comparison the
+        pre-screen skips has no changes, 'skipped' alignment and no
+        visualization.
+        
+    Raises:
+        ValueError: If the alignment settings or detection mode are invalid
+    """
+    screen = prescreen(baseline_scan, image_hash, data)
+    if screen and screen['skipped']:
+        return skipped_comparison(baseline_scan, image_hash, data, screen)
+    
+    arguments = comparison_arguments(baseline_scan, data)
+    # Includes waiting for a worker and moving data to and from it
+    with metrics.stage('compute'):
+        result = run_compute(
+            vision().run_comparison,
+            current_source=image_store.path_for(image_hash),
+            render_format=render_format,
+            render_quality=render_quality,
+            collect_timings=timings_enabled(),
+            **arguments
+        )
+    record_worker_timings(result)
+    
+    remember_homography(baseline_scan, data, result)
+    result['detection_mode'] = arguments['mode']
+    result['image_hash'] = image_hash
+    result['prescreen'] = screen
+    return result
+
+def visualization_format(data):
+    """
+    Resolve the requested visualization format and quality
+    
+    Returns:
+        Tuple of format key and encoder quality
+        
+    Raises:
+        ValueError: If the format or quality is not supported
+    """
+    formats = vision().VISUALIZATION_FORMATS
+    image_format = str(data.get('format') or app.config["VISUALIZATION_FORMAT"]).lower()
+    if image_format not in formats:
+        raise ValueError(f"Unsupported visualization format '{image_format}'")
+    
+    quality = data.get('quality')
+    if quality is None or quality == '':
+        return image_format, formats[image_format][2]
+    
+    quality = int(quality)
+    low, high = (0, 9) if image_format == 'png' else (1, 100)
+    if not low <= quality <= high:
+        raise ValueError(f"Quality for {image_format} must be between {low} and {high}")
+    return image_format, quality
+
+@app.before_request
+def _start_job_worker():
+    """Start the compare job worker in this process on its first request"""
+    job_worker.start()
+
+@app.before_request
+def _start_request_timings():
+    """Collect the stage timings of the request when they are reported"""
+    if timings_enabled():
+        g.request_started = time.perf_counter()
+        g.timings, g.timings_token = metrics.begin_timings()
+
+@app.after_request
+def _report_request_timings(response):
+    """Record the request's stage timings and add its Server-Timing header"""
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    
+    # Work done while streaming the response body is recorded on its own
+    _end_request_timings()
+    elapsed = time.perf_counter() - g.request_started
+    
+    if metrics.registry.enabled:
+        metrics.registry.observe_stages(timings.seconds)
+        metrics.registry.request_seconds.observe(request.endpoint or 'unmatched', elapsed)
+    if app.config["SERVER_TIMING"]:
+        response.headers['Server-Timing'] = metrics.server_timing(timings, total=elapsed)
+    return response
+
+@app.teardown_request
+def _end_request_timings(exc=None):
+    """Stop collecting stage timings for the request"""
+    token = g.pop('timings_token', None)
+    if token is not None:
+        metrics.end_timings(token)
+
+@app.route('/metrics')
+def get_metrics():
+    """Stage and request latency histograms in the Prometheus text format"""
+    if not metrics.registry.enabled:
+        return jsonify({
+            'success': False,
+            'message': 'Metrics are disabled'
+        }), 404
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/')
 def index():
     """Main page with camera interface for scanning spaces"""
@@ -26,38 +701,57 @@ def index():
 @app.route('/history')
 def history():
     """Page showing historical scans and detected changes"""
-    # Get all scan sessions
-    sessions = ScanSession.query.order_by(ScanSession.created_at.desc()).all()
-    return render_template('history.html', sessions=sessions)
+    try:
+        before, limit = page_arguments(default_limit=20, max_limit=100)
+    except ValueError:
+        before, limit = None, 20
+    
+    # One page of sessions, with their scans loaded in a single extra query
+    sessions, next_before = keyset_page(
+        ScanSession.query.options(selectinload(ScanSession.scans)),
+        ScanSession, before, limit, order_column=ScanSession.created_at
+    )
+    change_counts = change_type_counts([scan.id for session in sessions for scan in session.scans])
+    
+    # Analytics over the whole history, counted by the database
+    totals = {
+        'sessions': ScanSession.query.count(),
+        'scans': db.session.query(func.count()).select_from(session_scan).scalar(),
+        'changes': db.session.query(func.count(ChangeLog.id)).join(
+            session_scan, session_scan.c.scan_id == ChangeLog.scan_id
+        ).scalar()
+    }
+    recent_changes = db.session.query(
+        ChangeLog.change_type, ChangeLog.object_type,
+        Scan.id.label('scan_id'), Scan.name.label('scan_name'), Scan.timestamp
+    ).join(Scan, ChangeLog.scan_id == Scan.id).filter(
+        Scan.sessions.any()
+    ).order_by(ChangeLog.id.desc()).limit(5).all()
+    
+    return render_template('history.html', sessions=sessions, change_counts=change_counts,
+                           totals=totals, recent_changes=recent_changes,
+                           before=before, next_before=next_before)
 
 @app.route('/api/scan/save', methods=['POST'])
 def save_scan():
     """API endpoint to save a new scan"""
     try:
-        data = request.json
+        data, image_hash = read_scan_upload('image')
         
-        # Decode base64 image
-        image_data = base64.b64decode(data['image'].split(',')[1])
-        
-        # Create new scan record
-        new_scan = Scan(
-            name=data.get('name', f"Scan {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"),
-            description=data.get('description', ''),
-            image_data=image_data,
-            is_baseline=data.get('is_baseline', False),
-            location=data.get('location', 'Unknown')
+        # Save the scan and its session association
+        new_scan = create_scan(
+            stored_image_fields(image_hash),
+            data,
+            is_baseline=parse_bool(data.get('is_baseline', False))
         )
         
-        db.session.add(new_scan)
-        db.session.commit()
-        
-        # If this scan belongs to a session, associate it
-        session_id = data.get('session_id')
-        if session_id:
-            session = ScanSession.query.get(session_id)
-            if session:
-                session.scans.append(new_scan)
-                db.session.commit()
+        # Prepare baseline features now so the first comparison is fast
+        if new_scan.is_baseline:
+            try:
+                get_baseline_features(new_scan, *alignment_settings({}, new_scan.location),
+                                      location_zones(new_scan.location))
+            except ExecutorSaturated:
+                logger.debug(f"Compute pool busy, baseline {new_scan.id} will be prepared on first use")
         
         return jsonify({
             'success': True,
@@ -76,7 +770,8 @@ def save_scan():
 def compare_scans():
     """API endpoint to compare a new scan with a baseline"""
     try:
-        data = request.json
+        with metrics.stage('upload'):
+            data, image_hash = read_scan_upload('current_image')
         
         # Get baseline scan
         baseline_id = data.get('baseline_id')
@@ -86,79 +781,90 @@ def compare_scans():
                 'message': 'Baseline scan ID is required'
             }), 400
             
-        baseline_scan = Scan.query.get(baseline_id)
+        baseline_scan = db.session.get(Scan, baseline_id)
         if not baseline_scan:
             return jsonify({
                 'success': False,
                 'message': 'Baseline scan not found'
             }), 404
         
-        # Decode current scan
-        current_image_data = base64.b64decode(data['current_image'].split(',')[1])
-        
-        # Open images with PIL
-        baseline_image = Image.open(io.BytesIO(baseline_scan.image_data))
-        current_image = Image.open(io.BytesIO(current_image_data))
+        try:
+            alignment_settings(data, baseline_scan.location)
+            detection_mode(data, baseline_scan.location)
+            detection_engine(data)
+            prescreen_max_distance(data, baseline_scan.location)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
         
-        # Preprocess images
-        baseline_processed = preprocess_image(np.array(baseline_image))
-        current_processed = preprocess_image(np.array(current_image))
+        # The visualization is rendered lazily unless the client asks for it now
+        render_format = render_quality = None
+        if parse_bool(data.get('render_visualization', False)):
+            render_format, render_quality = visualization_format({
+                'format': data.get('visualization_format'),
+                'quality': data.get('visualization_quality')
+            })
         
-        # Detect changes
-        changes, change_mask, visualization = detect_changes(
-            baseline_processed, 
-            current_processed
+        # Reuse the cached baseline and run the comparison on the compute pool
+        result = compare_with_baseline(
+            baseline_scan,
+            image_hash,
+            data,
+            render_format=render_format,
+            render_quality=render_quality
         )
+        changes = result['changes']
+        objects_detected = result['objects']
+        image_hash = result['image_hash']
         
-        # Detect objects in areas with changes
-        objects_detected = detect_objects(current_processed, changes)
-        
-        # Save the new scan if requested
-        new_scan_id = None
-        if data.get('save_scan', False):
-            new_scan = Scan(
-                name=data.get('name', f"Comparison with {baseline_scan.name}"),
-                description=data.get('description', ''),
-                image_data=current_image_data,
-                is_baseline=False,
-                location=data.get('location', baseline_scan.location)
+        # Record the comparison, and the scan with its changes if requested
+        image_fields = None
+        if parse_bool(data.get('save_scan', False)):
+            image_fields = stored_image_fields(image_hash)
+        with metrics.stage('db_commit'):
+            comparison = save_comparison(
+                baseline_scan,
+                image_hash,
+                changes,
+                objects_detected,
+                data,
+                image_fields=image_fields,
+                detection_mode=result['detection_mode'],
+                prescreen=result['prescreen']
             )
-            db.session.add(new_scan)
-            db.session.commit()
-            new_scan_id = new_scan.id
-            
-            # Save detected changes
-            for i, change in enumerate(changes):
-                change_log = ChangeLog(
-                    scan_id=new_scan.id,
-                    baseline_id=baseline_id,
-                    change_type=change['type'],
-                    object_type=objects_detected[i]['label'] if i < len(objects_detected) else 'unknown',
-                    confidence=objects_detected[i]['confidence'] if i < len(objects_detected) else 0.0,
-                    position_x=change['x'],
-                    position_y=change['y'],
-                    size_w=change['width'],
-                    size_h=change['height']
-                )
-                db.session.add(change_log)
-            
-            db.session.commit()
         
-        # Convert visualization to base64 for return
-        visualization_buffer = io.BytesIO()
-        visualization_image = Image.fromarray(visualization)
-        visualization_image.save(visualization_buffer, format='PNG')
-        visualization_base64 = base64.b64encode(visualization_buffer.getvalue()).decode('utf-8')
+        # Skipped comparisons have nothing rendered; the URL renders on demand
+        if render_format is not None and 'visualization' in result:
+            with metrics.stage('cache_write'):
+                # save_comparison stores the changes as json.dumps(changes)
+                version = visualization_cache.content_version(baseline_scan.image_hash, image_hash,
+                                                              json.dumps(changes))
+                visualization_cache.put(comparison.id, version, render_format, render_quality,
+                                        result['visualization'])
         
         return jsonify({
             'success': True,
-            'scan_id': new_scan_id,
+            'scan_id': comparison.scan_id,
+            'comparison_id': comparison.id,
             'changes': changes,
             'objects': objects_detected,
-            'visualization': f'data:image/png;base64,{visualization_base64}',
-            'change_count': len(changes)
+            'visualization': url_for(
+                'get_comparison_visualization',
+                comparison_id=comparison.id,
+                format=render_format
+            ),
+            'change_count': len(changes),
+            'alignment': result['alignment'],
+            'detection_mode': result['detection_mode'],
+            'prescreen': result['prescreen']
         })
         
+    except ExecutorSaturated:
+        return busy_response('Comparison capacity exhausted, please retry shortly')
+    except TimeoutError:
+        return busy_response('Comparison timed out waiting for compute capacity')
     except Exception as e:
         logger.error(f"Error comparing scans: {str(e)}")
         return jsonify({
@@ -166,6 +872,187 @@ def compare_scans():
             'message': f'Error comparing scans: {str(e)}'
         }), 500
 
+@app.route('/api/scan/compare-batch', methods=['POST'])
+def compare_scan_batch():
+    """
+    API endpoint to compare several frames with one baseline
+    
+    The baseline is prepared once and the frames are compared in parallel on
+    the compute pool. The response is streamed as NDJSON: one line per frame
+    (with its 'index' in the upload) as soon as it finishes, then a summary
+    line.
+    """
+    try:
+        data, image_hashes = read_batch_upload('images')
+        
+        baseline_id = data.get('baseline_id')
+        if not baseline_id:
+            return jsonify({
+                'success': False,
+                'message': 'Baseline scan ID is required'
+            }), 400
+        
+        if not image_hashes:
+            return jsonify({
+                'success': False,
+                'message': 'At least one image is required'
+            }), 400
+        
+        max_frames = app.config["COMPARE_BATCH_MAX_FRAMES"]
+        if len(image_hashes) > max_frames:
+            return jsonify({
+                'success': False,
+                'message': f'At most {max_frames} images can be compared per batch'
+            }), 400
+        
+        baseline_scan = db.session.get(Scan, baseline_id)
+        if not baseline_scan:
+            return jsonify({
+                'success': False,
+                'message': 'Baseline scan not found'
+            }), 404
+        
+        try:
+            arguments = comparison_arguments(baseline_scan, data)
+            if prescreen_max_distance(data, baseline_scan.location) is not None:
+                # Loaded now, as the frames are compared outside this session
+                baseline_signature(baseline_scan)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        save_scans = parse_bool(data.get('save_scan', False))
+        
+    except ExecutorSaturated:
+        return busy_response('Comparison capacity exhausted, please retry shortly')
+    except TimeoutError:
+        return busy_response('Comparison timed out waiting for compute capacity')
+    except Exception as e:
+        logger.error(f"Error comparing scan batch: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error comparing scan batch: {str(e)}'
+        }), 500
+    
+    def frame_result(index, image_hash, result, screen):
+        """Record one finished or skipped frame and build its NDJSON line"""
+        record_worker_timings(result)
+        remember_homography(baseline_scan, data, result)
+        # A skipped frame may be recorded with the baseline's image instead
+        image_hash = result.get('image_hash', image_hash)
+        comparison = save_comparison(
+            baseline_scan,
+            image_hash,
+            result['changes'],
+            result['objects'],
+            data,
+            image_fields=stored_image_fields(image_hash) if save_scans else None,
+            detection_mode=arguments['mode'],
+            prescreen=screen
+        )
+        return {
+            'index': index,
+            'success': True,
+            'scan_id': comparison.scan_id,
+            'comparison_id': comparison.id,
+            'changes': result['changes'],
+            'objects': result['objects'],
+            'visualization': url_for('get_comparison_visualization', comparison_id=comparison.id),
+            'change_count': len(result['changes']),
+            'alignment': result['alignment'],
+            'prescreen': screen
+        }
+    
+    def generate():
+        queued = list(enumerate(image_hashes))
+        running = {}
+        screens = {}
+        failed = 0
+        
+        while queued or running:
+            # Keep as many frames in flight as the compute pool accepts
+            while queued:
+                index, image_hash = queued[0]
+                if index not in screens:
+                    screens[index] = screen = prescreen(baseline_scan, image_hash, data)
+                    if screen and screen['skipped']:
+                        # Unchanged frames are answered without the compute pool
+                        queued.pop(0)
+                        try:
+                            line = frame_result(index, image_hash,
+                                                skipped_comparison(baseline_scan, image_hash, data, screen), screen)
+                        except Exception as e:
+                            logger.error(f"Error recording frame {index} of batch: {str(e)}")
+                            failed += 1
+                            line = {
+                                'index': index,
+                                'success': False,
+                                'message': f'Error comparing scans: {str(e)}'
+                            }
+                        yield json.dumps(line) + '\n'
+                        continue
+                try:
+                    future = get_compute_executor().submit(
+                        vision().run_comparison,
+                        current_source=image_store.path_for(image_hash),
+                        collect_timings=timings_enabled(),
+                        **arguments
+                    )
+                except ExecutorSaturated:
+                    if running:
+                        break
+                    # Nothing of ours is in flight, so the pool is busy with other work
+                    failed += 1
+                    queued.pop(0)
+                    yield json.dumps({
+                        'index': index,
+                        'success': False,
+                        'message': 'Comparison capacity exhausted'
+                    }) + '\n'
+                    continue
+                running[future] = queued.pop(0)
+            
+            if not running:
+                break
+            
+            done, _ = wait(running, timeout=app.config["COMPUTE_TIMEOUT"], return_when=FIRST_COMPLETED)
+            if not done:
+                # Give up on frames that are stuck rather than hold the response open
+                for future, (index, _) in list(running.items()) + [(None, item) for item in queued]:
+                    if future is not None:
+                        future.cancel()
+                    failed += 1
+                    yield json.dumps({
+                        'index': index,
+                        'success': False,
+                        'message': 'Comparison timed out'
+                    }) + '\n'
+                break
+            
+            for future in done:
+                index, image_hash = running.pop(future)
+                try:
+                    line = frame_result(index, image_hash, future.result(), screens[index])
+                except Exception as e:
+                    logger.error(f"Error comparing frame {index} of batch: {str(e)}")
+                    failed += 1
+                    line = {
+                        'index': index,
+                        'success': False,
+                        'message': f'Error comparing scans: {str(e)}'
+                    }
+                yield json.dumps(line) + '\n'
+        
+        yield json.dumps({
+            'done': True,
+            'frames': len(image_hashes),
+            'failed': failed
+        }) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/session/create', methods=['POST'])
 def create_session():
     """API endpoint to create a new scanning session"""
@@ -194,19 +1081,53 @@ def create_session():
             'message': f'Error creating session: {str(e)}'
         }), 500
 
+def scan_image_urls(scan):
+    """URLs of a scan's image and its thumbnail and preview"""
+    urls = {'image_url': url_for('get_scan_image', scan_id=scan.id)}
+    for kind in DERIVATIVES:
+        urls[f'{kind}_url'] = url_for('get_scan_derivative', scan_id=scan.id, kind=kind)
+    return urls
+
+def send_scan_file(path, mimetype, etag):
+    """Send a stored scan image, cacheable and revalidated by its hash"""
+    response = send_file(path, mimetype=mimetype, etag=etag, max_age=86400)
+    response.cache_control.public = True
+    return response
+
 @app.route('/api/scan/<int:scan_id>')
 def get_scan(scan_id):
-    """API endpoint to get a specific scan"""
+    """
+    API endpoint to get a specific scan
+    
+    The image is referenced by URL; pass include_image=true to also get it
+    inline as a base64 data URL.
+    """
     try:
-        scan = Scan.query.get(scan_id)
+        scan = db.session.get(Scan, scan_id)
         if not scan:
             return jsonify({
                 'success': False,
                 'message': 'Scan not found'
             }), 404
-            
-        # Convert image to base64
-        image_base64 = base64.b64encode(scan.image_data).decode('utf-8')
+        
+        scan_data = {
+            'id': scan.id,
+            'name': scan.name,
+            'description': scan.description,
+            'timestamp': scan.timestamp.isoformat(),
+            'is_baseline': scan.is_baseline,
+            'location': scan.location,
+            **scan_image_urls(scan)
+        }
+        
+        if parse_bool(request.args.get('include_image', False)):
+            # Convert image to base64, mapping it straight from the image store
+            if scan.image_hash:
+                with image_store.map(scan.image_hash) as image_map:
+                    image_base64 = base64.b64encode(image_map).decode('utf-8')
+            else:
+                image_base64 = base64.b64encode(scan.image_data).decode('utf-8')
+            scan_data['image'] = f'data:image/jpeg;base64,{image_base64}'
         
         # Get related changes
         changes = ChangeLog.query.filter_by(scan_id=scan_id).all()
@@ -223,15 +1144,7 @@ def get_scan(scan_id):
         
         return jsonify({
             'success': True,
-            'scan': {
-                'id': scan.id,
-                'name': scan.name,
-                'description': scan.description,
-                'timestamp': scan.timestamp.isoformat(),
-                'is_baseline': scan.is_baseline,
-                'location': scan.location,
-                'image': f'data:image/jpeg;base64,{image_base64}'
-            },
+            'scan': scan_data,
             'changes': changes_data
         })
         
@@ -242,6 +1155,177 @@ def get_scan(scan_id):
             'message': f'Error retrieving scan: {str(e)}'
         }), 500
 
+@app.route('/api/scan/<int:scan_id>/image')
+def get_scan_image(scan_id):
+    """API endpoint to get the original image of a scan"""
+    try:
+        scan = db.session.get(Scan, scan_id)
+        if not scan:
+            return jsonify({
+                'success': False,
+                'message': 'Scan not found'
+            }), 404
+        
+        if scan.image_hash:
+            path = image_store.path_for(scan.image_hash)
+            with Image.open(path) as image:
+                mimetype = Image.MIME.get(image.format, 'application/octet-stream')
+            return send_scan_file(path, mimetype, scan.image_hash)
+        
+        # Scans saved before the image store keep their bytes in the database
+        with Image.open(io.BytesIO(scan.image_data)) as image:
+            mimetype = Image.MIME.get(image.format, 'application/octet-stream')
+        return send_scan_file(io.BytesIO(scan.image_data), mimetype, str(_scan_version(scan)))
+        
+    except Exception as e:
+        logger.error(f"Error retrieving scan image: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error retrieving scan image: {str(e)}'
+        }), 500
+
+@app.route('/api/scan/<int:scan_id>/<any(thumbnail, preview):kind>')
+def get_scan_derivative(scan_id, kind):
+    """
+    API endpoint to get the thumbnail or preview of a scan
+    
+    Both are generated in the background when the scan is saved; a scan
+    whose derivatives are missing gets them on first request.
+    """
+    try:
+        scan = db.session.get(Scan, scan_id)
+        if not scan:
+            return jsonify({
+                'success': False,
+                'message': 'Scan not found'
+            }), 404
+        
+        if not has_derivatives(scan) or not image_store.exists(getattr(scan, f'{kind}_hash')):
+            store_derivatives(scan, image_store, run_compute)
+            db.session.commit()
+        
+        digest = getattr(scan, f'{kind}_hash')
+        return send_scan_file(image_store.path_for(digest), 'image/jpeg', digest)
+        
+    except ExecutorSaturated:
+        return busy_response('Thumbnail capacity exhausted, please retry shortly')
+    except TimeoutError:
+        return busy_response('Thumbnail generation timed out waiting for compute capacity')
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error retrieving scan {kind}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error retrieving scan {kind}: {str(e)}'
+        }), 500
+
+def scan_summary(scan, change_count=0):
+    """JSON representation of a scan in listings, without its image"""
+    return {
+        'id': scan.id,
+        'name': scan.name,
+        'description': scan.description,
+        'timestamp': scan.timestamp.isoformat(),
+        'is_baseline': scan.is_baseline,
+        'location': scan.location,
+        'change_count': change_count,
+        **scan_image_urls(scan)
+    }
+
+@app.route('/api/scans')
+def list_scans():
+    """
+    API endpoint to page through scans, newest first
+    
+    Optional query parameters: 'location' and 'baseline' filter the scans,
+    'limit' sets the page size and 'before' is the 'next_before' cursor of
+    the previous page.
+    """
+    try:
+        before, limit = page_arguments()
+        
+        query = Scan.query
+        if request.args.get('location'):
+            query = query.filter(Scan.location == request.args['location'])
+        if 'baseline' in request.args:
+            query = query.filter(Scan.is_baseline.is_(parse_bool(request.args['baseline'])))
+        
+        scans, next_before = keyset_page(query, Scan, before, limit, order_column=Scan.timestamp)
+        change_counts = change_type_counts([scan.id for scan in scans])
+        
+        return jsonify({
+            'success': True,
+            'scans': [scan_summary(scan, change_counts.get(scan.id, {}).get('total', 0)) for scan in scans],
+            'next_before': next_before
+        })
+        
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'before and limit must be integers'
+        }), 400
+    except Exception as e:
+        logger.error(f"Error listing scans: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error listing scans: {str(e)}'
+        }), 500
+
+@app.route('/api/changes')
+def list_changes():
+    """
+    API endpoint to page through change logs, newest first
+    
+    Optional query parameters: 'scan_id', 'baseline_id', 'track_id',
+    'location' and 'type' filter the changes, 'limit' sets the page size and
+    'before' is the 'next_before' cursor of the previous page.
+    """
+    try:
+        before, limit = page_arguments()
+        
+        query = ChangeLog.query
+        for parameter, column in (('scan_id', ChangeLog.scan_id), ('baseline_id', ChangeLog.baseline_id),
+                                  ('track_id', ChangeLog.track_id)):
+            if request.args.get(parameter):
+                query = query.filter(column == int(request.args[parameter]))
+        if request.args.get('type'):
+            query = query.filter(ChangeLog.change_type == request.args['type'])
+        if request.args.get('location'):
+            query = query.join(Scan, ChangeLog.scan_id == Scan.id).filter(Scan.location == request.args['location'])
+        
+        changes, next_before = keyset_page(query, ChangeLog, before, limit)
+        
+        return jsonify({
+            'success': True,
+            'changes': [{
+                'id': change.id,
+                'scan_id': change.scan_id,
+                'baseline_id': change.baseline_id,
+                'track_id': change.track_id,
+                'timestamp': change.timestamp.isoformat() if change.timestamp else None,
+                'type': change.change_type,
+                'object_type': change.object_type,
+                'confidence': change.confidence,
+                'position_x': change.position_x,
+                'position_y': change.position_y,
+                'size_w': change.size_w,
+                'size_h': change.size_h
+            } for change in changes],
+            'next_before': next_before
+        })
+        
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'before, limit and ID filters must be integers'
+        }), 400
+    except Exception as e:
+        logger.error(f"Error listing changes: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error listing changes: {str(e)}'
+        }), 500
+
 @app.route('/api/baseline-scans')
 def get_baseline_scans():
     """API endpoint to get all baseline scans"""
@@ -251,7 +1335,8 @@ def get_baseline_scans():
             'id': baseline.id,
             'name': baseline.name,
             'timestamp': baseline.timestamp.isoformat(),
-            'location': baseline.location
+            'location': baseline.location,
+            **scan_image_urls(baseline)
         } for baseline in baselines]
         
         return jsonify({
@@ -265,3 +1350,473 @@ def get_baseline_scans():
             'success': False,
             'message': f'Error retrieving baseline scans: {str(e)}'
         }), 500
+
+@app.route('/api/compare-jobs', methods=['POST'])
+def create_compare_job():
+    """API endpoint to queue an asynchronous comparison with a baseline"""
+    try:
+        # The image is stored up front so the worker can pick it up after a restart
+        data, image_hash = read_scan_upload('current_image')
+        
+        baseline_id = data.get('baseline_id')
+        if not baseline_id:
+            return jsonify({
+                'success': False,
+                'message': 'Baseline scan ID is required'
+            }), 400
+        
+        baseline_scan = db.session.get(Scan, baseline_id)
+        if not baseline_scan:
+            return jsonify({
+                'success': False,
+                'message': 'Baseline scan not found'
+            }), 404
+        
+        try:
+            alignment_settings(data, baseline_scan.location)
+            detection_mode(data, baseline_scan.location)
+            detection_engine(data)
+            prescreen_max_distance(data, baseline_scan.location)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        options = {key: data[key] for key in ('save_scan', 'name', 'description', 'location', 'session_id',
+                                              'alignment', 'keypoint_budget', 'detection_mode', 'detection_engine',
+                                              'prescreen', 'prescreen_max_distance')
+                   if key in data}
+        job = enqueue_compare_job(baseline_id, image_hash, options)
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('get_compare_job', job_id=job.id)
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Error queueing compare job: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error queueing compare job: {str(e)}'
+        }), 500
+
+@app.route('/api/compare-jobs/<job_id>')
+def get_compare_job(job_id):
+    """API endpoint to poll the status and results of a compare job"""
+    try:
+        job = db.session.get(CompareJob, job_id)
+        if not job:
+            return jsonify({
+                'success': False,
+                'message': 'Compare job not found'
+            }), 404
+        
+        response = {
+            'success': True,
+            'job': {
+                'id': job.id,
+                'baseline_id': job.baseline_id,
+                'status': job.status,
+                'attempts': job.attempts,
+                'error': job.error,
+                'created_at': job.created_at.isoformat(),
+                'started_at': job.started_at.isoformat() if job.started_at else None,
+                'finished_at': job.finished_at.isoformat() if job.finished_at else None
+            }
+        }
+        
+        if job.status == 'completed':
+            result = json.loads(job.result)
+            result['visualization'] = url_for(
+                'get_comparison_visualization',
+                comparison_id=result['comparison_id']
+            )
+            response['result'] = result
+        
+        return jsonify(response)
+        
+    except Exception as e:
+        logger.error(f"Error retrieving compare job: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error retrieving compare job: {str(e)}'
+        }), 500
+
+@app.route('/api/comparisons/<int:comparison_id>/visualization')
+def get_comparison_visualization(comparison_id):
+    """
+    API endpoint to get the visualization of a comparison
+    
+    Query parameters select the format (jpeg, webp or png) and quality.
+    Renderings are generated on first request and cached under the content
+    hashes of the images and changes they are drawn from, so clients may
+    cache them indefinitely.
+    """
+    try:
+        try:
+            image_format, quality = visualization_format(request.args)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        comparison = db.session.query(
+            Comparison.image_hash, Comparison.changes, Comparison.detection_mode, Scan.image_hash
+        ).join(Scan, Scan.id == Comparison.baseline_id).filter(Comparison.id == comparison_id).first()
+        if not comparison:
+            return jsonify({
+                'success': False,
+                'message': 'Comparison not found'
+            }), 404
+        image_hash, changes, mode, baseline_hash = comparison
+        version = visualization_cache.content_version(baseline_hash, image_hash, changes)
+        
+        # Answer revalidations without touching the renderer
+        etag = visualization_cache.etag(comparison_id, version, image_format, quality)
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+            return response
+        
+        path = visualization_cache.get(comparison_id, version, image_format, quality)
+        if path is None:
+            data = run_compute(
+                vision().render_comparison,
+                image_store.path_for(image_hash),
+                json.loads(changes),
+                image_format,
+                quality,
+                mode=mode or 'standard'
+            )
+            path = visualization_cache.put(comparison_id, version, image_format, quality, data)
+        
+        response = send_file(
+            path,
+            mimetype=vision().VISUALIZATION_FORMATS[image_format][1],
+            etag=etag,
+            max_age=31536000
+        )
+        response.cache_control.immutable = True
+        return response
+        
+    except ExecutorSaturated:
+        return busy_response('Rendering capacity exhausted, please retry shortly')
+    except TimeoutError:
+        return busy_response('Rendering timed out waiting for compute capacity')
+    except Exception as e:
+        logger.error(f"Error rendering visualization: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error rendering visualization: {str(e)}'
+        }), 500
+
+def _location_profile_data(location, profile):
+    return {
+        'location': location,
+        'alignment_backend': profile.alignment_backend if profile else None,
+        'keypoint_budget': profile.keypoint_budget if profile else None,
+        'available_backends': alignment_backends(),
+        'default_backend': app.config["ALIGNMENT_BACKEND"],
+        'detection_mode': profile.detection_mode if profile else None,
+        'default_detection_mode': app.config["DETECTION_MODE"],
+        'prescreen_max_distance': profile.prescreen_max_distance if profile else None,
+        'default_prescreen_max_distance': app.config["PRESCREEN_MAX_DISTANCE"],
+        'zones': json.loads(profile.zones) if profile and profile.zones else None
+    }
+
+@app.route('/api/locations/<path:location>/profile', methods=['GET'])
+def get_location_profile(location):
+    """API endpoint to get the processing settings of a location"""
+    try:
+        profile = db.session.get(LocationProfile, location)
+        return jsonify({
+            'success': True,
+            'profile': _location_profile_data(location, profile)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error retrieving location profile: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error retrieving location profile: {str(e)}'
+        }), 500
+
+@app.route('/api/locations/<path:location>/profile', methods=['PUT'])
+def update_location_profile(location):
+    """API endpoint to set the processing settings of a location"""
+    try:
+        data = request.json
+        
+        backend = data.get('alignment_backend')
+        if backend and backend not in alignment_backends():
+            return jsonify({
+                'success': False,
+                'message': f"Alignment backend '{backend}' is not available"
+            }), 400
+        
+        budget = data.get('keypoint_budget')
+        if budget is not None and (not isinstance(budget, int) or budget < 0):
+            return jsonify({
+                'success': False,
+                'message': 'Keypoint budget must be a non-negative integer'
+            }), 400
+        
+        mode = data.get('detection_mode')
+        if mode and mode not in vision().DETECTION_MODES:
+            return jsonify({
+                'success': False,
+                'message': f"Unknown detection mode '{mode}'"
+            }), 400
+        
+        # Negative bounds disable the pre-screen for the location
+        max_distance = data.get('prescreen_max_distance')
+        if max_distance is not None and (not isinstance(max_distance, int) or isinstance(max_distance, bool)):
+            return jsonify({
+                'success': False,
+                'message': 'Pre-screen max distance must be an integer'
+            }), 400
+        
+        # Polygons in fractions of the frame; none monitors the whole frame
+        try:
+            zones = parse_zones(data.get('zones'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        profile = db.session.get(LocationProfile, location)
+        if not profile:
+            profile = LocationProfile(location=location)
+            db.session.add(profile)
+        
+        if 'alignment_backend' in data:
+            profile.alignment_backend = backend or None
+        if 'keypoint_budget' in data:
+            profile.keypoint_budget = budget
+        if 'detection_mode' in data:
+            profile.detection_mode = mode or None
+        if 'prescreen_max_distance' in data:
+            profile.prescreen_max_distance = max_distance
+        if 'zones' in data:
+            profile.zones = json.dumps(zones_data(zones)) if zones else None
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'profile': _location_profile_data(location, profile)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error updating location profile: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error updating location profile: {str(e)}'
+        }), 500
+
+@app.route('/api/locations/<path:location>/tracks')
+def get_location_tracks(location):
+    """
+    API endpoint to get the regions tracked across a location's scans
+    
+    Returns the long-term analysis (frequently changing, recently added and
+    recently removed regions) and the most recently seen tracks; 'limit'
+    caps the number of tracks listed.
+    """
+    try:
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        
+        # Pick up changes saved since the last update
+        update_location_tracks(location)
+        
+        tracks = ChangeTrack.query.filter_by(location=location).order_by(
+            ChangeTrack.last_scan_id.desc(), ChangeTrack.id.desc()
+        ).limit(limit).all()
+        
+        return jsonify({
+            'success': True,
+            'location': location,
+            'analysis': summarize_location_tracks(location),
+            'tracks': [track_data(track) for track in tracks],
+            'track_count': ChangeTrack.query.filter_by(location=location).count()
+        })
+        
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'limit must be an integer'
+        }), 400
+    except Exception as e:
+        logger.error(f"Error retrieving change tracks: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error retrieving change tracks: {str(e)}'
+        }), 500
+
+def parse_time(value):
+    """
+    Read an ISO 8601 query parameter as seconds since the epoch
+    
+    Times without an offset are taken as UTC, like the stored timestamps.
+    
+    Raises:
+        ValueError: If the value isn't an ISO 8601 date or time
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return epoch_seconds(parsed)
+
+def heatmap_window():
+    """
+    Time window of a heatmap request
+
+    Returns:
+        (since, until) in seconds since the epoch, each None when not given
+
+    Raises:
+        ValueError: If a time isn't ISO 8601
+    """
+    since = parse_time(request.args['since']) if request.args.get('since') else None
+    until = parse_time(request.args['until']) if request.args.get('until') else None
+    return since, until
+
+@app.route('/api/locations/<path:location>/heatmap')
+def get_location_heatmap(location):
+    """
+    API endpoint to get where a location's changes happen
+    
+    The heatmap counts, per cell of a grid over the frame, the changes whose
+    box covered it. It is updated as comparisons are saved, so answering
+    takes the same time however long the location's history is.
+    
+    'since' and 'until' (ISO 8601) limit the changes counted to a window,
+    widened to whole time buckets; without them every change counts.
+    'format' is "png" (default) for a heatmap image 'width' pixels wide in
+    the aspect ratio of the location's baselines, with a "linear" or "log"
+    'scale', or "json" for the raw grid and the buckets it sums.
+    """
+    try:
+        image_format = request.args.get('format', 'png')
+        scale = request.args.get('scale', 'linear')
+        if image_format not in ('png', 'json') or scale not in ('linear', 'log'):
+            return jsonify({
+                'success': False,
+                'message': "format must be png or json, and scale linear or log"
+            }), 400
+        try:
+            since, until = heatmap_window()
+            width = max(16, min(int(request.args.get('width', 640)), 4096))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'since and until must be ISO 8601 times and width an integer'
+            }), 400
+        
+        store = heatmap_store()
+        heatmap = store.query(location, since, until)
+        
+        if image_format == 'json':
+            return jsonify({
+                'success': True,
+                'location': location,
+                'grid_size': store.grid_size,
+                'grid': heatmap.grid.tolist(),
+                'change_count': heatmap.changes,
+                'bucket_seconds': store.bucket_seconds,
+                'buckets': [{
+                    'start': datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None).isoformat(),
+                    'change_count': count
+                } for start, count in heatmap.buckets]
+            })
+        
+        # The image only changes with the counts, so revalidations are
+        # answered without rendering
+        etag = 'heat-' + hashlib.sha1(repr((
+            location, since, until, width, scale, heatmap.changes, heatmap.buckets
+        )).encode('utf-8')).hexdigest()
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        # Changes are placed in the frame of the baselines
+        frame = db.session.query(Scan.image_width, Scan.image_height).filter(
+            Scan.location == location, Scan.is_baseline.is_(True), Scan.image_width.isnot(None)
+        ).order_by(Scan.id.desc()).first()
+        height = max(1, round(width * frame[1] / frame[0])) if frame and frame[0] and frame[1] else width
+        
+        # Imported here so starting the app doesn't load NumPy
+        from utils.heatmap import render_heatmap
+        response = Response(render_heatmap(heatmap.grid, (width, height), scale), mimetype='image/png')
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error rendering change heatmap: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error rendering change heatmap: {str(e)}'
+        }), 500
+
+@app.route('/api/locations/<path:location>/heatmap/<int:zoom>/<int:column>/<int:row>.png')
+def get_location_heatmap_tile(location, zoom, column, row):
+    """
+    API endpoint to get one 256x256 tile of a location's heatmap
+    
+    At zoom level z the frame is split into 2**z x 2**z tiles, numbered
+    from the top left like map tiles, so a viewer can zoom into the heatmap
+    and only fetch what it shows. Tiles divide the width and height of the
+    frame alike, and are stretched to the frame's aspect ratio by the
+    viewer. 'since', 'until' and 'scale' are those of the whole heatmap.
+    """
+    try:
+        scale = request.args.get('scale', 'linear')
+        if scale not in ('linear', 'log') or zoom > 12:
+            return jsonify({
+                'success': False,
+                'message': 'scale must be linear or log, and zoom at most 12'
+            }), 400
+        try:
+            since, until = heatmap_window()
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'since and until must be ISO 8601 times'
+            }), 400
+        if column >= 2 ** zoom or row >= 2 ** zoom:
+            return jsonify({
+                'success': False,
+                'message': 'Tile not found'
+            }), 404
+        
+        heatmap = heatmap_store().query(location, since, until)
+        etag = 'heat-' + hashlib.sha1(repr((
+            location, since, until, zoom, column, row, scale, heatmap.changes, heatmap.buckets
+        )).encode('utf-8')).hexdigest()
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        # Imported here so starting the app doesn't load NumPy
+        from utils.heatmap import render_heatmap_tile
+        response = Response(render_heatmap_tile(heatmap.grid, zoom, column, row, scale), mimetype='image/png')
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error rendering change heatmap tile: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error rendering change heatmap tile: {str(e)}'
+        }), 500
@@ -73,9 +73,9 @@ class Camera {
     
     /**
      * Capture a frame from the video stream
-     * @returns {string} Base64 encoded image data
+     * @returns {Promise<{blob: Blob, url: string}|null>} JPEG image blob and an object URL for display
      */
-    captureImage() {
+    async captureImage() {
         try {
             const context = this.canvasElement.getContext('2d');
             
@@ -87,11 +87,20 @@ class Camera {
                 this.canvasElement.height
             );
             
-            // Convert canvas to base64 image
-            const imageData = this.canvasElement.toDataURL('image/jpeg', 0.9);
+            // Encode the canvas as a binary JPEG (no base64 inflation)
+            const blob = await new Promise(resolve => {
+                this.canvasElement.toBlob(resolve, 'image/jpeg', 0.9);
+            });
+            
+            if (!blob) {
+                throw new Error('Failed to encode image');
+            }
             
             this.updateStatus('Image captured');
-            return imageData;
+            return {
+                blob: blob,
+                url: URL.createObjectURL(blob)
+            };
             
         } catch (error) {
             this.updateStatus(`Capture error: ${error.message}`);
@@ -200,22 +200,28 @@ async function loadBaselines() {
 /**
  * Capture an image from the camera
  */
-function captureImage() {
+async function captureImage() {
     if (!camera) {
         showError('Camera not initialized');
         return;
     }
     
-    const imageData = camera.captureImage();
-    if (imageData) {
+    const capture = await camera.captureImage();
+    if (capture) {
+        // Release the previous capture unless it is still shown as the baseline
+        if (currentScan && (!baselineScan || baselineScan.imageData !== currentScan.imageData)) {
+            URL.revokeObjectURL(currentScan.imageData);
+        }
+        
         // Store current scan
         currentScan = {
-            imageData: imageData,
+            imageBlob: capture.blob,
+            imageData: capture.url,
             timestamp: new Date()
         };
         
         // Display in visualizer
-        visualizer.setComparisonImage(imageData);
+        visualizer.setComparisonImage(capture.url);
         visualizer.switchView('comparison');
         
         // Enable save and compare buttons
@@ -270,17 +276,18 @@ async function saveAsBaseline() {
             return;
         }
         
+        // Upload the JPEG as a binary multipart part instead of a base64 data URL
+        const formData = new FormData();
+        formData.append('image', currentScan.imageBlob, 'scan.jpg');
+        formData.append('name', scanName);
+        formData.append('is_baseline', 'true');
+        if (scanSession) {
+            formData.append('session_id', scanSession.id);
+        }
+        
         const response = await fetch('/api/scan/save', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                name: scanName,
-                image: currentScan.imageData,
-                is_baseline: true,
-                session_id: scanSession ? scanSession.id : null
-            })
+            body: formData
         });
         
         const data = await response.json();
@@ -330,17 +337,17 @@ async function compareWithBaseline() {
         showProcessing(true);
         updateStatus('Comparing images...');
         
+        const formData = new FormData();
+        formData.append('current_image', currentScan.imageBlob, 'scan.jpg');
+        formData.append('baseline_id', baselineId);
+        formData.append('save_scan', 'true');
+        if (scanSession) {
+            formData.append('session_id', scanSession.id);
+        }
+        
         const response = await fetch('/api/scan/compare', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                baseline_id: baselineId,
-                current_image: currentScan.imageData,
-                save_scan: true,
-                session_id: scanSession ? scanSession.id : null
-            })
+            body: formData
         });
         
         const data = await response.json();
@@ -396,11 +403,11 @@ async function selectBaseline() {
             baselineScan = {
                 id: data.scan.id,
                 name: data.scan.name,
-                imageData: data.scan.image
+                imageData: data.scan.image_url
             };
             
             // Set in visualizer
-            await visualizer.setBaseImage(data.scan.image);
+            await visualizer.setBaseImage(data.scan.image_url);
             
             // Enable compare button if current scan exists
             elements.compareWithBaselineBtn.disabled = !currentScan;
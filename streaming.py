@@ -0,0 +1,114 @@
+import os
+import time
+import logging
+
+import click
+
+from app import app, db
+from models import Scan, ScanSession
+from persistence import save_comparison
+
+logger = logging.getLogger(__name__)
+
+def run_stream(baseline_scan, source, threshold=30, persistence=5, learning_rate=0.02, frame_step=1,
+               session_name=None, engine='contours'):
+    """
+    Watch a video or frame directory for lasting changes against a baseline
+
+    Every frame with newly persistent changes is saved as a scan of the
+    baseline's location, in a session created for the run, with one
+    ChangeLog row per change, exactly like a saved comparison.
+
+    Args:
+        baseline_scan: Baseline Scan the background is seeded from
+        source: Path of a video file or a directory of frame images
+        threshold: Sensitivity threshold (0-255)
+        persistence: Consecutive frames a region must be seen in
+        learning_rate: Weight of each frame in the running background
+        frame_step: Process every frame_step-th frame only
+        session_name: Name of the session grouping the saved scans
+        engine: One of DETECTION_ENGINES
+
+    Returns:
+        Dictionary with the number of frames read, scans saved and changes
+        found, and the frame rate achieved
+    """
+    # Imported here because routes imports persistence, and so registering
+    # the command doesn't load the vision stack
+    from routes import get_baseline_features, location_zones, image_store, stored_image_fields
+    from utils.object_detector import detect_objects
+    from utils.pipeline import encode_image
+    from utils.stream_detector import StreamDetector, read_frames
+
+    features = get_baseline_features(baseline_scan, app.config["ALIGNMENT_BACKEND"],
+                                     app.config["ALIGNMENT_KEYPOINT_BUDGET"], location_zones(baseline_scan.location))
+    detector = StreamDetector(
+        features,
+        threshold=threshold,
+        persistence=persistence,
+        learning_rate=learning_rate,
+        residual_threshold=app.config["ALIGNMENT_RESIDUAL_THRESHOLD"],
+        iou_threshold=app.config["TRACK_IOU_THRESHOLD"],
+        engine=engine
+    )
+
+    session = ScanSession(
+        name=session_name or f"Stream {os.path.basename(os.path.normpath(source))}",
+        location=baseline_scan.location
+    )
+    db.session.add(session)
+    db.session.commit()
+
+    stats = {'frames': 0, 'scans': 0, 'changes': 0}
+
+    def counted(frames):
+        for item in frames:
+            stats['frames'] += 1
+            yield item
+
+    start = time.perf_counter()
+    for index, frame, aligned, changes in detector.run(counted(read_frames(source, frame_step))):
+        image_hash = image_store.put(encode_image(frame, 'jpeg'))
+        save_comparison(
+            baseline_scan,
+            image_hash,
+            changes,
+            detect_objects(aligned, changes, features.zones),
+            {
+                'name': f"{session.name} frame {index}",
+                'location': baseline_scan.location,
+                'session_id': session.id
+            },
+            image_fields=stored_image_fields(image_hash)
+        )
+        stats['scans'] += 1
+        stats['changes'] += len(changes)
+        logger.info(f"Frame {index}: {len(changes)} lasting changes")
+
+    elapsed = time.perf_counter() - start
+    stats['fps'] = stats['frames'] / elapsed if elapsed > 0 else 0.0
+    stats['session_id'] = session.id
+    return stats
+
+@app.cli.command('stream-detect')
+@click.argument('baseline_id', type=int)
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--threshold', default=30, help='Sensitivity threshold (0-255)')
+@click.option('--persistence', default=5, help='Consecutive frames a change must last')
+@click.option('--learning-rate', default=0.02, help='Background adaptation rate per frame')
+@click.option('--frame-step', default=1, help='Process every n-th frame')
+@click.option('--session-name', default=None, help='Name of the session holding the saved scans')
+@click.option('--engine', type=click.Choice(['contours', 'components']), default=None,
+              help='Change region extraction engine')
+def stream_detect_command(baseline_id, source, threshold, persistence, learning_rate, frame_step, session_name,
+                          engine):
+    """Detect lasting changes in a video or frame directory against a baseline scan"""
+    baseline_scan = db.session.get(Scan, baseline_id)
+    if not baseline_scan:
+        raise click.ClickException(f'Scan {baseline_id} not found')
+
+    stats = run_stream(baseline_scan, source, threshold=threshold, persistence=persistence,
+                       learning_rate=learning_rate, frame_step=frame_step, session_name=session_name,
+                       engine=engine or app.config["DETECTION_ENGINE"])
+    click.echo(f"Read {stats['frames']} frames at {stats['fps']:.1f} fps; saved {stats['scans']} scans "
+               f"with {stats['changes']} changes in session {stats['session_id']}")
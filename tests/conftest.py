@@ -0,0 +1,68 @@
+"""Fixtures running the app on a throwaway instance"""
+import io
+import os
+import logging
+import tempfile
+
+import cv2
+import pytest
+
+# The app reads its settings when imported, so the instance is set up first
+_instance = tempfile.mkdtemp(prefix='spacescanner-test-')
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_instance, 'test.db')}"
+os.environ["IMAGE_STORE_PATH"] = os.path.join(_instance, 'scan_images')
+os.environ["VISUALIZATION_CACHE_PATH"] = os.path.join(_instance, 'visualizations')
+os.environ["HEATMAP_PATH"] = os.path.join(_instance, 'heatmaps')
+os.environ["COMPUTE_WORKERS"] = "0"
+os.environ["COMPARE_JOB_THREADS"] = "0"
+
+logging.disable(logging.CRITICAL)
+
+def encode_png(image):
+    """PNG upload of an RGB image"""
+    return io.BytesIO(cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))[1].tobytes())
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    from migrations import upgrade_database
+
+    app = create_app()
+    with app.app_context():
+        upgrade_database()
+    return app
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def save_baseline(client):
+    """Save an RGB image as the baseline of a location, returning its scan ID"""
+    def save(image, location):
+        response = client.post('/api/scan/save', data={
+            'image': (encode_png(image), 'baseline.png'),
+            'is_baseline': 'true',
+            'location': location
+        }, content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()['scan_id']
+    return save
+
+@pytest.fixture
+def compare(client):
+    """Compare an RGB image with a baseline, returning the response JSON"""
+    def run(baseline_id, image, **options):
+        response = client.post('/api/scan/compare', data=dict({
+            'current_image': (encode_png(image), 'current.png'),
+            'baseline_id': str(baseline_id)
+        }, **{key: str(value).lower() if isinstance(value, bool) else str(value) for key, value in options.items()}),
+            content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+    return run
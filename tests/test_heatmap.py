@@ -0,0 +1,153 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import scene_pair
+from utils.heatmap import HeatmapStore
+
+DAY = 86400
+
+@pytest.fixture
+def store(tmp_path):
+    return HeatmapStore(str(tmp_path), grid_size=8, bucket_seconds=DAY, buckets=3)
+
+def add(store, location, boxes, day):
+    with store.updating(location) as heatmap:
+        heatmap.add(boxes, day * DAY + 10)
+
+def test_boxes_count_in_every_cell_they_overlap(store):
+    add(store, 'a', [(0, 0, 0.25, 0.25), (0.5, 0.5, 0.5, 0.5)], day=1)
+
+    heatmap = store.query('a')
+    assert heatmap.changes == 2
+    assert heatmap.grid[:2, :2].tolist() == [[1, 1], [1, 1]]
+    # A degenerate box still marks the cell it's in
+    assert heatmap.grid[4, 4] == 1
+    assert heatmap.grid.sum() == 5
+    assert store.query('other').changes == 0
+
+def test_ring_keeps_the_latest_buckets(store):
+    for day in range(1, 6):
+        add(store, 'a', [(0, 0, 0.1, 0.1)] * day, day)
+
+    # All time counts everything, windows only the buckets still kept
+    assert store.query('a').changes == 15
+    assert [count for _, count in store.query('a', since=0).buckets] == [3, 4, 5]
+    window = store.query('a', since=4 * DAY, until=5 * DAY)
+    assert window.changes == 9
+    assert window.buckets == [(4 * DAY, 4), (5 * DAY, 5)]
+
+    # Changes older than the ring only count for all time
+    add(store, 'a', [(0, 0, 0.1, 0.1)], day=1)
+    assert store.query('a').changes == 16
+    assert store.query('a', since=0).changes == 12
+
+def test_reset_clears_counts_and_the_high_water_mark(store):
+    with store.updating('a') as heatmap:
+        heatmap.add([(0, 0, 1, 1)], DAY)
+        heatmap.applied = 7
+
+    store.reset('a')
+    assert store.query('a').changes == 0
+    assert not store.query('a').grid.any()
+    with store.updating('a') as heatmap:
+        assert heatmap.applied == 0
+
+@pytest.fixture
+def location_changes(save_baseline, compare):
+    """Compare-and-save scans at a location, returning the change count of each"""
+    baseline, current, _, _ = scene_pair(seed=7, size=(640, 480))
+    baseline_id = save_baseline(baseline, 'heatmap')
+
+    def run():
+        return len(compare(baseline_id, current, save_scan=True)['changes'])
+    return run
+
+def test_changes_are_applied_once_and_caught_up_after_failures(app, location_changes):
+    from heatmaps import heatmap_store, update_location_heatmap, rebuild_location_heatmap
+
+    first = location_changes()
+    assert first > 0
+    with app.app_context():
+        assert heatmap_store().query('heatmap').changes == first
+
+    # A failed update leaves the changes to the next one
+    with mock.patch.object(HeatmapStore, 'updating', side_effect=OSError('No space left on device')):
+        second = location_changes()
+    with app.app_context():
+        assert heatmap_store().query('heatmap').changes == first
+    third = location_changes()
+
+    with app.app_context():
+        heatmap = heatmap_store().query('heatmap')
+        assert heatmap.changes == first + second + third
+        assert update_location_heatmap('heatmap') == 0
+
+        grid = heatmap.grid.copy()
+        assert rebuild_location_heatmap('heatmap') == heatmap.changes
+        assert np.array_equal(heatmap_store().query('heatmap').grid, grid)
+
+def test_heatmap_endpoint(client, location_changes):
+    changes = location_changes()
+
+    data = client.get('/api/locations/heatmap/heatmap?format=json').get_json()
+    assert data['change_count'] >= changes
+    assert sum(bucket['change_count'] for bucket in data['buckets']) == data['change_count']
+
+    response = client.get('/api/locations/heatmap/heatmap?width=64')
+    assert response.mimetype == 'image/png'
+    revalidated = client.get('/api/locations/heatmap/heatmap?width=64',
+                             headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+
+    assert client.get('/api/locations/heatmap/heatmap?format=gif').status_code == 400
+
+def test_changes_are_placed_in_the_baseline_frame(app, save_baseline, compare):
+    import cv2
+    from heatmaps import heatmap_store
+
+    baseline, current, _, _ = scene_pair(seed=9, size=(640, 480))
+    # The same changes, once compared at the baseline's resolution and once
+    # at twice that
+    for location, image in (('heatmap-same', current), ('heatmap-larger', cv2.resize(current, (1280, 960)))):
+        baseline_id = save_baseline(baseline, location)
+        assert compare(baseline_id, image, save_scan=True)['changes']
+
+    with app.app_context():
+        same, larger = (heatmap_store().query(location) for location in ('heatmap-same', 'heatmap-larger'))
+    assert same.changes == larger.changes
+    assert np.array_equal(same.grid, larger.grid)
+
+def test_tiles_join_up_into_the_heatmap():
+    import io
+    from PIL import Image
+    from utils.heatmap import render_heatmap_tile
+
+    grid = np.zeros((8, 8), np.uint32)
+    grid[1:3, 5:7] = 4
+    grid[6, 0] = 1
+
+    def tile(zoom, column, row, size):
+        return np.asarray(Image.open(io.BytesIO(render_heatmap_tile(grid, zoom, column, row, tile_size=size))))
+
+    whole = tile(0, 0, 0, 64)
+    stitched = np.vstack([np.hstack([tile(1, column, row, 32) for column in range(2)]) for row in range(2)])
+    assert np.array_equal(whole, stitched)
+    # The peak is the whole grid's, not the tile's
+    assert tile(1, 0, 1, 32).max() < whole.max()
+
+    with pytest.raises(ValueError):
+        render_heatmap_tile(grid, 1, 2, 0)
+
+def test_heatmap_tile_endpoint(client, location_changes):
+    location_changes()
+
+    response = client.get('/api/locations/heatmap/heatmap/1/1/0.png?scale=log')
+    assert response.status_code == 200 and response.mimetype == 'image/png'
+    revalidated = client.get('/api/locations/heatmap/heatmap/1/1/0.png?scale=log',
+                             headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+
+    assert client.get('/api/locations/heatmap/heatmap/1/2/0.png').status_code == 404
+    assert client.get('/api/locations/heatmap/heatmap/13/0/0.png').status_code == 400
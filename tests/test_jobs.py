@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timedelta
+from unittest import mock
+
+import cv2
+import pytest
+
+from benchmarks.fixtures import scene_pair
+
+class WorkerDied(BaseException):
+    """Stands in for the worker process dying"""
+
+@pytest.fixture
+def job_images(save_baseline):
+    baseline, current, _, _ = scene_pair(seed=4, size=(640, 480))
+    baseline_id = save_baseline(baseline, 'jobs')
+
+    from routes import image_store
+    image_hash = image_store.put(cv2.imencode('.png', cv2.cvtColor(current, cv2.COLOR_RGB2BGR))[1].tobytes())
+    return baseline_id, image_hash
+
+def expire_lease(app, job):
+    from app import db
+
+    job.started_at = datetime.utcnow() - timedelta(seconds=app.config["COMPARE_JOB_LEASE"] + 1)
+    db.session.commit()
+
+def test_running_jobs_are_reclaimed_once_their_lease_expires(app, app_context, job_images):
+    from jobs import enqueue_compare_job, claim_next_job
+
+    job = enqueue_compare_job(*job_images, {})
+    claimed = claim_next_job()
+    assert claimed.id == job.id
+    assert claimed.status == 'running' and claimed.attempts == 1
+
+    # Still leased to its worker
+    assert claim_next_job() is None
+
+    expire_lease(app, claimed)
+    reclaimed = claim_next_job()
+    assert reclaimed.id == job.id
+    assert reclaimed.attempts == 2
+
+def test_job_reclaimed_after_saving_is_not_saved_twice(app, app_context, job_images):
+    from app import db
+    from models import Comparison
+    from jobs import enqueue_compare_job, claim_next_job, run_job
+
+    baseline_id, image_hash = job_images
+    job = enqueue_compare_job(baseline_id, image_hash, {'save_scan': True})
+
+    # The worker dies after saving the comparison, before finishing the job
+    with mock.patch('jobs._finish_job', side_effect=WorkerDied):
+        with pytest.raises(WorkerDied):
+            run_job(claim_next_job())
+    db.session.rollback()
+
+    job = db.session.get(type(job), job.id)
+    assert job.status == 'running' and job.comparison_id is not None
+
+    expire_lease(app, job)
+    run_job(claim_next_job())
+
+    job = db.session.get(type(job), job.id)
+    assert job.status == 'completed'
+    comparisons = Comparison.query.filter_by(baseline_id=baseline_id).all()
+    assert [comparison.id for comparison in comparisons] == [job.comparison_id]
+
+    result = json.loads(job.result)
+    assert result['comparison_id'] == job.comparison_id
+    assert result['scan_id'] == comparisons[0].scan_id is not None
+    assert result['change_count'] == len(result['changes']) > 0
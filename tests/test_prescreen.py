@@ -0,0 +1,127 @@
+import io
+import hashlib
+
+import pytest
+from PIL import Image
+
+from benchmarks.fixtures import textured_scene
+from utils.prescreen import image_signature, signature_distance, signature_mask, detectable_distance, SIGNATURE_SIZE
+from utils.zones import Zones
+
+def signature(image):
+    return image_signature(Image.fromarray(image))
+
+@pytest.fixture(scope='module')
+def scene():
+    return textured_scene(seed=2, size=(800, 600))
+
+def test_signature_distance_is_the_largest_cell_difference(scene):
+    changed = scene.copy()
+    changed[:60, :75] = 255
+
+    assert signature_distance(signature(scene), signature(scene)) == 0
+    assert signature_distance(signature(scene), signature(changed)) > 100
+    assert signature_distance(signature(scene), b'') is None
+
+def test_signature_mask_ignores_cells_outside_the_zones(scene):
+    changed = scene.copy()
+    changed[:60, :75] = 255
+    right_half = Zones((((0.5, 0), (1, 0), (1, 1), (0.5, 1)),), ())
+
+    assert signature_distance(signature(scene), signature(changed), signature_mask(right_half)) == 0
+
+def test_detectable_distance_shrinks_with_the_cell_area():
+    bounds = [detectable_distance((width, width * 3 // 4), 30, 100) for width in (100, 200, 400, 800, 1600)]
+    assert bounds == sorted(bounds, reverse=True)
+    assert bounds[-2:] == [0, -1]
+
+@pytest.mark.parametrize('size', [(800, 600), (400, 300), (200, 150)])
+def test_detectable_distance_keeps_corner_changes(size):
+    # The smallest detectable change, centered on a cell corner, always
+    # moves the signature by more than the bound
+    width, height = size
+    threshold, area = 30, 100
+    base = textured_scene(seed=3, size=size, clutter=0)
+    changed = base.astype(int)
+    x, y = width // SIGNATURE_SIZE * 4, height // SIGNATURE_SIZE * 4
+    changed[y - 5:y + 5, x - 5:x + 5] += threshold
+    changed = changed.clip(0, 255).astype(base.dtype)
+
+    assert signature_distance(signature(base), signature(changed)) > detectable_distance(size, threshold, area)
+
+def test_prescreen_is_disabled_by_default(app, save_baseline, compare, scene):
+    assert app.config["PRESCREEN_MAX_DISTANCE"] == -1
+
+    baseline_id = save_baseline(scene, 'prescreen-default')
+    result = compare(baseline_id, scene)
+    assert result['prescreen'] is None
+    assert result['alignment'] != 'skipped'
+
+def test_bound_is_capped_by_the_smallest_detectable_change(save_baseline, compare, scene):
+    baseline_id = save_baseline(scene, 'prescreen-capped')
+
+    unchanged = compare(baseline_id, scene, prescreen_max_distance=4)
+    assert unchanged['prescreen'] == dict(unchanged['prescreen'], max_distance=0, skipped=True)
+
+    # A small change on a cell corner is compared, not skipped
+    changed = scene.copy()
+    changed[68:82, 93:107] = 255
+    result = compare(baseline_id, changed, prescreen_max_distance=4)
+    assert not result['prescreen']['skipped']
+    assert result['changes']
+
+def test_pyramid_mode_is_never_prescreened(save_baseline, compare, scene):
+    baseline_id = save_baseline(scene, 'prescreen-pyramid')
+    result = compare(baseline_id, scene, prescreen_max_distance=4, detection_mode='pyramid')
+    assert result['prescreen'] is None
+
+def test_skipped_and_compared_unchanged_frames_report_the_same_objects(save_baseline, compare, scene):
+    baseline_id = save_baseline(scene, 'prescreen-objects')
+
+    skipped = compare(baseline_id, scene, prescreen_max_distance=0)
+    compared = compare(baseline_id, scene, prescreen=False)
+    assert skipped['prescreen']['skipped']
+    assert compared['prescreen'] is None
+    assert skipped['changes'] == compared['changes'] == []
+    assert skipped['objects'] == compared['objects'] == []
+
+def test_image_store_tells_new_images_apart(tmp_path):
+    from utils.image_store import ImageStore
+
+    store = ImageStore(str(tmp_path))
+    digest, created = store.add(b'image')
+    assert created
+    assert store.add(b'image') == (digest, False)
+    assert store.add_stream(io.BytesIO(b'image')) == (digest, False)
+    assert store.add_stream(io.BytesIO(b'other'))[1]
+    assert store.read(digest) == b'image'
+    assert not list(tmp_path.glob('*.tmp'))
+
+def test_only_uploads_the_request_created_are_discarded(app, monkeypatch, save_baseline, compare, scene):
+    from conftest import encode_png
+    from app import db
+    from models import Comparison
+    from routes import image_store
+
+    monkeypatch.setitem(app.config, "PRESCREEN_DISCARD_IMAGES", True)
+    baseline_id = save_baseline(scene, 'prescreen-discard')
+
+    def near_copy(delta):
+        # Different bytes, the same signature
+        image = scene.copy()
+        image[0, 0] = image[0, 0].astype(int) + delta
+        return image, hashlib.sha256(encode_png(image).getvalue()).hexdigest()
+
+    image, digest = near_copy(1)
+    result = compare(baseline_id, image, prescreen_max_distance=0)
+    assert result['prescreen']['skipped']
+    with app.app_context():
+        assert db.session.get(Comparison, result['comparison_id']).image_hash != digest
+    assert not image_store.exists(digest)
+
+    # The same bytes stored before the request, e.g. by a concurrent upload
+    # still being compared, stay
+    image, digest = near_copy(-1)
+    image_store.put(encode_png(image).getvalue())
+    assert compare(baseline_id, image, prescreen_max_distance=0)['prescreen']['skipped']
+    assert image_store.exists(digest)
@@ -0,0 +1,41 @@
+import cv2
+import pytest
+
+from benchmarks.fixtures import scene_pair
+from utils.pipeline import prepare_baseline_image, run_comparison
+
+def png(image):
+    return cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))[1].tobytes()
+
+@pytest.fixture(scope='module')
+def scenes():
+    baseline, current, _, truth = scene_pair(seed=10, size=(1600, 1200), inserted=4, removed=4)
+    return png(baseline), current, truth
+
+def boxes(result):
+    return sorted((change['x'], change['y'], change['width'], change['height']) for change in result['changes'])
+
+def test_pyramid_changes_are_in_full_resolution_baseline_coordinates(scenes):
+    baseline, current, truth = scenes
+    result = run_comparison(prepare_baseline_image(baseline), png(current), mode='pyramid', baseline_source=baseline)
+
+    found = boxes(result)
+    assert len(found) == len(truth)
+    for (_, (x, y, w, h)), (fx, fy, fw, fh) in zip(sorted(truth, key=lambda t: t[1]), found):
+        assert abs(fx - x) <= 3 and abs(fy - y) <= 3 and abs(fw - w) <= 6 and abs(fh - h) <= 6
+
+def test_pyramid_handles_current_images_of_another_shape(scenes):
+    baseline, current, truth = scenes
+    features = prepare_baseline_image(baseline)
+    # The left part of the frame, in another aspect ratio than the baseline
+    cropped = current[:, :1200].copy()
+
+    full = run_comparison(features, png(current), mode='pyramid', baseline_source=baseline)
+    result = run_comparison(features, png(cropped), mode='pyramid', baseline_source=baseline)
+
+    expected = [box for box in boxes(full) if box[0] + box[2] < 1150]
+    found = [box for box in boxes(result) if box[0] + box[2] < 1150]
+    assert expected
+    assert len(found) == len(expected)
+    for a, b in zip(expected, found):
+        assert max(abs(u - v) for u, v in zip(a, b)) <= 3
@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import scene_pair
+from utils.image_processor import preprocess_image
+from utils.change_detector import detect_changes
+from utils.tiling import Tiling, TiledComponents, tile_grid
+
+TILING = Tiling(tile_size=128, threads=4)
+
+@pytest.fixture(scope='module')
+def frames():
+    baseline, current, _, _ = scene_pair(seed=5, size=(1280, 960), inserted=6, removed=6)
+    return baseline, current
+
+def without_ids(changes):
+    return sorted((dict(change, id=None) for change in changes), key=lambda change: (change['x'], change['y']))
+
+def test_tiling_splits_only_frames_larger_than_a_tile():
+    assert TILING.splits((600, 800))
+    assert not TILING.splits((128, 128))
+    assert not Tiling(tile_size=128, threads=1).splits((600, 800))
+
+def test_tile_grid_covers_the_frame():
+    grid = tile_grid((300, 260), 128)
+    assert [tile[:2] for tile in grid[-1]] == [(256, 300)] * 3
+    assert [tile[2:] for tile in grid[0]] == [(0, 128), (128, 256), (256, 260)]
+
+def test_tiled_preprocessing_matches_serial(frames):
+    serial = preprocess_image(frames[0], max_dim=None)
+    tiled = preprocess_image(frames[0], max_dim=None, tiling=TILING)
+    # Only the rounding of CLAHE's interpolation weights may differ
+    assert np.abs(serial.astype(int) - tiled).max() <= 1
+
+@pytest.mark.parametrize('engine', ['contours', 'components'])
+def test_tiled_detection_matches_serial(frames, engine):
+    baseline, current = (preprocess_image(frame, max_dim=None) for frame in frames)
+    serial_changes, serial_mask, _ = detect_changes(baseline, current, aligned_current=current,
+                                                    render=False, engine=engine)
+    tiled_changes, tiled_mask, _ = detect_changes(baseline, current, aligned_current=current,
+                                                  render=False, engine=engine, tiling=TILING)
+
+    assert serial_changes
+    assert np.array_equal(serial_mask, tiled_mask)
+    # Regions may be found in another order, and numbered accordingly
+    assert without_ids(serial_changes) == without_ids(tiled_changes)
+
+def test_regions_crossing_seams_are_merged():
+    mask = np.zeros((300, 300), np.uint8)
+    # A block over the corner where four tiles meet, a diagonal line
+    # crossing tiles only through their corners, and a U shape whose arms
+    # only join in the tile below
+    cv2.rectangle(mask, (50, 50), (80, 80), 255, -1)
+    for i in range(60, 250):
+        mask[i, i] = 255
+    cv2.rectangle(mask, (170, 20), (180, 140), 255, -1)
+    cv2.rectangle(mask, (230, 20), (240, 140), 255, -1)
+    cv2.rectangle(mask, (170, 130), (240, 140), 255, -1)
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    expected = sorted(tuple(int(v) for v in row) for row in stats[1:])
+
+    components = TiledComponents.of(mask, Tiling(tile_size=64, threads=4))
+    assert len(components) == count - 1
+    found = sorted(tuple(int(v) for v in box) + (int(area),)
+                   for box, area in zip(components.boxes, components.areas))
+    assert found == expected
@@ -0,0 +1,108 @@
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+START = datetime(2026, 1, 1)
+
+@pytest.fixture
+def add_scan(app_context):
+    """Store a scan of a location with changes at the given boxes, returning its ID"""
+    from app import db
+    from models import Scan, ChangeLog
+
+    baselines = {}
+
+    def add(location, boxes, day=0):
+        if location not in baselines:
+            baseline = Scan(name='baseline', is_baseline=True, location=location)
+            db.session.add(baseline)
+            db.session.flush()
+            baselines[location] = baseline.id
+        scan = Scan(name='scan', location=location, timestamp=START + timedelta(days=day))
+        db.session.add(scan)
+        db.session.flush()
+        db.session.add_all(ChangeLog(scan_id=scan.id, baseline_id=baselines[location], change_type='added',
+                                     position_x=x, position_y=y, size_w=w, size_h=h,
+                                     timestamp=START + timedelta(days=day))
+                           for x, y, w, h in boxes)
+        db.session.commit()
+        return scan.id
+    return add
+
+def track_ids(scan_id):
+    from models import ChangeLog
+    return [change.track_id for change in ChangeLog.query.filter_by(scan_id=scan_id).order_by(ChangeLog.id)]
+
+def test_overlapping_changes_continue_a_track(add_scan):
+    from models import ChangeTrack
+    from tracks import update_location_tracks
+
+    first = add_scan('tracks', [(10, 10, 50, 50), (200, 200, 40, 40)])
+    second = add_scan('tracks', [(14, 12, 50, 50), (400, 10, 20, 20)], day=1)
+    assert update_location_tracks('tracks') == 4
+
+    first_ids, second_ids = track_ids(first), track_ids(second)
+    assert None not in first_ids + second_ids
+    assert second_ids[0] == first_ids[0]
+    assert len(set(first_ids + second_ids)) == 3
+
+    track = ChangeTrack.query.filter_by(id=first_ids[0]).one()
+    assert track.observations == 2
+    assert (track.position_x, track.position_y, track.first_scan_id, track.last_scan_id) == (14, 12, first, second)
+    assert update_location_tracks('tracks') == 0
+
+def test_tracks_from_the_cache_and_the_database_agree(add_scan):
+    from tracks import update_location_tracks, tracker_cache
+
+    first = add_scan('cached', [(10, 10, 50, 50)])
+    update_location_tracks('cached')
+    cached = add_scan('cached', [(12, 10, 50, 50)], day=1)
+    update_location_tracks('cached')
+
+    tracker_cache.invalidate('cached')
+    reloaded = add_scan('cached', [(14, 10, 50, 50)], day=2)
+    update_location_tracks('cached')
+    assert track_ids(first) == track_ids(cached) == track_ids(reloaded)
+
+def test_idle_tracks_retire(app, add_scan):
+    from tracks import update_location_tracks, tracker_cache, _load_tracker
+
+    with mock.patch.dict(app.config, {"TRACK_MAX_IDLE_DAYS": 10}):
+        first = add_scan('idle', [(10, 10, 50, 50), (300, 300, 50, 50)])
+        # The second region keeps being seen, the first one isn't for 12 days
+        add_scan('idle', [(300, 300, 50, 50)], day=6)
+        add_scan('idle', [(300, 300, 50, 50)], day=12)
+        back = add_scan('idle', [(10, 10, 50, 50), (300, 300, 50, 50)], day=13)
+        update_location_tracks('idle')
+
+        assert track_ids(back)[0] != track_ids(first)[0]
+        assert track_ids(back)[1] == track_ids(first)[1]
+
+        # Reloading from the database only brings back the live tracks
+        tracker_cache.invalidate('idle')
+        assert set(_load_tracker('idle').tracker.boxes) == set(track_ids(back))
+
+def test_concurrent_updates_claim_the_location(app, add_scan):
+    from models import ChangeLog, ChangeTrack, TrackState
+    from tracks import update_location_tracks
+
+    for day in range(20):
+        add_scan('claimed', [(10 + day % 3, 10, 50, 50)], day=day)
+
+    def run():
+        with app.app_context():
+            update_location_tracks('claimed', scans_per_batch=3)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    track = ChangeTrack.query.filter_by(location='claimed').one()
+    assert track.observations == 20
+    assert ChangeLog.query.filter_by(track_id=track.id).count() == 20
+    # One version per batch that tracked changes
+    assert TrackState.query.filter_by(location='claimed').one().version == 7
@@ -0,0 +1,25 @@
+import json
+
+from benchmarks.fixtures import scene_pair
+
+def test_visualizations_are_keyed_by_their_content(app, save_baseline, compare, client):
+    baseline, current, _, _ = scene_pair(seed=8, size=(640, 480))
+    baseline_id = save_baseline(baseline, 'visualization')
+    result = compare(baseline_id, current)
+
+    response = client.get(result['visualization'])
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert client.get(result['visualization'], headers={'If-None-Match': etag}).status_code == 304
+
+    # A comparison whose content changed no longer matches its cached image
+    from app import db
+    from models import Comparison
+    with app.app_context():
+        comparison = db.session.get(Comparison, result['comparison_id'])
+        comparison.changes = json.dumps(json.loads(comparison.changes)[:1])
+        db.session.commit()
+
+    response = client.get(result['visualization'], headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
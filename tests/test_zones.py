@@ -0,0 +1,80 @@
+import pytest
+
+from benchmarks.fixtures import scene_pair
+from utils.image_processor import preprocess_image, zone_mask, feature_mask
+from utils.change_detector import detect_changes
+from utils.zones import Zones, parse_zones, load_zones, zones_data
+
+SQUARE = [[0.25, 0.25], [0.75, 0.25], [0.75, 0.75], [0.25, 0.75]]
+LEFT_HALF = Zones((((0, 0), (0.5, 0), (0.5, 1), (0, 1)),), ())
+
+@pytest.mark.parametrize('data', [
+    [SQUARE],
+    {'include': [SQUARE], 'other': []},
+    {'include': SQUARE},
+    {'include': [SQUARE[:2]]},
+    {'exclude': [[[0, 0], [1, 0], [1.5, 1]]]},
+    {'include': [[[0, 0], [1, 0], [True, 1]]]},
+])
+def test_malformed_zones_are_rejected(data):
+    with pytest.raises(ValueError):
+        parse_zones(data)
+
+def test_zones_round_trip():
+    zones = parse_zones({'include': [SQUARE]})
+    assert zones == Zones((tuple(map(tuple, SQUARE)),), ())
+    assert parse_zones(zones_data(zones)) == zones
+    assert parse_zones({'include': [], 'exclude': []}) is None
+    assert load_zones(None) is None
+
+def test_zone_mask_covers_the_included_area():
+    mask, (x, y, width, height) = zone_mask(parse_zones({'include': [SQUARE]}), (200, 400))
+    assert (x, y, width, height) == (100, 50, 201, 101)
+    assert mask[100, 200] == 255 and mask[10, 10] == 0
+    assert not mask.flags.writeable
+
+def test_feature_mask_only_leaves_out_excluded_areas():
+    assert feature_mask(parse_zones({'include': [SQUARE]}), (200, 400)) is None
+    mask = feature_mask(parse_zones({'exclude': [SQUARE]}), (200, 400))
+    assert mask[100, 200] == 0 and mask[10, 10] == 255
+
+@pytest.fixture(scope='module')
+def frames():
+    baseline, current, _, truth = scene_pair(seed=6, size=(800, 600), inserted=4, removed=4)
+    return preprocess_image(baseline), preprocess_image(current), truth
+
+def test_changes_outside_the_zones_are_dropped(frames):
+    baseline, current, truth = frames
+    everywhere, _, _ = detect_changes(baseline, current, aligned_current=current, render=False)
+    changes, mask, _ = detect_changes(baseline, current, aligned_current=current, render=False, zones=LEFT_HALF)
+
+    # Changes are reported in frame coordinates, and only the left half
+    # is monitored
+    assert any(box[0] + box[2] > 400 for _, box in truth)
+    assert changes
+    assert all(change['x'] + change['width'] <= 401 for change in changes)
+    # The changes in the left half are kept (their edges on the zone
+    # boundary may differ by the closing's reach)
+    assert sorted((change['x'], change['y']) for change in changes) == \
+        sorted((change['x'], change['y']) for change in everywhere if change['x'] < 400)
+    assert mask.shape == baseline.shape
+    assert not mask[:, 401:].any()
+
+def test_nothing_is_compared_without_a_monitored_area(frames):
+    baseline, current, _ = frames
+    covered = Zones(LEFT_HALF.include, LEFT_HALF.include)
+    changes, mask, _ = detect_changes(baseline, current, aligned_current=current, render=False, zones=covered)
+    assert changes == []
+    assert not mask.any()
+
+def test_profile_zones_are_validated(client):
+    response = client.put('/api/locations/zones-profile/profile', json={'zones': {'include': [SQUARE[:2]]}})
+    assert response.status_code == 400
+
+    response = client.put('/api/locations/zones-profile/profile', json={'zones': {'include': [SQUARE]}})
+    assert response.status_code == 200
+    assert client.get('/api/locations/zones-profile/profile').get_json()['profile']['zones'] == \
+        {'include': [SQUARE], 'exclude': []}
+
+    client.put('/api/locations/zones-profile/profile', json={'zones': None})
+    assert client.get('/api/locations/zones-profile/profile').get_json()['profile']['zones'] is None
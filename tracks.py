@@ -0,0 +1,336 @@
+import os
+import queue
+import threading
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from itertools import groupby
+
+from sqlalchemy import func, insert, update, bindparam
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import Scan, ChangeLog, ChangeTrack, TrackState
+from utils.feature_cache import BaselineFeatureStore
+from utils.region_tracker import RegionTracker
+
+logger = logging.getLogger(__name__)
+
+# Region trackers of recently updated locations, keyed by location and
+# validated against the location's TrackState version
+tracker_cache = BaselineFeatureStore(app.config["TRACKER_CACHE_SIZE"])
+
+# ChangeTrack columns set from a track's latest change
+_TRACK_POSITION = ('position_x', 'position_y', 'size_w', 'size_h', 'last_scan_id', 'last_seen', 'last_change_type')
+
+def _claim_location(location):
+    """
+    Claim a location's tracks until the current transaction ends
+
+    Bumping the version of the location's TrackState row locks it (the
+    whole database on SQLite), so updates of a location from any thread or
+    process run one at a time.
+
+    Returns:
+        Version of the location's tracks before the claim
+    """
+    while True:
+        version = db.session.execute(
+            update(TrackState).where(TrackState.location == location)
+            .values(version=TrackState.version + 1).returning(TrackState.version)
+        ).scalar()
+        if version is not None:
+            return version - 1
+
+        try:
+            with db.session.begin_nested():
+                db.session.add(TrackState(location=location, version=0))
+        except IntegrityError:
+            # Another update created the row first
+            pass
+
+def _untracked_scans(location, limit):
+    """IDs of the oldest scans of a location with untracked changes"""
+    return [scan_id for (scan_id,) in db.session.query(ChangeLog.scan_id)
+            .join(Scan, ChangeLog.scan_id == Scan.id)
+            .filter(Scan.location == location, ChangeLog.track_id.is_(None))
+            .group_by(ChangeLog.scan_id)
+            .order_by(ChangeLog.scan_id)
+            .limit(limit)]
+
+class LiveTracks:
+    """
+    Region tracker of a location's live tracks.
+
+    A track retires once the location has gone TRACK_MAX_IDLE_DAYS without
+    a change matching it; its row is kept, but later changes can no longer
+    continue it. Idleness is measured from the location's newest change,
+    not the clock, so a location that stops being scanned keeps its tracks.
+    """
+
+    def __init__(self):
+        self.tracker = RegionTracker(iou_threshold=app.config["TRACK_IOU_THRESHOLD"])
+        max_idle = app.config["TRACK_MAX_IDLE_DAYS"]
+        self.max_idle = timedelta(days=max_idle) if max_idle > 0 else None
+        # Track ID -> time last seen, in the order the tracks were last seen
+        self._last_seen = OrderedDict()
+
+    def see(self, track_id, box, timestamp):
+        """Start a track, or move it to the box it was seen at"""
+        self.tracker.add(track_id, box)
+        self._last_seen[track_id] = timestamp
+        self._last_seen.move_to_end(track_id)
+
+    def rename(self, old_id, new_id):
+        """Give a track a new ID, if it is still live"""
+        if old_id in self._last_seen:
+            self.see(new_id, self.tracker.boxes[old_id], self._last_seen.pop(old_id))
+            self.tracker.remove(old_id)
+
+    def retire(self, now):
+        """Retire the tracks not seen within the idle window before now"""
+        if self.max_idle is None or now is None:
+            return
+        cutoff = now - self.max_idle
+        while self._last_seen:
+            track_id, last_seen = next(iter(self._last_seen.items()))
+            if last_seen is not None and last_seen >= cutoff:
+                break
+            del self._last_seen[track_id]
+            self.tracker.remove(track_id)
+
+    def __len__(self):
+        return len(self.tracker)
+
+def _load_tracker(location):
+    """Build the tracker of a location from its stored live tracks"""
+    live = LiveTracks()
+    rows = db.session.query(
+        ChangeTrack.id, ChangeTrack.position_x, ChangeTrack.position_y, ChangeTrack.size_w, ChangeTrack.size_h,
+        ChangeTrack.last_seen
+    ).filter(ChangeTrack.location == location)
+    if live.max_idle is not None:
+        newest = db.session.query(func.max(ChangeTrack.last_seen)).filter(
+            ChangeTrack.location == location
+        ).scalar()
+        if newest is not None:
+            rows = rows.filter(ChangeTrack.last_seen >= newest - live.max_idle)
+    for track_id, x, y, w, h, last_seen in rows.order_by(ChangeTrack.last_seen, ChangeTrack.id):
+        live.see(track_id, (x, y, w, h), last_seen)
+    return live
+
+def _track_changes(live, location, changes):
+    """
+    Assign untracked changes, scan by scan, to new or existing tracks
+
+    Tracks and assignments are gathered in memory and written with one
+    executemany statement each: new tracks are inserted, existing ones
+    updated in place, and every change is pointed at its track.
+
+    Args:
+        live: LiveTracks of the location, updated in place
+        location: Scan location
+        changes: Untracked ChangeLog rows ordered by scan and ID
+    """
+    # New tracks get negative keys until they are inserted
+    new_tracks = {}
+    updated_tracks = {}
+    assignments = []
+    for scan_id, rows in groupby(changes, key=lambda change: change.scan_id):
+        rows = list(rows)
+        live.retire(rows[0].timestamp)
+        boxes = [(row.position_x, row.position_y, row.size_w, row.size_h) for row in rows]
+        for row, box, key in zip(rows, boxes, live.tracker.match(boxes)):
+            if key is None:
+                key = -len(new_tracks) - 1
+                new_tracks[key] = {'location': location, 'first_scan_id': scan_id, 'first_seen': row.timestamp,
+                                   'observations': 0}
+            values = new_tracks[key] if key < 0 else updated_tracks.setdefault(key, {'track': key, 'observed': 0})
+            values.update(position_x=box[0], position_y=box[1], size_w=box[2], size_h=box[3],
+                          last_scan_id=scan_id, last_seen=row.timestamp, last_change_type=row.change_type)
+            values['observations' if key < 0 else 'observed'] += 1
+            live.see(key, box, row.timestamp)
+            assignments.append((row.id, key))
+
+    track_ids = {}
+    if new_tracks:
+        inserted = db.session.scalars(
+            insert(ChangeTrack).returning(ChangeTrack.id, sort_by_parameter_order=True), list(new_tracks.values())
+        ).all()
+        track_ids = dict(zip(new_tracks, inserted))
+        for key, track_id in track_ids.items():
+            live.rename(key, track_id)
+
+    if updated_tracks:
+        tracks = ChangeTrack.__table__
+        db.session.execute(
+            update(tracks).where(tracks.c.id == bindparam('track')).values(
+                observations=tracks.c.observations + bindparam('observed'),
+                **{name: bindparam(name) for name in _TRACK_POSITION}
+            ),
+            list(updated_tracks.values())
+        )
+
+    db.session.execute(update(ChangeLog), [{'id': change_id, 'track_id': track_ids.get(key, key)}
+                                           for change_id, key in assignments])
+
+def update_location_tracks(location, scans_per_batch=50):
+    """
+    Assign a location's untracked changes to region tracks
+
+    Changes are processed scan by scan in chronological order. Only the
+    untracked changes are read, so adding a scan costs time proportional to
+    its changes; the first call for a location also tracks its existing
+    history. Changes only continue live tracks, see LiveTracks.
+
+    Args:
+        location: Scan location
+        scans_per_batch: Scans processed per transaction
+
+    Returns:
+        Number of changes assigned to tracks
+    """
+    tracked = 0
+    live = version = None
+    try:
+        # Only claim the location when there is something to track
+        while _untracked_scans(location, 1):
+            previous = _claim_location(location)
+            if live is None or previous != version:
+                live = tracker_cache.get(location, previous)
+                if live is None:
+                    live = _load_tracker(location)
+
+            # Read under the claim, another update may have tracked them
+            scan_ids = _untracked_scans(location, scans_per_batch)
+            if not scan_ids:
+                # Release the claim without bumping the version
+                db.session.rollback()
+                tracker_cache.put(location, previous, live)
+                break
+
+            changes = db.session.query(
+                ChangeLog.id, ChangeLog.scan_id, ChangeLog.position_x, ChangeLog.position_y,
+                ChangeLog.size_w, ChangeLog.size_h, ChangeLog.timestamp, ChangeLog.change_type
+            ).filter(
+                ChangeLog.scan_id.in_(scan_ids), ChangeLog.track_id.is_(None)
+            ).order_by(ChangeLog.scan_id, ChangeLog.id).all()
+            _track_changes(live, location, changes)
+
+            db.session.commit()
+            version = previous + 1
+            tracker_cache.put(location, version, live)
+            tracked += len(changes)
+
+        return tracked
+
+    except Exception:
+        # Drop the tracker before the rollback releases the claim
+        tracker_cache.invalidate(location)
+        db.session.rollback()
+        raise
+
+class TrackWorker:
+    """
+    Background thread assigning newly saved changes to region tracks.
+
+    Saving a comparison only queues its location, so requests don't wait
+    for tracking; a location queued again before its update starts is
+    updated once. The queue is not persisted, but every update picks up all
+    of a location's untracked changes, so changes missed by a restart are
+    tracked by its next update (reading the tracks also updates them).
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """Start the worker thread once per process"""
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            # Threads don't survive a fork, so track the owning process
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='track-worker', daemon=True).start()
+
+    def enqueue(self, location):
+        """Queue a location whose changes were saved"""
+        self.start()
+        with self._lock:
+            if location in self._queued:
+                return
+            self._queued.add(location)
+        self._queue.put(location)
+
+    def _run(self):
+        while True:
+            location = self._queue.get()
+            # Changes saved from now on queue the location again
+            with self._lock:
+                self._queued.discard(location)
+            try:
+                with app.app_context():
+                    update_location_tracks(location)
+            except Exception as e:
+                # Tracks catch up on the next update of the location
+                logger.error(f"Error updating change tracks for {location}: {str(e)}")
+
+track_worker = TrackWorker()
+
+def track_data(track):
+    """JSON representation of a ChangeTrack"""
+    return {
+        'track_id': track.id,
+        'x': track.position_x,
+        'y': track.position_y,
+        'width': track.size_w,
+        'height': track.size_h,
+        'first_scan_id': track.first_scan_id,
+        'last_scan_id': track.last_scan_id,
+        'first_seen': track.first_seen.isoformat() if track.first_seen else None,
+        'last_seen': track.last_seen.isoformat() if track.last_seen else None,
+        'change_count': track.observations,
+        'last_change_type': track.last_change_type
+    }
+
+def summarize_location_tracks(location):
+    """
+    Summarize a location's tracks like analyze_long_term_changes does
+
+    Returns:
+        Dictionary of frequently changing, recently added and recently
+        removed regions
+    """
+    # "Recent" means seen in the location's latest compared scan
+    latest_scan_id = db.session.query(func.max(Scan.id)).filter(
+        Scan.location == location, Scan.is_baseline.is_(False)
+    ).scalar()
+
+    def region(track):
+        return {
+            'track_id': track.id,
+            'x': track.position_x,
+            'y': track.position_y,
+            'width': track.size_w,
+            'height': track.size_h
+        }
+
+    frequently_changing = ChangeTrack.query.filter(
+        ChangeTrack.location == location, ChangeTrack.observations > 2
+    ).order_by(ChangeTrack.observations.desc()).all()
+    recent = ChangeTrack.query.filter(
+        ChangeTrack.location == location, ChangeTrack.last_scan_id == latest_scan_id
+    ).all() if latest_scan_id else []
+
+    return {
+        'frequently_changing': [dict(region(track), change_count=track.observations)
+                                for track in frequently_changing],
+        'recently_added': [region(track) for track in recent if track.last_change_type == 'added'],
+        'recently_removed': [region(track) for track in recent if track.last_change_type == 'removed']
+    }
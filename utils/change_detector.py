@@ -1,11 +1,228 @@
 import cv2
 import numpy as np
 import logging
-from utils.image_processor import align_images
+from utils.image_processor import align_images, as_gray, zone_mask
+from utils.pipeline_context import get_context
+from utils.tiling import filter_tiled, label_tile, TiledComponents
+from utils.region_tracker import RegionTracker
+from utils import metrics
 
 logger = logging.getLogger(__name__)
 
-def detect_changes(baseline_image, current_image, threshold=30):
+# Box colors (RGB) used when drawing each change type
+CHANGE_COLORS = {
+    'added': (0, 255, 0),      # Green for added
+    'removed': (255, 0, 0),    # Red for removed
+    'changed': (255, 255, 0)   # Yellow for changed
+}
+
+# Default difference (0-255) a pixel must exceed to count as changed, and
+# the smallest region (pixels) reported as a change
+DEFAULT_THRESHOLD = 30
+MIN_CHANGE_AREA = 100
+
+# Engines turning the change mask into regions: "contours" traces each
+# region with findContours, "components" labels them with
+# connectedComponentsWithStats and computes their statistics in bulk
+DETECTION_ENGINES = ('contours', 'components')
+
+# Pyramid mode: padding (full resolution pixels) around each candidate
+# region so refined contours aren't cut off at tile edges
+PYRAMID_TILE_MARGIN = 16
+# Fraction of the threshold used to find candidates on the coarse level,
+# where downscaling blurs small changes into weaker differences
+PYRAMID_CANDIDATE_RATIO = 0.5
+
+@metrics.timed('render')
+def render_visualization(image, changes):
+    """
+    Draw detected changes onto a copy of an image
+    
+    Args:
+        image: The image to draw on (usually the preprocessed current image),
+            RGB or grayscale
+        changes: List of changes as returned by detect_changes
+        
+    Returns:
+        RGB visualization image
+    """
+    # Boxes are drawn in color, so grayscale images are expanded here, the
+    # one place the pipeline needs RGB
+    visualization = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB) if image.ndim == 2 else image.copy()
+    
+    for change in changes:
+        x, y, w, h = change['x'], change['y'], change['width'], change['height']
+        color = CHANGE_COLORS.get(change['type'], CHANGE_COLORS['changed'])
+        
+        # Draw rectangle and label
+        cv2.rectangle(visualization, (x, y), (x+w, y+h), color, 2)
+        cv2.putText(visualization, change['type'], (x, y-10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    
+    return visualization
+
+def classify_change(roi_baseline, roi_current):
+    """
+    Decide whether a changed region was added, removed or otherwise changed
+    
+    Args:
+        roi_baseline: Region in the baseline image
+        roi_current: Same region in the aligned current image
+        
+    Returns:
+        "added", "removed" or "changed"
+    """
+    # Determine if object was added, removed, or moved
+    # This is a simplified approach - in a real application, more sophisticated
+    # analysis would be needed
+    baseline_mean = np.mean(roi_baseline)
+    current_mean = np.mean(roi_current)
+    
+    if current_mean > baseline_mean * 1.2:
+        return "added"
+    elif baseline_mean > current_mean * 1.2:
+        return "removed"
+    return "changed"
+
+def _contour_changes(mask, baseline_image, aligned_current):
+    """
+    Describe the regions of a change mask by tracing their contours
+    
+    Args:
+        mask: Binary change mask
+        baseline_image: The baseline image
+        aligned_current: The current image aligned with the baseline
+        
+    Returns:
+        List of changes
+    """
+    # Find contours of changed regions
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    # List to store change information
+    changes = []
+    
+    # Process each contour
+    for i, contour in enumerate(contours):
+        # Filter out small contours
+        if cv2.contourArea(contour) < MIN_CHANGE_AREA:
+            continue
+            
+        # Get bounding rectangle
+        x, y, w, h = cv2.boundingRect(contour)
+        
+        # Extract the region from both images
+        roi_baseline = baseline_image[y:y+h, x:x+w]
+        roi_current = aligned_current[y:y+h, x:x+w]
+        
+        # Add to changes list
+        changes.append({
+            'id': i,
+            'type': classify_change(roi_baseline, roi_current),
+            'x': int(x),
+            'y': int(y),
+            'width': int(w),
+            'height': int(h)
+        })
+    
+    return changes
+
+def _box_means(gray, x, y, w, h):
+    """Mean intensity of each box of a grayscale image, via its integral image"""
+    # 32-bit sums are exact as long as the whole image can't overflow them
+    depth = cv2.CV_32S if gray.size * 255 < 2**31 else cv2.CV_64F
+    integral = cv2.integral(gray, sdepth=depth)
+    sums = (integral[y + h, x + w].astype(np.float64) - integral[y, x + w]
+            - integral[y + h, x] + integral[y, x])
+    return sums / (w * h)
+
+def _component_changes(mask, baseline_gray, current_gray):
+    """
+    Describe the regions of a change mask using connected components
+    
+    Areas, boxes and the mean intensities used to classify each region are
+    computed for all regions at once. A region's area counts its changed
+    pixels rather than the area enclosed by its outline.
+    
+    Args:
+        mask: Binary change mask
+        baseline_gray: The baseline image in grayscale
+        current_gray: The aligned current image in grayscale
+        
+    Returns:
+        List of changes
+    """
+    # Grana's block-based labeling is the fastest of OpenCV's algorithms on
+    # these sparse masks
+    _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(mask, 8, cv2.CV_32S, cv2.CCL_GRANA)
+    
+    # Label 0 is the unchanged background; filter out small regions
+    labels = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= MIN_CHANGE_AREA) + 1
+    x, y, w, h = stats[labels, :4].T
+    
+    # Mean of each region's bounding box in both images, as in _contour_changes
+    baseline_mean = _box_means(baseline_gray, x, y, w, h)
+    current_mean = _box_means(current_gray, x, y, w, h)
+    change_types = np.select(
+        [current_mean > baseline_mean * 1.2, baseline_mean > current_mean * 1.2],
+        ["added", "removed"],
+        default="changed"
+    )
+    
+    return [{
+        'id': int(labels[i] - 1),
+        'type': str(change_types[i]),
+        'x': int(x[i]),
+        'y': int(y[i]),
+        'width': int(w[i]),
+        'height': int(h[i])
+    } for i in range(len(labels))]
+
+def _tiled_changes(components, baseline_gray, current_gray, engine):
+    """
+    Describe the regions of a change mask labelled tile by tile
+    
+    The components engine reports them as _component_changes does; for the
+    contours engine each region is traced on its own and filtered by the
+    area inside its outline, as in _contour_changes (regions nested in
+    another region's holes are reported too, as by the components engine).
+    
+    Args:
+        components: utils.tiling.TiledComponents of the change mask
+        baseline_gray: The baseline image in grayscale
+        current_gray: The aligned current image in grayscale
+        engine: One of DETECTION_ENGINES
+        
+    Returns:
+        List of changes
+    """
+    # An outline encloses fewer pixels than its region has, so regions of
+    # under MIN_CHANGE_AREA changed pixels fail either filter
+    regions = np.flatnonzero(components.areas >= MIN_CHANGE_AREA)
+    
+    if engine != 'components':
+        def outline_area(region):
+            contours, _ = cv2.findContours(components.mask(region), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            return max(cv2.contourArea(contour) for contour in contours)
+        
+        regions = [region for region in regions if outline_area(region) >= MIN_CHANGE_AREA]
+    
+    changes = []
+    for region in regions:
+        x, y, w, h = (int(v) for v in components.boxes[region])
+        changes.append({
+            'id': len(changes),
+            'type': classify_change(baseline_gray[y:y+h, x:x+w], current_gray[y:y+h, x:x+w]),
+            'x': x,
+            'y': y,
+            'width': w,
+            'height': h
+        })
+    return changes
+
+@metrics.timed('detect')
+def detect_changes(baseline_image, current_image, threshold=DEFAULT_THRESHOLD, baseline_features=None, render=True,
+                   aligned_current=None, engine='contours', tiling=None, zones=None):
     """
     Detect changes between two images
     
@@ -13,88 +230,243 @@ def detect_changes(baseline_image, current_image, threshold=30):
         baseline_image: The baseline image
         current_image: The current image to compare
         threshold: Sensitivity threshold (0-255)
+        baseline_features: Optional precomputed BaselineFeatures for the baseline
+        render: Whether to draw the visualization image
+        aligned_current: Optional current image already aligned with the
+            baseline, skipping alignment
+        engine: One of DETECTION_ENGINES
+        tiling: Optional utils.tiling.Tiling to compute the mask and find
+            its regions tile by tile on several threads
+        zones: Optional utils.zones.Zones; only their monitored area is
+            compared
         
     Returns:
-        List of changes, change mask, and visualization image
+        List of changes, change mask, and visualization image (None when
+        render is False)
     """
     try:
         # Align images to account for slightly different camera positions
-        aligned_current = align_images(baseline_image, current_image)
-        
-        # Convert images to grayscale for comparison
-        baseline_gray = cv2.cvtColor(baseline_image, cv2.COLOR_RGB2GRAY)
-        current_gray = cv2.cvtColor(aligned_current, cv2.COLOR_RGB2GRAY)
+        if aligned_current is None:
+            aligned_current = align_images(baseline_image, current_image, baseline_features)
         
-        # Calculate absolute difference
-        diff = cv2.absdiff(baseline_gray, current_gray)
+        context = get_context()
+        # Preprocessed images are grayscale already
+        baseline_gray = as_gray(baseline_image)
+        current_gray = as_gray(aligned_current)
+        frame_shape = baseline_gray.shape
         
-        # Apply threshold to get binary mask of changes
-        _, thresh = cv2.threshold(diff, threshold, 255, cv2.THRESH_BINARY)
+        # With zones, only the bounding box of the monitored area is
+        # compared, and pixels outside the area are masked out of it
+        zone = None
+        if zones:
+            zone, (x0, y0, w, h) = zone_mask(zones, frame_shape)
+            if not w or not h:
+                visualization = render_visualization(current_image, []) if render else None
+                return [], np.zeros(frame_shape, np.uint8), visualization
+            zone = zone[y0:y0+h, x0:x0+w]
+            baseline_gray = baseline_gray[y0:y0+h, x0:x0+w]
+            current_gray = current_gray[y0:y0+h, x0:x0+w]
         
-        # Apply morphological operations to reduce noise
-        kernel = np.ones((5, 5), np.uint8)
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+        if tiling and tiling.splits(baseline_gray.shape):
+            changes, thresh = _detect_tiled(baseline_gray, current_gray, threshold, engine, tiling, zone)
+        else:
+            with metrics.stage('diff'):
+                # Calculate absolute difference and threshold it in place to
+                # get a binary mask of changes
+                diff = cv2.absdiff(baseline_gray, current_gray,
+                                   dst=context.buffer('detect_diff', baseline_gray.shape))
+                cv2.threshold(diff, threshold, 255, cv2.THRESH_BINARY, dst=diff)
+                if zone is not None:
+                    cv2.bitwise_and(diff, zone, dst=diff)
+            
+            with metrics.stage('morphology'):
+                # Apply morphological operations to reduce noise; only the
+                # returned mask is a new array. Closing can grow regions
+                # past the zone's edges, so they are cut back to it.
+                opened = cv2.morphologyEx(diff, cv2.MORPH_OPEN, context.kernel,
+                                          dst=context.buffer('detect_opened', diff.shape))
+                thresh = cv2.morphologyEx(opened, cv2.MORPH_CLOSE, context.kernel)
+                if zone is not None:
+                    cv2.bitwise_and(thresh, zone, dst=thresh)
+            
+            with metrics.stage('regions'):
+                if engine == 'components':
+                    changes = _component_changes(thresh, baseline_gray, current_gray)
+                else:
+                    changes = _contour_changes(thresh, baseline_gray, current_gray)
         
-        # Find contours of changed regions
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if zone is not None:
+            # Move the changes and the mask back to frame coordinates
+            for change in changes:
+                change.update(x=change['x'] + x0, y=change['y'] + y0)
+            mask = np.zeros(frame_shape, np.uint8)
+            mask[y0:y0+h, x0:x0+w] = thresh
+            thresh = mask
         
         # Create visualization image
-        visualization = current_image.copy()
+        visualization = render_visualization(current_image, changes) if render else None
         
-        # List to store change information
-        changes = []
+        return changes, thresh, visualization
         
-        # Process each contour
-        for i, contour in enumerate(contours):
-            # Filter out small contours
-            if cv2.contourArea(contour) < 100:
-                continue
-                
-            # Get bounding rectangle
+    except Exception as e:
+        logger.error(f"Error detecting changes: {str(e)}")
+        # Return empty changes and original image
+        return [], np.zeros(baseline_image.shape[:2], np.uint8), current_image
+
+def _detect_tiled(baseline_gray, current_gray, threshold, engine, tiling, zone=None):
+    """The mask and regions of detect_changes, computed tile by tile"""
+    kernel = get_context().kernel
+    
+    def mask_tile(baseline_tile, current_tile, zone_tile=None):
+        diff = cv2.absdiff(baseline_tile, current_tile)
+        cv2.threshold(diff, threshold, 255, cv2.THRESH_BINARY, dst=diff)
+        if zone_tile is not None:
+            cv2.bitwise_and(diff, zone_tile, dst=diff)
+        opened = cv2.morphologyEx(diff, cv2.MORPH_OPEN, kernel)
+        closed = cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel)
+        if zone_tile is not None:
+            cv2.bitwise_and(closed, zone_tile, dst=closed)
+        return closed
+    
+    # One pass over the tiles differences, filters and labels each of them,
+    # so the stage covers what diff, morphology and part of regions time
+    # when untiled. Opening and closing each erode and dilate once, so a
+    # tile's mask depends on pixels up to four kernel radii away.
+    with metrics.stage('diff'):
+        halo = 4 * (max(kernel.shape) // 2)
+        sources = [baseline_gray, current_gray] + ([zone] if zone is not None else [])
+        thresh, grid, labelled = filter_tiled(mask_tile, sources, halo, tiling, then=label_tile)
+    
+    with metrics.stage('regions'):
+        changes = _tiled_changes(TiledComponents(grid, labelled), baseline_gray, current_gray, engine)
+    
+    return changes, thresh
+
+def _merge_boxes(boxes):
+    """Merge overlapping (x0, y0, x1, y1) boxes until none overlap"""
+    merged = list(boxes)
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        for box in merged:
+            for j, other in enumerate(result):
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    result[j] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    changed = True
+                    break
+            else:
+                result.append(box)
+        merged = result
+    return merged
+
+@metrics.timed('detect')
+def detect_changes_pyramid(baseline_image, current_image, coarse_baseline, coarse_current, homography=None,
+                           threshold=DEFAULT_THRESHOLD, render=True, engine='contours', zones=None,
+                           coarse_current_shape=None):
+    """
+    Detect changes in high-resolution images coarse-to-fine
+    
+    Differences are first located on the downscaled (coarse) images, without
+    the noise filtering that would erase small objects there. Only tiles
+    around those candidates are then aligned and compared at full
+    resolution, so small changes are found at close to the coarse cost.
+    
+    Args:
+        baseline_image: Full resolution preprocessed baseline
+        current_image: Full resolution preprocessed current image
+        coarse_baseline: Downscaled preprocessed baseline
+        coarse_current: Downscaled current image aligned with coarse_baseline
+        homography: Homography aligning the coarse current image with the
+            coarse baseline, or None if no alignment was needed or possible
+        threshold: Sensitivity threshold (0-255)
+        render: Whether to draw the visualization image
+        engine: One of DETECTION_ENGINES
+        zones: Optional utils.zones.Zones; only their monitored area is
+            compared
+        coarse_current_shape: Shape of the downscaled current image before
+            its alignment, which homography maps from; defaults to the coarse
+            baseline's, as for images of the baseline's resolution
+        
+    Returns:
+        List of changes in full resolution baseline coordinates, change mask,
+        and visualization image (None when render is False)
+    """
+    try:
+        baseline_image = as_gray(baseline_image)
+        current_gray = as_gray(current_image)
+        full_h, full_w = baseline_image.shape[:2]
+        coarse_h, coarse_w = coarse_baseline.shape[:2]
+        
+        # Candidate regions on the coarse level: any difference counts
+        diff = cv2.absdiff(as_gray(coarse_baseline), as_gray(coarse_current))
+        _, candidates = cv2.threshold(diff, threshold * PYRAMID_CANDIDATE_RATIO, 255, cv2.THRESH_BINARY)
+        zone = None
+        if zones:
+            cv2.bitwise_and(candidates, zone_mask(zones, candidates.shape)[0], dst=candidates)
+            zone = zone_mask(zones, baseline_image.shape)[0]
+        candidates = cv2.dilate(candidates, np.ones((3, 3), np.uint8))
+        contours, _ = cv2.findContours(candidates, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        # Scale candidates to full resolution tiles
+        scale_x, scale_y = full_w / coarse_w, full_h / coarse_h
+        tiles = []
+        for contour in contours:
             x, y, w, h = cv2.boundingRect(contour)
+            tiles.append((
+                max(0, int(x * scale_x) - PYRAMID_TILE_MARGIN),
+                max(0, int(y * scale_y) - PYRAMID_TILE_MARGIN),
+                min(full_w, int(np.ceil((x + w) * scale_x)) + PYRAMID_TILE_MARGIN),
+                min(full_h, int(np.ceil((y + h) * scale_y)) + PYRAMID_TILE_MARGIN)
+            ))
+        tiles = _merge_boxes(tiles)
+        
+        # Homography from the full resolution current image to the full
+        # resolution baseline, through the coarse levels; each image is
+        # scaled between its own full and coarse sizes
+        cur_h, cur_w = current_gray.shape[:2]
+        coarse_cur_h, coarse_cur_w = (coarse_current_shape or coarse_baseline.shape)[:2]
+        to_coarse = np.diag([coarse_cur_w / cur_w, coarse_cur_h / cur_h, 1.0])
+        from_coarse = np.diag([scale_x, scale_y, 1.0])
+        H = from_coarse @ (homography if homography is not None else np.eye(3)) @ to_coarse
+        
+        kernel = get_context().kernel
+        mask = np.zeros((full_h, full_w), np.uint8)
+        changes = []
+        
+        for x0, y0, x1, y1 in tiles:
+            # Warp only this tile of the current image into baseline coordinates
+            offset = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+            roi_current = cv2.warpPerspective(current_gray, offset @ H, (x1 - x0, y1 - y0))
+            roi_baseline = baseline_image[y0:y1, x0:x1]
             
-            # Extract the region from both images
-            roi_baseline = baseline_image[y:y+h, x:x+w]
-            roi_current = aligned_current[y:y+h, x:x+w]
-            
-            # Determine if object was added, removed, or moved
-            # This is a simplified approach - in a real application, more sophisticated
-            # analysis would be needed
-            baseline_mean = np.mean(roi_baseline)
-            current_mean = np.mean(roi_current)
-            
-            change_type = "changed"
-            color = (255, 255, 0)  # Yellow for changed
-            
-            if current_mean > baseline_mean * 1.2:
-                change_type = "added"
-                color = (0, 255, 0)  # Green for added
-            elif baseline_mean > current_mean * 1.2:
-                change_type = "removed"
-                color = (255, 0, 0)  # Red for removed
+            _, tile_mask = cv2.threshold(cv2.absdiff(roi_baseline, roi_current), threshold, 255, cv2.THRESH_BINARY)
+            if zone is not None:
+                cv2.bitwise_and(tile_mask, zone[y0:y1, x0:x1], dst=tile_mask)
+            tile_mask = cv2.morphologyEx(tile_mask, cv2.MORPH_OPEN, kernel)
+            tile_mask = cv2.morphologyEx(tile_mask, cv2.MORPH_CLOSE, kernel)
+            if zone is not None:
+                cv2.bitwise_and(tile_mask, zone[y0:y1, x0:x1], dst=tile_mask)
+            mask[y0:y1, x0:x1] = tile_mask
             
-            # Draw rectangle on visualization
-            cv2.rectangle(visualization, (x, y), (x+w, y+h), color, 2)
-            cv2.putText(visualization, change_type, (x, y-10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+            if engine == 'components':
+                tile_changes = _component_changes(tile_mask, roi_baseline, roi_current)
+            else:
+                tile_changes = _contour_changes(tile_mask, roi_baseline, roi_current)
             
-            # Add to changes list
-            changes.append({
-                'id': i,
-                'type': change_type,
-                'x': int(x),
-                'y': int(y),
-                'width': int(w),
-                'height': int(h)
-            })
+            # Number changes across tiles and move them to image coordinates
+            for change in tile_changes:
+                change.update(id=len(changes), x=change['x'] + x0, y=change['y'] + y0)
+                changes.append(change)
         
-        return changes, thresh, visualization
+        visualization = render_visualization(current_image, changes) if render else None
+        
+        return changes, mask, visualization
         
     except Exception as e:
         logger.error(f"Error detecting changes: {str(e)}")
-        # Return empty changes and original image
-        return [], np.zeros_like(baseline_image[:,:,0]), current_image
+        return [], np.zeros(baseline_image.shape[:2], np.uint8), current_image
 
 
 def analyze_long_term_changes(scan_sequence):
@@ -108,7 +480,9 @@ def analyze_long_term_changes(scan_sequence):
         Analysis of trends and patterns
     """
     try:
-        # Initialize tracking of regions
+        # Initialize tracking of regions; boxes are matched across pairs by
+        # overlap so a region that shifts slightly keeps its history
+        tracker = RegionTracker()
         region_history = {}
         
         # Compare each adjacent pair of scans
@@ -117,29 +491,30 @@ def analyze_long_term_changes(scan_sequence):
             current = scan_sequence[i]
             
             # Detect changes between this pair
-            changes, _, _ = detect_changes(baseline, current)
+            changes, _, _ = detect_changes(baseline, current, render=False)
             
             # Update history for each change region
-            for change in changes:
-                region_key = f"{change['x']},{change['y']},{change['width']},{change['height']}"
-                
-                if region_key not in region_history:
-                    region_history[region_key] = {
+            boxes = [(change['x'], change['y'], change['width'], change['height']) for change in changes]
+            for change, box, track_id in zip(changes, boxes, tracker.match(boxes)):
+                if track_id is None:
+                    track_id = len(region_history)
+                    region_history[track_id] = {
                         'first_seen': i,
                         'last_seen': i,
                         'states': ['initial']
                     }
                 
-                region_history[region_key]['last_seen'] = i
-                region_history[region_key]['states'].append(change['type'])
+                tracker.add(track_id, box)
+                region_history[track_id]['last_seen'] = i
+                region_history[track_id]['states'].append(change['type'])
         
         # Analyze the history
         regions_frequently_changing = []
         regions_recently_added = []
         regions_recently_removed = []
         
-        for region_key, history in region_history.items():
-            x, y, w, h = map(int, region_key.split(','))
+        for track_id, history in region_history.items():
+            x, y, w, h = tracker.boxes[track_id]
             
             # If a region changed more than twice
             if len(history['states']) > 3:
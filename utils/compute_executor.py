@@ -0,0 +1,122 @@
+import threading
+import logging
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+class ExecutorSaturated(Exception):
+    """Raised when the compute executor has no free capacity"""
+
+class ComputeExecutor:
+    """
+    Runs CPU-bound vision work in a pool of worker processes so request
+    threads are not blocked on OpenCV.
+
+    The number of tasks queued or running is capped at max_pending; further
+    submissions raise ExecutorSaturated so callers can shed load instead of
+    piling up requests. With max_workers=0 tasks run inline in the calling
+    thread, which is handy for development and debugging.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, initializer=None, queue_timeout=0.0):
+        self.max_workers = max_workers
+        self.max_pending = max_pending or 2 * (max_workers or 1)
+        self.initializer = initializer
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+        self._pool = None
+        self._lock = threading.Lock()
+        self._initialized_inline = False
+
+    @property
+    def pending(self):
+        """Number of tasks queued or running"""
+        return self._pending
+
+    def _get_pool(self):
+        # Created lazily so forking servers start the pool in each worker
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=self.initializer
+                )
+                logger.debug(f"Started compute pool with {self._pool._max_workers} workers")
+            return self._pool
+
+    def _reset_pool(self, pool):
+        """Discard a pool whose worker processes died"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule fn(*args, **kwargs) on the pool
+
+        Returns:
+            concurrent.futures.Future for the result
+
+        Raises:
+            ExecutorSaturated: If max_pending tasks are already in flight
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise ExecutorSaturated(f'{self.max_pending} compute tasks already pending')
+
+        with self._lock:
+            self._pending += 1
+
+        try:
+            if self.max_workers == 0:
+                future = self._run_inline(fn, args, kwargs)
+            else:
+                pool = self._get_pool()
+                try:
+                    future = pool.submit(fn, *args, **kwargs)
+                except BrokenProcessPool:
+                    logger.error("Compute pool is broken, restarting it")
+                    self._reset_pool(pool)
+                    future = self._get_pool().submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _run_inline(self, fn, args, kwargs):
+        if self.initializer and not self._initialized_inline:
+            self.initializer()
+            self._initialized_inline = True
+
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the pool and wait for its result
+
+        Raises:
+            ExecutorSaturated: If the executor has no free capacity
+            TimeoutError: If the result is not ready within timeout seconds
+        """
+        return self.submit(fn, *args, **kwargs).result(timeout=timeout)
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
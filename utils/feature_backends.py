@@ -0,0 +1,159 @@
+import cv2
+import logging
+
+logger = logging.getLogger(__name__)
+
+# FLANN index algorithms
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+
+class FeatureBackend:
+    """
+    Keypoint detector/descriptor paired with a matcher suited to its
+    descriptors, used by align_images.
+
+    Subclasses implement _create_detector() and _create_matcher().
+    """
+
+    name = None
+    # Keypoint budget used when none is requested (0 keeps every keypoint)
+    default_max_features = 0
+    # Lowe's ratio test threshold
+    ratio = 0.75
+
+    def __init__(self, max_features=None):
+        self.max_features = self.default_max_features if max_features is None else max_features
+        self.detector = self._create_detector()
+        self.matcher = self._create_matcher()
+
+    def _create_detector(self):
+        raise NotImplementedError
+
+    def _create_matcher(self):
+        raise NotImplementedError
+
+    def detect(self, gray, mask=None):
+        """
+        Detect keypoints and compute descriptors
+
+        Args:
+            gray: Grayscale image
+            mask: Optional mask limiting where keypoints are detected
+
+        Returns:
+            Keypoints and descriptors
+        """
+        return self.detector.detectAndCompute(gray, mask)
+
+    def match(self, descriptors1, descriptors2):
+        """
+        Match descriptors and keep those passing the ratio test
+
+        Returns:
+            List of (index in descriptors1, index in descriptors2) pairs
+        """
+        pairs = self.matcher.knnMatch(descriptors1, descriptors2, k=2)
+
+        good_matches = []
+        for pair in pairs:
+            # Approximate matchers may return fewer than two neighbours
+            if len(pair) == 2 and pair[0].distance < self.ratio * pair[1].distance:
+                good_matches.append((pair[0].queryIdx, pair[0].trainIdx))
+        return good_matches
+
+class SiftBruteForceBackend(FeatureBackend):
+    """SIFT with exhaustive L2 matching (the original behaviour)"""
+
+    name = 'sift-bf'
+
+    def _create_detector(self):
+        return cv2.SIFT_create(nfeatures=self.max_features)
+
+    def _create_matcher(self):
+        return cv2.BFMatcher()
+
+class SiftFlannBackend(FeatureBackend):
+    """SIFT with approximate nearest neighbours from a FLANN KD-tree forest"""
+
+    name = 'sift'
+    default_max_features = 2000
+
+    def _create_detector(self):
+        return cv2.SIFT_create(nfeatures=self.max_features)
+
+    def _create_matcher(self):
+        return cv2.FlannBasedMatcher(dict(algorithm=FLANN_INDEX_KDTREE, trees=5), dict(checks=50))
+
+class BinaryLshMixin:
+    """FLANN LSH matching for binary descriptors (Hamming distance)"""
+
+    def _create_matcher(self):
+        return cv2.FlannBasedMatcher(
+            dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1),
+            dict(checks=50)
+        )
+
+class OrbBackend(BinaryLshMixin, FeatureBackend):
+    """ORB binary features with LSH matching"""
+
+    name = 'orb'
+    default_max_features = 2000
+
+    def _create_detector(self):
+        return cv2.ORB_create(nfeatures=self.max_features or 500)
+
+class AkazeBackend(BinaryLshMixin, FeatureBackend):
+    """AKAZE binary features with LSH matching"""
+
+    name = 'akaze'
+    default_max_features = 2000
+
+    def _create_detector(self):
+        if not hasattr(cv2, 'AKAZE_create'):
+            raise ValueError('AKAZE is not available in this OpenCV build')
+        return cv2.AKAZE_create()
+
+    def detect(self, gray, mask=None):
+        # AKAZE has no keypoint limit, so keep the strongest responses
+        keypoints = self.detector.detect(gray, mask)
+        if self.max_features and len(keypoints) > self.max_features:
+            keypoints = sorted(keypoints, key=lambda kp: kp.response, reverse=True)[:self.max_features]
+        return self.detector.compute(gray, keypoints)
+
+FEATURE_BACKENDS = {
+    backend.name: backend
+    for backend in (SiftBruteForceBackend, SiftFlannBackend, OrbBackend, AkazeBackend)
+}
+
+# Default backend keeps the original SIFT + brute-force behaviour
+DEFAULT_BACKEND = 'sift-bf'
+
+def create_backend(name=None, max_features=None):
+    """
+    Create a feature backend by name
+
+    Args:
+        name: Key of FEATURE_BACKENDS, or None for DEFAULT_BACKEND
+        max_features: Keypoint budget, or None for the backend's default
+
+    Returns:
+        FeatureBackend instance
+
+    Raises:
+        ValueError: If the backend is unknown or unavailable
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in FEATURE_BACKENDS:
+        raise ValueError(f"Unknown alignment backend '{name}'")
+    return FEATURE_BACKENDS[name](max_features)
+
+def available_backends():
+    """Names of the backends usable with the installed OpenCV"""
+    available = []
+    for name in FEATURE_BACKENDS:
+        try:
+            create_backend(name)
+            available.append(name)
+        except (ValueError, AttributeError, cv2.error):
+            pass
+    return available
@@ -0,0 +1,89 @@
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class BaselineFeatureStore:
+    """
+    Bounded LRU cache of prepared baselines (preprocessed image, keypoints and
+    descriptors) keyed by scan ID, or by (scan ID, variant) tuples when a
+    baseline is prepared in several ways (e.g. per feature backend).
+
+    Each entry also records a version token derived from the scan row so a
+    stale entry is never served after the baseline image has changed.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Look up a cached baseline
+
+        Args:
+            key: Cache key (usually the scan ID)
+            version: Version token of the scan row
+
+        Returns:
+            The cached entry, or None if missing or stale
+        """
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None or cached[0] != version:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, key, version, entry):
+        """Store a prepared baseline, evicting the least recently used entries"""
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (version, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                logger.debug(f"Evicted baseline {evicted} from feature cache")
+
+    def get_or_create(self, key, version, factory):
+        """
+        Return the cached baseline or build it with factory() and cache it
+
+        Args:
+            key: Cache key (usually the scan ID)
+            version: Version token of the scan row
+            factory: Callable producing the entry on a cache miss
+
+        Returns:
+            The cached or newly created entry
+        """
+        entry = self.get(key, version)
+        if entry is None:
+            entry = factory()
+            self.put(key, version, entry)
+        return entry
+
+    def invalidate(self, scan_id):
+        """Drop every cached variant of a baseline"""
+        with self._lock:
+            stale = [key for key in self._entries
+                     if key == scan_id or (isinstance(key, tuple) and key[0] == scan_id)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop every cached baseline"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,300 @@
+import io
+import os
+import fcntl
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Change counts of a location over a time window: per cell, the number of
+# changes whose box covered it; the number of changes; and the (bucket start
+# in seconds since the epoch, changes) of the time buckets summed
+Heatmap = namedtuple('Heatmap', ['grid', 'changes', 'buckets'])
+
+# Color ramp of rendered heatmaps, from no changes to the most changed cell
+RAMP = [(0, 0, 0), (80, 18, 123), (183, 55, 121), (251, 135, 97), (252, 253, 191)]
+
+def _ramp_palette():
+    anchors = np.linspace(0, 255, len(RAMP))
+    levels = np.arange(256)
+    return np.stack([np.interp(levels, anchors, channel) for channel in zip(*RAMP)], axis=1).astype(np.uint8)
+
+_PALETTE = _ramp_palette().ravel().tolist()
+
+class HeatmapStore:
+    """
+    Per-location change heatmaps kept in memory-mapped files.
+
+    A location's file holds a grid_size x grid_size uint32 grid of change
+    counts over the frame (cells are fractions of the width and height, so
+    scans of any resolution add up) for each of the last `buckets` time
+    buckets of bucket_seconds, kept as a ring, plus one grid for all time.
+    Recording a change touches only the cells under its box and reading a
+    window sums at most `buckets` grids, so neither depends on how much
+    history there is.
+
+    The file also records the last change applied to it (a high-water
+    mark), so callers adding changes from a log can apply each exactly once
+    and catch up after failed updates. Updates from several processes are
+    serialized with a lock on the file. The layout is part of the file
+    name, so changing the settings starts new heatmaps rather than
+    misreading old ones.
+    """
+
+    def __init__(self, root, grid_size=64, bucket_seconds=86400, buckets=90):
+        self.root = root
+        self.grid_size = grid_size
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self._maps = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, location):
+        """Get the on-disk path of a location's heatmap"""
+        digest = hashlib.sha1(location.encode('utf-8')).hexdigest()
+        return os.path.join(
+            self.root, f'{digest}-{self.grid_size}g-{self.buckets}x{self.bucket_seconds}s.heat'
+        )
+
+    def _layout(self, buffer):
+        """Views of a heatmap file: high-water mark, bucket epochs, change counts and grids"""
+        slots = self.buckets + 1
+        applied = np.ndarray((1,), np.int64, buffer, 0)
+        epochs = np.ndarray((self.buckets,), np.int64, buffer, applied.nbytes)
+        counts = np.ndarray((slots,), np.int64, buffer, applied.nbytes + epochs.nbytes)
+        grids = np.ndarray((slots, self.grid_size, self.grid_size), np.uint32, buffer,
+                           applied.nbytes + epochs.nbytes + counts.nbytes)
+        return applied, epochs, counts, grids
+
+    def _file_size(self):
+        slots = self.buckets + 1
+        return 8 + 8 * self.buckets + 8 * slots + 4 * slots * self.grid_size ** 2
+
+    def _map(self, location, create):
+        """The memory map of a location's heatmap, or None if it has none yet"""
+        path = self.path_for(location)
+        with self._lock:
+            mapped = self._maps.get(location)
+            if mapped is not None:
+                return mapped
+            if not create and not os.path.exists(path):
+                return None
+
+            with open(path, 'a+b') as f:
+                # New files are sized (zero filled) under the lock so
+                # processes creating them at once agree
+                with _locked(f, fcntl.LOCK_EX):
+                    if os.fstat(f.fileno()).st_size < self._file_size():
+                        f.truncate(self._file_size())
+            mapped = np.memmap(path, np.uint8, 'r+', shape=(self._file_size(),))
+            self._maps[location] = mapped
+            return mapped
+
+    def _epoch(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    @contextmanager
+    def updating(self, location):
+        """
+        Lock a location's heatmap for updates
+
+        Other processes can neither read nor update the heatmap until the
+        block exits, so the high-water mark read in it stays current.
+
+        Args:
+            location: Location to update
+
+        Yields:
+            HeatmapUpdate
+        """
+        mapped = self._map(location, create=True)
+        with open(self.path_for(location), 'rb') as f, _locked(f, fcntl.LOCK_EX):
+            yield HeatmapUpdate(self, self._layout(mapped))
+
+    def query(self, location, since=None, until=None):
+        """
+        Change counts of a location over a time window
+
+        Windows are widened to whole buckets and reach back at most
+        `buckets` buckets; without since and until all changes count.
+
+        Args:
+            location: Location to read
+            since: Start of the window in seconds since the epoch, or None
+            until: End of the window in seconds since the epoch, or None
+
+        Returns:
+            Heatmap
+        """
+        size = self.grid_size
+        mapped = self._map(location, create=False)
+        if mapped is None:
+            return Heatmap(np.zeros((size, size), np.uint64), 0, [])
+        _, epochs, counts, grids = self._layout(mapped)
+
+        with open(self.path_for(location), 'rb') as f, _locked(f, fcntl.LOCK_SH):
+            if since is None and until is None:
+                slots = np.flatnonzero(epochs > 0)
+                grid = grids[self.buckets].astype(np.uint64)
+                changes = int(counts[self.buckets])
+            else:
+                first = self._epoch(since) if since is not None else 1
+                last = self._epoch(until) if until is not None else np.iinfo(np.int64).max
+                slots = np.flatnonzero((epochs > 0) & (epochs >= first) & (epochs <= last))
+                grid = grids[slots].sum(axis=0, dtype=np.uint64)
+                changes = int(counts[slots].sum())
+            order = slots[np.argsort(epochs[slots])]
+            buckets = [(int(epochs[slot]) * self.bucket_seconds, int(counts[slot])) for slot in order]
+
+        return Heatmap(grid, changes, buckets)
+
+    def reset(self, location):
+        """
+        Clear the heatmap of a location
+
+        The file is zeroed in place rather than deleted, as other processes
+        may have it mapped.
+        """
+        mapped = self._map(location, create=False)
+        if mapped is None:
+            return
+        with open(self.path_for(location), 'rb') as f, _locked(f, fcntl.LOCK_EX):
+            mapped[:] = 0
+
+class HeatmapUpdate:
+    """Changes added to one location's heatmap while HeatmapStore.updating holds its lock"""
+
+    def __init__(self, store, layout):
+        self._store = store
+        self._applied, self._epochs, self._counts, self._grids = layout
+
+    @property
+    def applied(self):
+        """Identifier of the last change applied (0 for none)"""
+        return int(self._applied[0])
+
+    @applied.setter
+    def applied(self, value):
+        self._applied[0] = value
+
+    def add(self, boxes, timestamp):
+        """
+        Record changes
+
+        Args:
+            boxes: (x0, y0, x1, y1) boxes of the changes as fractions of the
+                frame's width and height
+            timestamp: Time of the changes, in seconds since the epoch
+        """
+        if not boxes:
+            return
+        store = self._store
+        epochs, counts, grids = self._epochs, self._counts, self._grids
+        epoch = store._epoch(timestamp)
+        slot = epoch % store.buckets
+        size = store.grid_size
+
+        # Reuse the ring slot of the oldest bucket; changes older than the
+        # buckets kept only count towards the all-time grid
+        if epochs[slot] < epoch:
+            epochs[slot] = epoch
+            counts[slot] = 0
+            grids[slot] = 0
+        targets = [store.buckets] + ([slot] if epochs[slot] == epoch else [])
+
+        for x0, y0, x1, y1 in boxes:
+            # Every cell the box overlaps, at least one
+            column0 = min(size - 1, max(0, int(x0 * size)))
+            row0 = min(size - 1, max(0, int(y0 * size)))
+            column1 = max(column0 + 1, min(size, int(np.ceil(x1 * size))))
+            row1 = max(row0 + 1, min(size, int(np.ceil(y1 * size))))
+            for target in targets:
+                grids[target, row0:row1, column0:column1] += 1
+        counts[targets] += len(boxes)
+
+@contextmanager
+def _locked(f, operation):
+    fcntl.flock(f.fileno(), operation)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def render_heatmap(grid, size, scale='linear'):
+    """
+    Render change counts as a PNG heatmap
+
+    Args:
+        grid: Change count grid (Heatmap.grid)
+        size: (width, height) of the image; cells are stretched to it
+        scale: "linear", or "log" to bring out rarely changing cells
+
+    Returns:
+        Encoded PNG bytes
+    """
+    image = Image.fromarray(_levels(grid, scale), 'L').resize(size, Image.BILINEAR)
+    return _encode(image)
+
+def render_heatmap_tile(grid, zoom, column, row, scale='linear', tile_size=256):
+    """
+    Render one tile of a heatmap split into 2**zoom x 2**zoom tiles
+
+    Tiles divide the frame in fractions of its width and height, like the
+    grid, so they are square whatever the frame's aspect ratio. They are
+    colored against the peak of the whole grid and interpolated across
+    their edges, so neighboring tiles join up seamlessly.
+
+    Args:
+        grid: Change count grid (Heatmap.grid)
+        zoom: Zoom level, 0 for a single tile
+        column, row: Position of the tile, from the top left
+        scale: "linear", or "log" to bring out rarely changing cells
+        tile_size: Side of the tile in pixels
+
+    Returns:
+        Encoded PNG bytes
+
+    Raises:
+        ValueError: If there is no such tile
+    """
+    tiles = 2 ** zoom
+    if not 0 <= column < tiles or not 0 <= row < tiles:
+        raise ValueError(f'Zoom level {zoom} has tiles 0 to {tiles - 1} in each direction')
+
+    # Centers of the tile's pixels in cell coordinates, interpolated
+    # between the centers of the cells around them
+    cells = grid.shape[0] / tiles
+    offsets = (np.arange(tile_size) + 0.5) / tile_size
+    xs = np.clip((column + offsets) * cells - 0.5, 0, grid.shape[1] - 1)
+    ys = np.clip((row + offsets) * cells - 0.5, 0, grid.shape[0] - 1)
+    x0, y0 = xs.astype(np.intp), ys.astype(np.intp)
+    x1, y1 = np.minimum(x0 + 1, grid.shape[1] - 1), np.minimum(y0 + 1, grid.shape[0] - 1)
+    fx, fy = xs - x0, (ys - y0)[:, None]
+
+    levels = _levels(grid, scale).astype(np.float64)
+    top = levels[y0][:, x0] * (1 - fx) + levels[y0][:, x1] * fx
+    bottom = levels[y1][:, x0] * (1 - fx) + levels[y1][:, x1] * fx
+    values = np.round(top * (1 - fy) + bottom * fy).astype(np.uint8)
+    return _encode(Image.fromarray(values, 'L'))
+
+def _levels(grid, scale):
+    """Gray levels of a grid, 255 for its most changed cell"""
+    values = grid.astype(np.float64)
+    if scale == 'log':
+        values = np.log1p(values)
+    peak = values.max()
+    return np.zeros(grid.shape, np.uint8) if peak <= 0 else np.round(values * (255 / peak)).astype(np.uint8)
+
+def _encode(image):
+    # Gray levels become indices into the color ramp
+    image.putpalette(_PALETTE)
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
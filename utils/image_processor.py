@@ -1,73 +1,160 @@
 import cv2
 import numpy as np
-from PIL import Image
 import logging
+from collections import namedtuple
+from functools import lru_cache
+from utils.feature_backends import DEFAULT_BACKEND
+from utils.pipeline_context import get_context
+from utils.tiling import filter_tiled, clahe_tiled
+from utils.zones import rasterize_zones
+from utils import metrics
 
 logger = logging.getLogger(__name__)
 
-def preprocess_image(image_array):
+# Preprocessed grayscale baseline image together with its feature points and
+# descriptors, the feature backend (name and keypoint budget) they were
+# extracted with, and the monitored zones (utils.zones.Zones) of its
+# location, or None for the whole frame
+BaselineFeatures = namedtuple(
+    'BaselineFeatures',
+    ['image', 'points', 'descriptors', 'backend', 'max_features', 'zones'],
+    defaults=(None,)
+)
+
+# Alignment residual check: images are compared at this scale on a grid of
+# tiles, and a tile's shift only counts when its phase correlation response
+# reaches RESIDUAL_MIN_RESPONSE (tiles containing real changes score low)
+RESIDUAL_SCALE = 0.5
+RESIDUAL_GRID = 3
+RESIDUAL_MIN_RESPONSE = 0.3
+
+def as_gray(image):
+    """
+    Grayscale plane of an image
+    
+    Preprocessed images are grayscale already and are returned as-is; RGB
+    images (e.g. from callers preprocessing on their own) are converted.
+    """
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+@lru_cache(maxsize=64)
+def zone_mask(zones, shape):
+    """
+    Mask of the monitored zones of a location for frames of a shape
+    
+    Masks are rasterized once per zones and frame shape.
+    
+    Args:
+        zones: utils.zones.Zones of the location
+        shape: Shape of the (preprocessed) frames
+        
+    Returns:
+        Tuple of the read-only mask (255 where monitored) and its bounding
+        box (x, y, width, height), which is empty when nothing is monitored
+    """
+    height, width = shape[:2]
+    mask = np.array(rasterize_zones(zones, (width, height)))
+    mask.setflags(write=False)
+    return mask, cv2.boundingRect(mask)
+
+@lru_cache(maxsize=64)
+def feature_mask(zones, shape):
+    """
+    Mask of where alignment features are detected in frames of a shape
+    
+    Only the excluded areas (screens, windows) are left out: the static
+    surroundings of a small monitored zone are what alignment relies on.
+    
+    Returns:
+        Read-only mask, or None when nothing is excluded
+    """
+    if not zones.exclude:
+        return None
+    height, width = shape[:2]
+    mask = np.array(rasterize_zones(zones, (width, height), include=False))
+    mask.setflags(write=False)
+    return mask
+
+@metrics.timed('preprocess')
+def preprocess_image(image_array, max_dim=800, tiling=None):
     """
     Preprocess an image for change detection
     
+    Every later stage works on intensities only, so the image is converted
+    to grayscale first and stays single channel: resizing and blurring touch
+    a third of the data, and nothing is expanded back to RGB.
+    
     Args:
-        image_array: NumPy array of the image
+        image_array: NumPy array of the image (RGB, RGBA or grayscale)
+        max_dim: Largest dimension images are downscaled to, or None to keep
+            the full resolution
+        tiling: Optional utils.tiling.Tiling to convert, blur and equalize
+            the image tile by tile on several threads
         
     Returns:
-        Preprocessed image
+        Preprocessed grayscale image
     """
+    context = get_context()
     try:
-        # Convert to RGB if needed
-        if image_array.shape[2] == 4:  # RGBA
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
+        # Convert to grayscale up front; the intermediates go to the
+        # context's scratch buffers
+        if image_array.ndim == 3:
+            code = cv2.COLOR_RGBA2GRAY if image_array.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+            if tiling and tiling.splits(image_array.shape):
+                grayscale = filter_tiled(lambda tile: cv2.cvtColor(tile, code), [image_array], 0, tiling)
+            else:
+                grayscale = cv2.cvtColor(image_array, code,
+                                         dst=context.buffer('preprocess_gray', image_array.shape[:2]))
+        else:
+            grayscale = image_array
         
         # Resize to a standard size if needed
         # This helps with consistency in processing
-        height, width = image_array.shape[:2]
-        max_dim = 800
+        height, width = grayscale.shape[:2]
         
-        if height > max_dim or width > max_dim:
+        if max_dim and (height > max_dim or width > max_dim):
             scale = max_dim / max(height, width)
             new_height = int(height * scale)
             new_width = int(width * scale)
-            image_array = cv2.resize(image_array, (new_width, new_height))
+            grayscale = cv2.resize(grayscale, (new_width, new_height),
+                                   dst=context.buffer('preprocess_resized', (new_height, new_width)))
             
-        # Apply slight Gaussian blur to reduce noise
-        image_array = cv2.GaussianBlur(image_array, (5, 5), 0)
-        
-        # Convert to grayscale for certain operations
-        grayscale = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
-        
-        # Equalize histogram to improve contrast
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        grayscale = clahe.apply(grayscale)
+        if tiling and tiling.splits(grayscale.shape):
+            # Tiles read the 2 pixels around them the 5x5 blur reaches
+            grayscale = filter_tiled(lambda tile: cv2.GaussianBlur(tile, (5, 5), 0), [grayscale], 2, tiling)
+            return clahe_tiled(grayscale, tiling)
         
-        # Convert back to RGB for consistency in the pipeline
-        enhanced = cv2.cvtColor(grayscale, cv2.COLOR_GRAY2RGB)
+        # Apply slight Gaussian blur to reduce noise
+        grayscale = cv2.GaussianBlur(grayscale, (5, 5), 0,
+                                     dst=context.buffer('preprocess_blurred', grayscale.shape))
         
-        return enhanced
+        # Equalize histogram to improve contrast; the result is returned, so
+        # it gets its own array
+        return context.clahe.apply(grayscale)
         
     except Exception as e:
         logger.error(f"Error preprocessing image: {str(e)}")
         # Return original image if processing fails
         return image_array
 
-def extract_features(image):
+@metrics.timed('features')
+def extract_features(image, backend=DEFAULT_BACKEND, max_features=None, mask=None):
     """
     Extract features from an image for matching
     
     Args:
         image: Preprocessed image
+        backend: Name of the feature backend (see utils.feature_backends)
+        max_features: Keypoint budget, or None for the backend's default
+        mask: Optional mask of where keypoints may be detected
         
     Returns:
         Keypoints and descriptors
     """
     try:
-        # Convert to grayscale for feature detection
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        
-        # Use SIFT for feature detection
-        sift = cv2.SIFT_create()
-        keypoints, descriptors = sift.detectAndCompute(gray, None)
+        keypoints, descriptors = get_context().backend(backend, max_features).detect(as_gray(image), mask)
         
         return keypoints, descriptors
         
@@ -75,46 +162,124 @@ def extract_features(image):
         logger.error(f"Error extracting features: {str(e)}")
         return None, None
 
-def align_images(image1, image2):
+def keypoint_coordinates(keypoints):
+    """
+    Convert OpenCV keypoints to an array of (x, y) coordinates
+    
+    Args:
+        keypoints: Sequence of cv2.KeyPoint objects
+        
+    Returns:
+        float32 array of shape (N, 2)
+    """
+    if not keypoints:
+        return np.empty((0, 2), dtype=np.float32)
+    return np.float32([kp.pt for kp in keypoints])
+
+def prepare_baseline(image_array, backend=DEFAULT_BACKEND, max_features=None, zones=None):
+    """
+    Preprocess a baseline image and extract its features once so they can be
+    reused across comparisons
+    
+    Args:
+        image_array: NumPy array of the raw baseline image
+        backend: Name of the feature backend
+        max_features: Keypoint budget, or None for the backend's default
+        zones: Optional Zones of the baseline's location, which comparisons
+            against it are limited to; no features are taken from their
+            excluded areas
+        
+    Returns:
+        BaselineFeatures with the preprocessed image, keypoint coordinates
+        and descriptors
+    """
+    processed = preprocess_image(image_array)
+    mask = feature_mask(zones, processed.shape) if zones else None
+    keypoints, descriptors = extract_features(processed, backend, max_features, mask)
+    
+    # Cached arrays are shared between requests, so guard against mutation
+    processed.setflags(write=False)
+    if descriptors is not None:
+        descriptors.setflags(write=False)
+    
+    return BaselineFeatures(
+        processed,
+        keypoint_coordinates(keypoints),
+        descriptors,
+        backend,
+        max_features,
+        zones
+    )
+
+def estimate_homography(baseline_features, image):
+    """
+    Estimate the homography mapping an image onto a prepared baseline
+    
+    Args:
+        baseline_features: BaselineFeatures of the baseline
+        image: Preprocessed image to align
+        
+    Returns:
+        3x3 homography matrix, or None if there are too few matches
+    """
+    backend = get_context().backend(baseline_features.backend, baseline_features.max_features)
+    pts1, des1 = baseline_features.points, baseline_features.descriptors
+    
+    gray = as_gray(image)
+    mask = feature_mask(baseline_features.zones, gray.shape) if baseline_features.zones else None
+    with metrics.stage('features'):
+        kp2, des2 = backend.detect(gray, mask)
+    
+    if des1 is None or des2 is None or len(des1) < 2 or len(des2) < 2:
+        return None
+    
+    pts2 = keypoint_coordinates(kp2)
+    
+    # Match features and apply the ratio test
+    with metrics.stage('match'):
+        good_matches = backend.match(des1, des2)
+    
+    if len(good_matches) < 10:
+        # Not enough matches for alignment
+        return None
+    
+    # Get matched keypoints
+    query_idx, train_idx = zip(*good_matches)
+    src_pts = pts1[list(query_idx)].reshape(-1, 1, 2)
+    dst_pts = pts2[list(train_idx)].reshape(-1, 1, 2)
+    
+    # Find homography matrix
+    with metrics.stage('homography'):
+        H, mask = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 5.0)
+    return H
+
+def align_images(image1, image2, baseline_features=None, backend=DEFAULT_BACKEND, max_features=None):
     """
     Align two images to account for camera position changes
     
     Args:
         image1: First image (baseline)
         image2: Second image (current)
+        baseline_features: Optional precomputed BaselineFeatures for image1;
+            its backend is then used for image2 as well
+        backend: Name of the feature backend when image1 isn't prepared
+        max_features: Keypoint budget when image1 isn't prepared
         
     Returns:
         Aligned version of image2
     """
     try:
-        # Extract features
-        kp1, des1 = extract_features(image1)
-        kp2, des2 = extract_features(image2)
+        # Extract baseline features unless they were prepared already
+        if baseline_features is None:
+            keypoints, descriptors = extract_features(image1, backend, max_features)
+            baseline_features = BaselineFeatures(
+                image1, keypoint_coordinates(keypoints), descriptors, backend, max_features
+            )
         
-        if des1 is None or des2 is None:
+        H = estimate_homography(baseline_features, image2)
+        if H is None:
             return image2
         
-        # Match features
-        bf = cv2.BFMatcher()
-        matches = bf.knnMatch(des1, des2, k=2)
-        
-        # Apply ratio test
-        good_matches = []
-        for m, n in matches:
-            if m.distance < 0.75 * n.distance:
-                good_matches.append(m)
-        
-        if len(good_matches) < 10:
-            # Not enough matches for alignment
-            return image2
-        
-        # Get matched keypoints
-        src_pts = np.float32([kp1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-        dst_pts = np.float32([kp2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-        
-        # Find homography matrix
-        H, mask = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 5.0)
-        
         # Apply transformation
         h, w = image1.shape[:2]
         aligned = cv2.warpPerspective(image2, H, (w, h))
@@ -124,3 +289,108 @@ def align_images(image1, image2):
     except Exception as e:
         logger.error(f"Error aligning images: {str(e)}")
         return image2
+
+def _dft_size_below(size):
+    """Largest size <= size that the DFT handles efficiently"""
+    # Other sizes also bias cv2.phaseCorrelate by half a pixel
+    while size > 8 and cv2.getOptimalDFTSize(size) != size:
+        size -= 1
+    return size
+
+@metrics.timed('residual')
+def alignment_residual(baseline_image, image, H=None):
+    """
+    Cheaply estimate how far an image is from being aligned with a baseline
+    
+    Both images are downscaled and split into a grid of tiles; phase
+    correlation gives each tile's residual shift. Rotation and scale show up
+    as tiles shifting in different directions, while tiles covering real
+    scene changes have a low response and are ignored.
+    
+    Args:
+        baseline_image: Preprocessed baseline image
+        image: Preprocessed image to check
+        H: Optional homography applied to image before checking
+        
+    Returns:
+        Residual misalignment in pixels, or infinity if too few tiles could
+        be matched
+    """
+    scale = RESIDUAL_SCALE
+    baseline_small = cv2.resize(as_gray(baseline_image), None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    image_small = cv2.resize(as_gray(image), None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    height, width = baseline_small.shape
+    if H is not None:
+        S = np.diag([scale, scale, 1.0])
+        H_small = S @ H @ np.linalg.inv(S)
+        image_small = cv2.warpPerspective(image_small, H_small, (width, height))
+    elif image_small.shape != baseline_small.shape:
+        return float('inf')
+    
+    tile_h = _dft_size_below(height // RESIDUAL_GRID)
+    tile_w = _dft_size_below(width // RESIDUAL_GRID)
+    window = cv2.createHanningWindow((tile_w, tile_h), cv2.CV_32F)
+    
+    shifts = []
+    for row in range(RESIDUAL_GRID):
+        for col in range(RESIDUAL_GRID):
+            # Center each tile in its grid cell
+            y = row * (height // RESIDUAL_GRID) + (height // RESIDUAL_GRID - tile_h) // 2
+            x = col * (width // RESIDUAL_GRID) + (width // RESIDUAL_GRID - tile_w) // 2
+            (dx, dy), response = cv2.phaseCorrelate(
+                np.float32(baseline_small[y:y+tile_h, x:x+tile_w]),
+                np.float32(image_small[y:y+tile_h, x:x+tile_w]),
+                window
+            )
+            if response >= RESIDUAL_MIN_RESPONSE:
+                shifts.append(np.hypot(dx, dy) / scale)
+    
+    if len(shifts) * 2 < RESIDUAL_GRID * RESIDUAL_GRID:
+        return float('inf')
+    return float(np.percentile(shifts, 80))
+
+@metrics.timed('align')
+def align_to_baseline(baseline_features, image, homography_hint=None, residual_threshold=1.5):
+    """
+    Align an image with a prepared baseline, skipping feature matching when
+    a cheap check shows it isn't needed
+    
+    The image is used as-is when it is already aligned (fixed cameras), and
+    homography_hint (e.g. the last transform for this camera) is reused when
+    it still fits; only otherwise is a new homography estimated.
+    
+    Args:
+        baseline_features: BaselineFeatures of the baseline
+        image: Preprocessed image to align
+        homography_hint: Optional previously estimated homography to try first
+        residual_threshold: Largest residual in pixels accepted by the fast
+            paths (0 disables them)
+        
+    Returns:
+        Tuple of the aligned image, the homography used (None if alignment
+        failed) and the method: "identity", "cached", "estimated" or "failed"
+    """
+    baseline_image = baseline_features.image
+    h, w = baseline_image.shape[:2]
+    
+    try:
+        if residual_threshold > 0:
+            if alignment_residual(baseline_image, image) <= residual_threshold:
+                return image, np.eye(3), 'identity'
+            
+            if homography_hint is not None and \
+                    alignment_residual(baseline_image, image, homography_hint) <= residual_threshold:
+                with metrics.stage('warp'):
+                    return cv2.warpPerspective(image, homography_hint, (w, h)), homography_hint, 'cached'
+        
+        H = estimate_homography(baseline_features, image)
+        if H is None:
+            return image, None, 'failed'
+        
+        with metrics.stage('warp'):
+            return cv2.warpPerspective(image, H, (w, h)), H, 'estimated'
+        
+    except Exception as e:
+        logger.error(f"Error aligning images: {str(e)}")
+        return image, None, 'failed'
@@ -0,0 +1,145 @@
+import os
+import mmap
+import hashlib
+import tempfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ImageStore:
+    """
+    Content-addressed on-disk store for scan images.
+
+    Files are named by the SHA-256 of their bytes and sharded into two levels
+    of sub-directories (ab/cd/abcd...), so identical images are stored once.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, digest):
+        """Get the on-disk path of an image by its hash"""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        """Check whether an image is present in the store"""
+        return bool(digest) and os.path.exists(self.path_for(digest))
+
+    def put(self, data):
+        """
+        Store image bytes, deduplicating identical content
+
+        Args:
+            data: Raw image bytes
+
+        Returns:
+            Hex SHA-256 digest identifying the stored image
+        """
+        return self.add(data)[0]
+
+    def put_stream(self, stream, chunk_size=64 * 1024):
+        """
+        Store an image read incrementally from a file-like object, hashing
+        it while it is written so the upload is never held in memory
+
+        Args:
+            stream: Readable binary stream
+            chunk_size: Bytes read per iteration
+
+        Returns:
+            Hex SHA-256 digest identifying the stored image
+        """
+        return self.add_stream(stream, chunk_size)[0]
+
+    def add(self, data):
+        """
+        Store image bytes like put, telling whether they were new
+
+        Returns:
+            Tuple of the digest and whether this call created the file (False
+            when the same content was stored already)
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if self.exists(digest):
+            return digest, False
+
+        # Write to a temporary file first so readers never see partial images
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            return digest, self._publish(digest, tmp_path)
+        finally:
+            os.remove(tmp_path)
+
+    def add_stream(self, stream, chunk_size=64 * 1024):
+        """
+        Store a streamed image like put_stream, telling whether it was new
+
+        Returns:
+            Tuple of the digest and whether this call created the file
+        """
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    f.write(chunk)
+
+            digest = sha.hexdigest()
+            return digest, not self.exists(digest) and self._publish(digest, tmp_path)
+        finally:
+            os.remove(tmp_path)
+
+    def _publish(self, digest, tmp_path):
+        """
+        Link a fully written temporary file in as an image
+
+        Linking fails if the image exists, so of several writers storing
+        the same content at once exactly one creates it.
+
+        Returns:
+            Whether the image was created
+        """
+        path = self.path_for(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+
+    def open(self, digest):
+        """Open a stored image for streaming reads"""
+        return open(self.path_for(digest), 'rb')
+
+    def map(self, digest):
+        """
+        Memory-map a stored image read-only
+
+        Returns:
+            mmap object; close it when done
+        """
+        with self.open(digest) as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, digest):
+        """Read a stored image into memory"""
+        with self.open(digest) as f:
+            return f.read()
+
+    def size(self, digest):
+        """Get the size in bytes of a stored image"""
+        return os.path.getsize(self.path_for(digest))
+
+    def delete(self, digest):
+        """Remove an image from the store"""
+        try:
+            os.remove(self.path_for(digest))
+        except FileNotFoundError:
+            pass
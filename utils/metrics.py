@@ -0,0 +1,179 @@
+import time
+import bisect
+import logging
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage timings of the work in progress in this context (request, job or
+# comparison), or None when nobody is collecting them
+_current_timings = ContextVar('stage_timings', default=None)
+
+# Shared no-op context manager returned when timings aren't collected
+_NOT_TIMED = nullcontext()
+
+class StageTimings:
+    """
+    Wall-clock seconds spent in each named stage of one unit of work.
+
+    Stages may nest (e.g. "match" inside "align"), and a stage entered more
+    than once accumulates its time.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def merge(self, seconds):
+        """Add timings collected elsewhere, e.g. in a compute worker"""
+        for name, value in seconds.items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + value
+
+def stage(name):
+    """
+    Time a block as a stage of the current unit of work
+
+    Costs a context variable lookup when no timings are being collected.
+    """
+    timings = _current_timings.get()
+    return _NOT_TIMED if timings is None else timings.stage(name)
+
+def timed(name):
+    """Decorator timing every call of a function as a stage"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            timings = _current_timings.get()
+            if timings is None:
+                return fn(*args, **kwargs)
+            with timings.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def begin_timings():
+    """
+    Start collecting stage timings in the current context
+
+    Returns:
+        Tuple of the StageTimings and the token to pass to end_timings
+    """
+    timings = StageTimings()
+    return timings, _current_timings.set(timings)
+
+def end_timings(token):
+    """Stop collecting the timings started by begin_timings"""
+    _current_timings.reset(token)
+
+@contextmanager
+def collect_timings():
+    """
+    Collect the stage timings of the enclosed work
+
+    Yields:
+        StageTimings filled in as stages complete
+    """
+    timings, token = begin_timings()
+    try:
+        yield timings
+    finally:
+        end_timings(token)
+
+def current_timings():
+    """StageTimings being collected in this context, or None"""
+    return _current_timings.get()
+
+class Histogram:
+    """Prometheus style cumulative histogram with one series per label value"""
+
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # Per bucket counts (the last one is +Inf), sum and count
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        """Text exposition lines of the histogram"""
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: ([*counts], total, count) for key, (counts, total, count) in self._series.items()}
+
+        for label_value, (counts, total, count) in sorted(series.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsRegistry:
+    """
+    Latency histograms of this process, exposed in the Prometheus text format.
+
+    Each process keeps its own registry, so with several web workers every
+    scrape sees the process that answered it.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stage_seconds = Histogram(
+            'spacescanner_stage_seconds', 'Time spent in each pipeline stage', 'stage'
+        )
+        self.request_seconds = Histogram(
+            'spacescanner_request_seconds', 'Request handling time by endpoint', 'endpoint'
+        )
+
+    def observe_stages(self, seconds):
+        """Record the stage timings (name to seconds) of a finished unit of work"""
+        for name, value in seconds.items():
+            self.stage_seconds.observe(name, value)
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = self.stage_seconds.render() + self.request_seconds.render()
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+def server_timing(timings, total=None):
+    """
+    Server-Timing header value listing stage durations in milliseconds
+
+    Args:
+        timings: StageTimings of the request
+        total: Optional overall request time in seconds
+    """
+    entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.seconds.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
@@ -1,11 +1,16 @@
 import cv2
 import numpy as np
 import logging
-import io
-import os
+
+from utils.image_processor import zone_mask
+from utils import metrics
 
 logger = logging.getLogger(__name__)
 
+# Regions are classified by the dominant bin of a hue/saturation histogram
+HUE_BINS = 18
+SATURATION_BINS = 25
+
 # Simplified object detector that doesn't rely on TensorFlow
 class ObjectDetector:
     def __init__(self):
@@ -22,91 +27,146 @@ class ObjectDetector:
             "decorative item", "office supplies", "tools", "unknown"
         ]
     
-    def detect(self, image, regions=None):
+    def detect(self, image, regions=None, bounds=None):
         """
         Detect objects in the image, optionally focusing on specific regions
         
         Args:
-            image: The image to analyze
+            image: The image to analyze (RGB or grayscale)
             regions: Optional list of regions to focus on
+            bounds: Optional (x, y, width, height) box analyzed instead of
+                the entire image when there are no regions
             
         Returns:
             List of detected objects with bounding boxes and labels
         """
         try:
-            results = []
-            
-            # Process the entire image or each region
+            # Process the entire image (or bounds) or each region
+            x0, y0, w0, h0 = bounds if bounds else (0, 0, image.shape[1], image.shape[0])
             regions_to_process = regions if regions else [
-                {'x': 0, 'y': 0, 'width': image.shape[1], 'height': image.shape[0], 'type': 'changed'}
+                {'x': x0, 'y': y0, 'width': w0, 'height': h0, 'type': 'changed'}
             ]
             
-            for region in regions_to_process:
-                # Extract region
-                x, y, w, h = region['x'], region['y'], region['width'], region['height']
-                
-                # Ensure coordinates are within the image bounds
-                x = max(0, min(x, image.shape[1] - 1))
-                y = max(0, min(y, image.shape[0] - 1))
-                w = min(w, image.shape[1] - x)
-                h = min(h, image.shape[0] - y)
-                
-                # Skip if region is too small
-                if w < 10 or h < 10:
-                    continue
-                
-                roi = image[y:y+h, x:x+w]
-                
-                if roi.size == 0:
-                    continue
-                
-                # Calculate features for classification
-                # Use color distribution as a simple feature
-                hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-                    
-                # Calculate color histogram
-                hist = cv2.calcHist([hsv], [0, 1], None, [18, 25], [0, 180, 0, 256])
-                cv2.normalize(hist, hist, 0, 1, cv2.NORM_MINMAX)
-                
-                # Simple classification based on dominant color
-                dominant_color_idx = np.unravel_index(hist.argmax(), hist.shape)
-                hue = dominant_color_idx[0] * 10  # 180/18
-                
-                # Object classification based on color and change type
-                label = "unknown"
-                change_type = region.get('type', 'changed')
-                
-                if 0 <= hue < 15 or 160 <= hue <= 180:  # Red range
-                    label = "furniture" if change_type == 'added' else "decorative item"
-                elif 15 <= hue < 40:  # Yellow/Orange range
-                    label = "electronics" if change_type == 'added' else "container"
-                elif 40 <= hue < 80:  # Green range
-                    label = "plant"
-                elif 80 <= hue < 120:  # Blue range
-                    label = "clothing" if change_type == 'added' else "office supplies"
-                elif 120 <= hue < 160:  # Purple range
-                    label = "electronics" if change_type == 'removed' else "decorative item"
-                
-                # Calculate a pseudo-confidence based on the size of the region
-                # Larger regions tend to be more reliable
-                area_ratio = (w * h) / (image.shape[0] * image.shape[1])
-                confidence = min(0.85, max(0.4, area_ratio * 10))
-                
-                results.append({
-                    'label': label,
-                    'confidence': float(confidence),
-                    'x': int(x),
-                    'y': int(y),
-                    'width': int(w),
-                    'height': int(h)
-                })
+            image_h, image_w = image.shape[:2]
+            boxes = np.array([[r['x'], r['y'], r['width'], r['height']] for r in regions_to_process],
+                             dtype=np.int64).reshape(-1, 4)
+            change_types = np.array([r.get('type', 'changed') for r in regions_to_process])
+            
+            # Ensure coordinates are within the image bounds
+            x = np.clip(boxes[:, 0], 0, image_w - 1)
+            y = np.clip(boxes[:, 1], 0, image_h - 1)
+            w = np.minimum(boxes[:, 2], image_w - x)
+            h = np.minimum(boxes[:, 3], image_h - y)
+            
+            # Skip regions that are too small
+            keep = (w >= 10) & (h >= 10)
+            x, y, w, h, change_types = x[keep], y[keep], w[keep], h[keep], change_types[keep]
+            if len(x) == 0:
+                return []
+            
+            # Use color distribution as a simple feature: the dominant bin of
+            # each region's hue/saturation histogram. Only the area spanned
+            # by the regions is converted.
+            if image.ndim == 2:
+                # Grayscale pixels all have hue and saturation 0
+                hue = np.zeros(len(x), dtype=np.int64)
+            else:
+                left, top = x.min(), y.min()
+                right, bottom = (x + w).max(), (y + h).max()
+                hist = _region_histograms(
+                    _hue_saturation_bins(image[top:bottom, left:right]),
+                    x - left, y - top, w, h
+                )
+                hue = (hist.argmax(axis=1) // SATURATION_BINS) * (180 // HUE_BINS)
             
-            return results
+            # Object classification based on color and change type
+            added = change_types == 'added'
+            removed = change_types == 'removed'
+            labels = np.select(
+                [
+                    (hue < 15) | (hue >= 160),  # Red range
+                    hue < 40,                   # Yellow/Orange range
+                    hue < 80,                   # Green range
+                    hue < 120,                  # Blue range
+                    hue < 160                   # Purple range
+                ],
+                [
+                    np.where(added, "furniture", "decorative item"),
+                    np.where(added, "electronics", "container"),
+                    "plant",
+                    np.where(added, "clothing", "office supplies"),
+                    np.where(removed, "electronics", "decorative item")
+                ],
+                default="unknown"
+            )
+            
+            # Calculate a pseudo-confidence based on the size of the region
+            # Larger regions tend to be more reliable
+            area_ratio = (w * h) / (image_h * image_w)
+            confidence = np.clip(area_ratio * 10, 0.4, 0.85)
+            
+            return [{
+                'label': str(labels[i]),
+                'confidence': float(confidence[i]),
+                'x': int(x[i]),
+                'y': int(y[i]),
+                'width': int(w[i]),
+                'height': int(h[i])
+            } for i in range(len(x))]
             
         except Exception as e:
             logger.error(f"Error in object detection: {str(e)}")
             return []
 
+# Lookup tables from 8-bit hue and saturation to their share of the joint
+# histogram bin index
+_HUE_BIN_LUT = (np.minimum(np.arange(256), 179) * HUE_BINS // 180 * SATURATION_BINS).astype(np.uint16)
+_SATURATION_BIN_LUT = (np.arange(256) * SATURATION_BINS // 256).astype(np.uint16)
+
+def _hue_saturation_bins(image):
+    """Joint hue/saturation histogram bin of every pixel"""
+    hue, saturation, _ = cv2.split(cv2.cvtColor(image, cv2.COLOR_RGB2HSV))
+    return cv2.add(cv2.LUT(hue, _HUE_BIN_LUT), cv2.LUT(saturation, _SATURATION_BIN_LUT))
+
+def _region_histograms(bins, x, y, w, h):
+    """
+    Histogram the bins inside many boxes with one pass per label layer
+    
+    Boxes are painted into label images, starting a new layer whenever a box
+    overlaps one already painted, and each layer is histogrammed with a
+    single bincount.
+    
+    Args:
+        bins: 2D array of per-pixel bin indices
+        x, y, w, h: Arrays of box coordinates (within bins)
+        
+    Returns:
+        Array of shape (number of boxes, HUE_BINS * SATURATION_BINS)
+    """
+    n_bins = HUE_BINS * SATURATION_BINS
+    histograms = np.empty((len(x), n_bins), dtype=np.int64)
+    
+    remaining = list(range(len(x)))
+    while remaining:
+        # Pixels outside every box of the layer count towards a spare label
+        # that is dropped afterwards, which is cheaper than masking them out
+        labels = np.full(bins.shape, len(remaining) * n_bins, dtype=np.int32)
+        layer, overlapping = [], []
+        for i in remaining:
+            box = labels[y[i]:y[i]+h[i], x[i]:x[i]+w[i]]
+            if box.min() < len(remaining) * n_bins:
+                overlapping.append(i)
+                continue
+            # Labels are stored premultiplied by the number of bins
+            box[:] = len(layer) * n_bins
+            layer.append(i)
+        
+        counts = np.bincount((labels + bins).ravel(), minlength=(len(remaining) + 1) * n_bins)
+        histograms[layer] = counts[:len(layer) * n_bins].reshape(len(layer), n_bins)
+        remaining = overlapping
+    
+    return histograms
+
 # Create a singleton instance
 _detector = None
 
@@ -117,16 +177,20 @@ def get_detector():
         _detector = ObjectDetector()
     return _detector
 
-def detect_objects(image, regions=None):
+@metrics.timed('objects')
+def detect_objects(image, regions=None, zones=None):
     """
     Detect objects in the image
     
     Args:
         image: Image to analyze
         regions: Optional list of regions to focus on
+        zones: Optional utils.zones.Zones; without regions only the
+            bounding box of their monitored area is analyzed
         
     Returns:
         List of detected objects
     """
     detector = get_detector()
-    return detector.detect(image, regions)
+    bounds = zone_mask(zones, image.shape[:2])[1] if zones else None
+    return detector.detect(image, regions, bounds)
@@ -0,0 +1,243 @@
+import io
+import logging
+from contextlib import nullcontext
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.image_processor import preprocess_image, prepare_baseline, align_to_baseline
+from utils.change_detector import (detect_changes, detect_changes_pyramid, render_visualization, DETECTION_ENGINES,
+                                   DEFAULT_THRESHOLD, MIN_CHANGE_AREA)
+from utils.object_detector import detect_objects, get_detector
+from utils.feature_backends import DEFAULT_BACKEND
+from utils.tiling import Tiling
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Supported visualization formats: PIL format, MIME type and default quality.
+# For PNG the quality is the zlib compression level, kept low because PNG
+# encoding at the default level dominates render time.
+VISUALIZATION_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', 85),
+    'webp': ('WEBP', 'image/webp', 80),
+    'png': ('PNG', 'image/png', 1)
+}
+
+# Change detection modes: "standard" works on images downscaled to 800px,
+# "pyramid" refines candidates at full resolution (boxes in original pixels)
+DETECTION_MODES = ('standard', 'pyramid')
+
+# These functions run inside compute worker processes, so their arguments
+# and results must be picklable (arrays, bytes, paths and plain dicts).
+
+def init_worker():
+    """Initialize a compute worker process"""
+    # One OpenCV thread per process; parallelism comes from the pool itself
+    cv2.setNumThreads(1)
+    # Preload the detector singleton so the first comparison doesn't pay for it
+    get_detector()
+
+@metrics.timed('decode')
+def load_image_array(source):
+    """
+    Decode an image into a NumPy array
+
+    Args:
+        source: Path of an image file or raw encoded image bytes
+
+    Returns:
+        NumPy array of the decoded image
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return np.array(Image.open(source))
+
+@lru_cache(maxsize=2)
+def _full_resolution_baseline(path):
+    """Full resolution preprocessed baseline, kept for consecutive comparisons"""
+    image = preprocess_image(load_image_array(path), max_dim=None)
+    # Stored images never change, so the path identifies the content
+    image.flags.writeable = False
+    return image
+
+def load_full_resolution_baseline(source):
+    """Decode and preprocess a baseline image without downscaling it"""
+    if isinstance(source, str):
+        return _full_resolution_baseline(source)
+    return preprocess_image(load_image_array(source), max_dim=None)
+
+def prepare_baseline_image(source, backend=DEFAULT_BACKEND, max_features=None, zones=None):
+    """Decode a baseline image and prepare its features with a feature backend"""
+    return prepare_baseline(load_image_array(source), backend, max_features, zones)
+
+@metrics.timed('encode')
+def encode_image(image_array, image_format='png', quality=None):
+    """
+    Encode an RGB array in one of the VISUALIZATION_FORMATS
+
+    Args:
+        image_array: RGB image
+        image_format: Key of VISUALIZATION_FORMATS
+        quality: Encoder quality (compression level for PNG), or None for
+            the format's default
+
+    Returns:
+        Encoded image bytes
+    """
+    pil_format, _, default_quality = VISUALIZATION_FORMATS[image_format]
+    quality = default_quality if quality is None else quality
+
+    buffer = io.BytesIO()
+    image = Image.fromarray(image_array)
+    if pil_format == 'PNG':
+        image.save(buffer, format=pil_format, compress_level=quality)
+    else:
+        image.save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue()
+
+def generate_derivatives(source, sizes, quality=80):
+    """
+    Encode downscaled JPEG copies of an image
+    
+    JPEG sources are decoded directly at a reduced scale (draft mode), and
+    each copy is resized from the next larger one rather than from the
+    original.
+    
+    Args:
+        source: Path or encoded bytes of the image
+        sizes: Dictionary of derivative name to longest side in pixels
+        quality: JPEG quality
+        
+    Returns:
+        Dictionary of derivative name to encoded JPEG bytes
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    
+    derivatives = {}
+    with Image.open(source) as image:
+        largest = max(sizes.values())
+        image.draft('RGB', (largest, largest))
+        image = image.convert('RGB')
+        for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            derivatives[name] = buffer.getvalue()
+    return derivatives
+
+def run_comparison(baseline_features, current_source, threshold=DEFAULT_THRESHOLD, render_format=None, render_quality=None,
+                   homography_hint=None, residual_threshold=1.5, mode='standard', baseline_source=None,
+                   engine='contours', tiling=None, collect_timings=False):
+    """
+    Compare a current image against a prepared baseline
+
+    Args:
+        baseline_features: BaselineFeatures of the baseline scan; only the
+            monitored area of their zones is compared
+        current_source: Path or encoded bytes of the current image
+        threshold: Sensitivity threshold (0-255)
+        render_format: Visualization format to render eagerly, or None to
+            skip rendering
+        render_quality: Encoder quality for the visualization
+        homography_hint: Last homography that aligned this camera with the
+            baseline, tried before estimating a new one
+        residual_threshold: Residual (pixels) accepted by the alignment fast
+            paths, 0 to always estimate
+        mode: One of DETECTION_MODES
+        baseline_source: Path or encoded bytes of the baseline image, needed
+            by the pyramid mode
+        engine: One of DETECTION_ENGINES
+        tiling: Optional Tiling to preprocess the current image and detect
+            changes tile by tile on several threads
+        collect_timings: Whether to time the comparison's stages
+
+    Returns:
+        Dictionary with changes, detected objects, the alignment method and
+        homography, when rendered the encoded visualization, and when
+        collected the stage timings in seconds ('timings')
+    """
+    with metrics.collect_timings() if collect_timings else nullcontext() as timings:
+        result = _compare(baseline_features, current_source, threshold, render_format, render_quality,
+                          homography_hint, residual_threshold, mode, baseline_source, engine, tiling)
+    if timings is not None:
+        result['timings'] = timings.seconds
+    return result
+
+def _compare(baseline_features, current_source, threshold, render_format, render_quality, homography_hint,
+             residual_threshold, mode, baseline_source, engine, tiling):
+    current_array = load_image_array(current_source)
+    current_processed = preprocess_image(current_array, tiling=tiling)
+
+    aligned, homography, method = align_to_baseline(
+        baseline_features,
+        current_processed,
+        homography_hint=homography_hint,
+        residual_threshold=residual_threshold
+    )
+
+    if mode == 'pyramid':
+        # Alignment and candidate search ran on the downscaled images; the
+        # candidates are refined against the full resolution images
+        coarse_shape = current_processed.shape
+        current_processed = preprocess_image(current_array, max_dim=None, tiling=tiling)
+        changes, _, visualization = detect_changes_pyramid(
+            load_full_resolution_baseline(baseline_source),
+            current_processed,
+            baseline_features.image,
+            aligned,
+            homography=homography,
+            threshold=threshold,
+            render=render_format is not None,
+            engine=engine,
+            zones=baseline_features.zones,
+            coarse_current_shape=coarse_shape
+        )
+    else:
+        changes, _, visualization = detect_changes(
+            baseline_features.image,
+            current_processed,
+            threshold=threshold,
+            baseline_features=baseline_features,
+            render=render_format is not None,
+            aligned_current=aligned,
+            engine=engine,
+            tiling=tiling,
+            zones=baseline_features.zones
+        )
+
+    # Detect objects in areas with changes; without changes there are none,
+    # as for comparisons the pre-screen skips
+    objects_detected = detect_objects(current_processed, changes, baseline_features.zones) if changes else []
+
+    result = {
+        'changes': changes,
+        'objects': objects_detected,
+        'alignment': method,
+        'homography': homography
+    }
+    if render_format is not None:
+        result['visualization'] = encode_image(visualization, render_format, render_quality)
+    return result
+
+def render_comparison(current_source, changes, image_format='png', quality=None, mode='standard'):
+    """
+    Render the visualization of a stored comparison on demand
+
+    Args:
+        current_source: Path or encoded bytes of the compared image
+        changes: Changes recorded for the comparison
+        image_format: Key of VISUALIZATION_FORMATS
+        quality: Encoder quality, or None for the format's default
+        mode: Detection mode of the comparison, which determines the
+            resolution its changes refer to
+
+    Returns:
+        Encoded visualization bytes
+    """
+    max_dim = None if mode == 'pyramid' else 800
+    current_processed = preprocess_image(load_image_array(current_source), max_dim=max_dim)
+    return encode_image(render_visualization(current_processed, changes), image_format, quality)
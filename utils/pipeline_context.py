@@ -0,0 +1,76 @@
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from utils.feature_backends import create_backend
+
+logger = logging.getLogger(__name__)
+
+# Contrast equalization of preprocess_image: CLAHE clip limit and cells per
+# side of its tile grid
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_GRID = 8
+
+class PipelineContext:
+    """
+    OpenCV objects and scratch buffers reused across comparisons.
+
+    Creating a CLAHE instance, a morphology kernel or a feature backend
+    (detector and matcher) on every call adds up, and so does allocating
+    fresh full-frame intermediates for images that all have the camera's
+    size. A context keeps them instead; it is not thread-safe, so each thread
+    gets its own through get_context() (compute workers run a single one).
+
+    Scratch buffers are overwritten by the next call that asks for the same
+    name, so they only hold intermediates, never returned results.
+    """
+
+    def __init__(self):
+        self.clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=(CLAHE_GRID, CLAHE_GRID))
+        self.kernel = np.ones((5, 5), np.uint8)
+        self._partial_clahes = {}
+        self._backends = {}
+        self._buffers = {}
+
+    def partial_clahe(self, columns, rows):
+        """
+        CLAHE instance for a part of a frame spanning columns x rows cells of
+        the full CLAHE_GRID (see utils.tiling)
+        """
+        clahe = self._partial_clahes.get((columns, rows))
+        if clahe is None:
+            clahe = self._partial_clahes[(columns, rows)] = cv2.createCLAHE(
+                clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=(columns, rows)
+            )
+        return clahe
+
+    def backend(self, name, max_features=None):
+        """Feature backend by name and keypoint budget, created on first use"""
+        key = (name, max_features)
+        backend = self._backends.get(key)
+        if backend is None:
+            backend = self._backends[key] = create_backend(name, max_features)
+        return backend
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        """
+        Scratch array for OpenCV dst= arguments
+
+        The array is reallocated only when the requested shape or type
+        changes, e.g. when frames of another size arrive.
+        """
+        array = self._buffers.get(name)
+        if array is None or array.shape != tuple(shape) or array.dtype != dtype:
+            array = self._buffers[name] = np.empty(shape, dtype)
+        return array
+
+_local = threading.local()
+
+def get_context():
+    """PipelineContext of the calling thread"""
+    context = getattr(_local, 'context', None)
+    if context is None:
+        context = _local.context = PipelineContext()
+    return context
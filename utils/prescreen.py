@@ -0,0 +1,128 @@
+import io
+import math
+import threading
+import logging
+from collections import defaultdict, deque
+from functools import lru_cache
+
+from PIL import Image, ImageChops
+
+from utils.zones import rasterize_zones
+
+logger = logging.getLogger(__name__)
+
+# Side of the grayscale grid an image is reduced to for its signature; the
+# signature is its SIGNATURE_SIZE * SIGNATURE_SIZE cell means as bytes
+SIGNATURE_SIZE = 32
+
+def image_signature(source):
+    """
+    Low-resolution signature of an image for the "no change" pre-screen
+
+    The image is reduced to a SIGNATURE_SIZE x SIGNATURE_SIZE grid of mean
+    gray levels, whatever its aspect ratio. JPEG images are decoded at a
+    reduced scale (draft mode) but no further than 8 pixels per cell, as
+    coarser DCT scaling shifts the cell means of textured scenes by up to
+    15 levels. PIL is enough, so the vision stack isn't needed.
+
+    Args:
+        source: Path or encoded bytes of the image, or an open PIL image
+
+    Returns:
+        Signature bytes
+    """
+    if isinstance(source, Image.Image):
+        return _signature(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        return _signature(image)
+
+def _signature(image):
+    image.draft('RGB', (SIGNATURE_SIZE * 8, SIGNATURE_SIZE * 8))
+    return image.convert('L').resize((SIGNATURE_SIZE, SIGNATURE_SIZE), Image.BOX).tobytes()
+
+@lru_cache(maxsize=256)
+def signature_mask(zones):
+    """
+    Signature cells that overlap the monitored area of zones
+
+    Returns:
+        Grayscale PIL image of the signature's size, 255 for those cells
+    """
+    detail = SIGNATURE_SIZE * 8
+    area = rasterize_zones(zones, (detail, detail)).resize((SIGNATURE_SIZE, SIGNATURE_SIZE), Image.BOX)
+    return area.point(lambda value: 255 if value else 0)
+
+def signature_distance(signature1, signature2, mask=None):
+    """
+    Largest difference (0-255) between the cells of two signatures
+
+    A change anywhere in the frame shows up in at least one cell, while
+    sensor and compression noise averages out within them.
+
+    Args:
+        signature1, signature2: Signatures from image_signature
+        mask: Optional signature_mask; only its cells are compared
+
+    Returns:
+        Distance, or None if the signatures aren't comparable
+    """
+    if not signature1 or not signature2 or len(signature1) != len(signature2):
+        return None
+    size = (SIGNATURE_SIZE, SIGNATURE_SIZE)
+    difference = ImageChops.difference(Image.frombytes('L', size, signature1), Image.frombytes('L', size, signature2))
+    if mask is not None:
+        difference = ImageChops.darker(difference, mask)
+    return difference.getextrema()[1]
+
+def detectable_distance(frame_size, threshold, min_area):
+    """
+    Largest signature distance that the smallest detectable change always
+    exceeds
+
+    A change of min_area pixels by threshold levels moves the means of the
+    cells it covers by threshold * min_area / cell area in total. Sitting on
+    a cell corner it is split across four cells, so the largest of them
+    moves by at least a quarter of that, less up to half a level of
+    rounding in each signature. Larger bounds let such changes be skipped.
+
+    Args:
+        frame_size: (width, height) of the frames changes are detected on
+        threshold: Smallest difference (levels of the original image) a
+            pixel of a detectable change has
+        min_area: Smallest detectable change, in pixels of frame_size
+
+    Returns:
+        Bound, or -1 when cells are too large for any bound to be safe
+    """
+    width, height = frame_size
+    cell_area = (width / SIGNATURE_SIZE) * (height / SIGNATURE_SIZE)
+    shift = threshold * min_area / (4 * cell_area)
+    return max(-1, math.ceil(shift) - 2)
+
+class SkipRateWindow:
+    """
+    Share of recent pre-screened comparisons that were skipped, per location.
+
+    Counts are kept per process over the last window comparisons of each
+    location, which is what tuning the distance bound needs: the rate
+    follows changes of the bound or of the scene quickly.
+    """
+
+    def __init__(self, window=100):
+        self.window = window
+        self._decisions = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, location, skipped):
+        """
+        Record one pre-screen decision
+
+        Returns:
+            Skip rate of the location including this decision
+        """
+        with self._lock:
+            decisions = self._decisions[location]
+            decisions.append(bool(skipped))
+            return sum(decisions) / len(decisions)
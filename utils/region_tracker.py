@@ -0,0 +1,101 @@
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+def box_iou(box1, box2):
+    """
+    Intersection over union of two (x, y, width, height) boxes
+
+    Returns:
+        IoU between 0 and 1
+    """
+    x1, y1, w1, h1 = box1
+    x2, y2, w2, h2 = box2
+
+    overlap_w = min(x1 + w1, x2 + w2) - max(x1, x2)
+    overlap_h = min(y1 + h1, y2 + h2) - max(y1, y2)
+    if overlap_w <= 0 or overlap_h <= 0:
+        return 0.0
+
+    intersection = overlap_w * overlap_h
+    return intersection / float(w1 * h1 + w2 * h2 - intersection)
+
+class RegionTracker:
+    """
+    Follows changed regions across scans by matching boxes on IoU.
+
+    Each track keeps the box it was last seen at. Boxes are indexed on a
+    uniform grid, so matching a new box only looks at tracks sharing a grid
+    cell with it rather than at every track.
+
+    The tracker only handles geometry; callers keep whatever they record
+    about a track (history, counts, database rows) keyed by track ID.
+    """
+
+    def __init__(self, iou_threshold=0.3, cell_size=64):
+        self.iou_threshold = iou_threshold
+        self.cell_size = cell_size
+        self.boxes = {}
+        self._cells = defaultdict(set)
+
+    def _cells_for(self, box):
+        x, y, w, h = box
+        size = self.cell_size
+        for cell_x in range(int(x) // size, int(x + max(w, 1) - 1) // size + 1):
+            for cell_y in range(int(y) // size, int(y + max(h, 1) - 1) // size + 1):
+                yield cell_x, cell_y
+
+    def add(self, track_id, box):
+        """Start tracking a region, or move a tracked region to a new box"""
+        if track_id in self.boxes:
+            self.remove(track_id)
+        self.boxes[track_id] = tuple(box)
+        for cell in self._cells_for(box):
+            self._cells[cell].add(track_id)
+
+    def remove(self, track_id):
+        """Stop tracking a region"""
+        box = self.boxes.pop(track_id)
+        for cell in self._cells_for(box):
+            self._cells[cell].discard(track_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def candidates(self, box):
+        """IDs of the tracks whose box shares a grid cell with box"""
+        found = set()
+        for cell in self._cells_for(box):
+            found.update(self._cells.get(cell, ()))
+        return found
+
+    def match(self, boxes):
+        """
+        Match the boxes of one scan to existing tracks
+
+        Pairs are assigned greedily from the highest IoU down, so each track
+        matches at most one box of the scan.
+
+        Args:
+            boxes: List of (x, y, width, height) boxes
+
+        Returns:
+            List with the matched track ID, or None, for each box
+        """
+        pairs = []
+        for index, box in enumerate(boxes):
+            for track_id in self.candidates(box):
+                iou = box_iou(box, self.boxes[track_id])
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, index, track_id))
+
+        matches = [None] * len(boxes)
+        used = set()
+        for iou, index, track_id in sorted(pairs, key=lambda pair: pair[0], reverse=True):
+            if matches[index] is None and track_id not in used:
+                matches[index] = track_id
+                used.add(track_id)
+        return matches
+
+    def __len__(self):
+        return len(self.boxes)
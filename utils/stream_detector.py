@@ -0,0 +1,209 @@
+import os
+import logging
+
+import cv2
+import numpy as np
+
+from utils.image_processor import preprocess_image, align_to_baseline, as_gray, zone_mask
+from utils.change_detector import _contour_changes, _component_changes
+from utils.pipeline_context import get_context
+from utils.region_tracker import RegionTracker
+
+logger = logging.getLogger(__name__)
+
+# Frame files read from a directory source, in file name order
+FRAME_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+
+def read_frames(source, frame_step=1):
+    """
+    Iterate over the frames of a video file or a directory of images
+
+    Args:
+        source: Path of a video file, or of a directory of frame images
+        frame_step: Yield every frame_step-th frame only
+
+    Yields:
+        Tuples of the frame index and the RGB frame
+    """
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(FRAME_EXTENSIONS))
+        for index, name in enumerate(names):
+            if index % frame_step:
+                continue
+            frame = cv2.imread(os.path.join(source, name), cv2.IMREAD_COLOR)
+            if frame is None:
+                logger.warning(f"Skipping unreadable frame {name}")
+                continue
+            yield index, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f'Cannot open video {source}')
+    try:
+        index = 0
+        while True:
+            # grab() skips decoding the frames that are stepped over
+            if not capture.grab():
+                break
+            if index % frame_step == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    yield index, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            index += 1
+    finally:
+        capture.release()
+
+class StreamDetector:
+    """
+    Detects lasting changes over a sequence of frames from a fixed camera.
+
+    Frames are compared with a running average background seeded from the
+    baseline instead of with the baseline itself, so slow drift such as
+    daylight is absorbed while the background is only updated outside
+    changed regions. A changed region is reported once, after it has been
+    seen in persistence consecutive frames, which filters out passers-by and
+    flicker.
+
+    Alignment carries the last homography from frame to frame, so a steady
+    camera costs a residual check per frame rather than feature matching.
+    Only the monitored area of the baseline's zones is watched.
+    """
+
+    def __init__(self, baseline_features, threshold=30, persistence=5, learning_rate=0.02,
+                 residual_threshold=1.5, iou_threshold=0.3, engine='contours'):
+        """
+        Args:
+            baseline_features: BaselineFeatures of the baseline scan
+            threshold: Sensitivity threshold (0-255)
+            persistence: Consecutive frames a region must be seen in before
+                it is reported
+            learning_rate: Weight of each frame in the running background
+            residual_threshold: Residual (pixels) accepted by the alignment
+                fast paths
+            iou_threshold: Overlap needed to match a region across frames
+            engine: One of DETECTION_ENGINES
+        """
+        self.baseline_features = baseline_features
+        self.threshold = threshold
+        self.persistence = persistence
+        self.learning_rate = learning_rate
+        self.residual_threshold = residual_threshold
+        self.engine = engine
+
+        self.background = np.float32(as_gray(baseline_features.image))
+        self.homography = None
+        self.tracker = RegionTracker(iou_threshold=iou_threshold)
+        # Per candidate region: consecutive frames seen, frames missed and
+        # whether it was reported
+        self._regions = {}
+        self._next_region_id = 0
+
+    def process(self, frame, preprocessed=False):
+        """
+        Feed one frame to the detector
+
+        Args:
+            frame: RGB frame
+            preprocessed: Whether frame already went through preprocess_image
+
+        Returns:
+            Tuple of the changes that became persistent with this frame (in
+            the same format as detect_changes, with the region's 'track'
+            ID) and the preprocessed (grayscale), aligned frame
+        """
+        processed = frame if preprocessed else preprocess_image(frame)
+        aligned, homography, method = align_to_baseline(
+            self.baseline_features,
+            processed,
+            homography_hint=self.homography,
+            residual_threshold=self.residual_threshold
+        )
+        if homography is not None:
+            self.homography = homography
+        elif method == 'failed':
+            # Comparing an unaligned frame would flag the whole scene
+            return [], aligned
+
+        # Every intermediate of a frame lives in the context's scratch
+        # buffers, which stay allocated while the frame size doesn't change
+        context = get_context()
+        gray = as_gray(aligned)
+        shape = gray.shape
+        background = cv2.convertScaleAbs(self.background, dst=context.buffer('stream_background', shape))
+
+        diff = cv2.absdiff(background, gray, dst=context.buffer('stream_diff', shape))
+        cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY, dst=diff)
+        zone = zone_mask(self.baseline_features.zones, shape)[0] if self.baseline_features.zones else None
+        if zone is not None:
+            cv2.bitwise_and(diff, zone, dst=diff)
+        opened = cv2.morphologyEx(diff, cv2.MORPH_OPEN, context.kernel, dst=context.buffer('stream_opened', shape))
+        mask = cv2.morphologyEx(opened, cv2.MORPH_CLOSE, context.kernel, dst=context.buffer('stream_mask', shape))
+        if zone is not None:
+            cv2.bitwise_and(mask, zone, dst=mask)
+
+        if self.engine == 'components':
+            changes = _component_changes(mask, background, gray)
+        else:
+            changes = _contour_changes(mask, background, gray)
+
+        # Learn the unchanged parts of the scene only, so a lasting change is
+        # not absorbed into the background before it is reported
+        unchanged = cv2.bitwise_not(mask, dst=context.buffer('stream_unchanged', shape))
+        cv2.accumulateWeighted(gray, self.background, self.learning_rate, mask=unchanged)
+
+        return self._persistent(changes), aligned
+
+    def _persistent(self, changes):
+        """Update the candidate regions and return the newly persistent changes"""
+        boxes = [(change['x'], change['y'], change['width'], change['height']) for change in changes]
+        seen = set()
+        persistent = []
+
+        for change, box, region_id in zip(changes, boxes, self.tracker.match(boxes)):
+            if region_id is None:
+                region_id = self._next_region_id
+                self._next_region_id += 1
+                self._regions[region_id] = {'frames': 0, 'missed': 0, 'reported': False}
+
+            region = self._regions[region_id]
+            region['frames'] += 1
+            region['missed'] = 0
+            self.tracker.add(region_id, box)
+            seen.add(region_id)
+
+            if region['frames'] >= self.persistence and not region['reported']:
+                region['reported'] = True
+                persistent.append(dict(change, track=region_id))
+
+        # Forget regions gone for as long as it takes to report one; a
+        # missed frame also restarts the count of unreported regions
+        for region_id in list(self._regions):
+            if region_id in seen:
+                continue
+            region = self._regions[region_id]
+            region['missed'] += 1
+            if not region['reported']:
+                region['frames'] = 0
+            if region['missed'] >= self.persistence:
+                del self._regions[region_id]
+                self.tracker.remove(region_id)
+
+        return persistent
+
+    def run(self, frames):
+        """
+        Process a sequence of frames lazily
+
+        Args:
+            frames: Iterable of (frame index, RGB frame), e.g. read_frames()
+
+        Yields:
+            Tuples of the frame index, the frame, the preprocessed aligned
+            frame and its newly persistent changes, for frames with at least
+            one
+        """
+        for index, frame in frames:
+            changes, aligned = self.process(frame)
+            if changes:
+                yield index, frame, aligned, changes
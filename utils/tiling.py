@@ -0,0 +1,307 @@
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from utils.pipeline_context import get_context, CLAHE_GRID
+
+logger = logging.getLogger(__name__)
+
+# Thread pools running tiles, per thread count, shared by the comparisons of
+# a process
+_pools = {}
+_pools_lock = threading.Lock()
+
+class Tiling(namedtuple('Tiling', ['tile_size', 'threads'])):
+    """
+    Tiled execution settings: side (pixels) of the square tiles a frame is
+    split into, and the number of threads processing them.
+
+    OpenCV releases the GIL, so the tiles of one frame run in parallel on a
+    thread pool. Neighborhood operations read an overlapping border (halo)
+    around each tile, so the stitched results equal whole-frame processing.
+    """
+
+    def splits(self, shape):
+        """Whether a frame of this shape is split into more than one tile"""
+        return self.threads > 1 and (shape[0] > self.tile_size or shape[1] > self.tile_size)
+
+def _pool(threads):
+    with _pools_lock:
+        pool = _pools.get(threads)
+        if pool is None:
+            pool = _pools[threads] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='tile')
+        return pool
+
+def map_tiles(fn, items, threads):
+    """Apply fn to every item on the tile thread pool, returning the results in order"""
+    items = list(items)
+    if threads <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    return list(_pool(threads).map(fn, items))
+
+def _ranges(length, size):
+    return [(start, min(start + size, length)) for start in range(0, length, size)]
+
+def tile_grid(shape, tile_size):
+    """
+    Split a frame into tiles
+
+    Returns:
+        Rows of (y0, y1, x0, x1) tiles, top to bottom and left to right
+    """
+    columns = _ranges(shape[1], tile_size)
+    return [[(y0, y1, x0, x1) for x0, x1 in columns] for y0, y1 in _ranges(shape[0], tile_size)]
+
+def filter_tiled(fn, sources, halo, tiling, then=None):
+    """
+    Run an image operation tile by tile and stitch the results
+
+    Args:
+        fn: Operation taking one crop of each source and returning a single
+            channel uint8 result of the crop's size
+        sources: Images of the same height and width
+        halo: Pixels around each tile the operation needs to compute the
+            tile exactly (0 for per-pixel operations)
+        tiling: Tiling settings
+        then: Optional function further processing each tile's part of the
+            result on the same thread
+
+    Returns:
+        Stitched result, or with then a tuple of the stitched result, the
+        rows of tiles (see tile_grid) and then's return value per tile
+    """
+    height, width = sources[0].shape[:2]
+    result = np.empty((height, width), np.uint8)
+    grid = tile_grid((height, width), tiling.tile_size)
+
+    def run(tile):
+        y0, y1, x0, x1 = tile
+        top, left = max(0, y0 - halo), max(0, x0 - halo)
+        bottom, right = min(height, y1 + halo), min(width, x1 + halo)
+        output = fn(*(source[top:bottom, left:right] for source in sources))
+        result[y0:y1, x0:x1] = output[y0 - top:y1 - top, x0 - left:x1 - left]
+        return then(result[y0:y1, x0:x1]) if then else None
+
+    extras = map_tiles(run, [tile for row in grid for tile in row], tiling.threads)
+    return (result, grid, extras) if then else result
+
+def _split(cells, parts):
+    bounds = [round(i * cells / parts) for i in range(parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+@lru_cache(maxsize=None)
+def clahe_blocks(threads, grid=CLAHE_GRID):
+    """
+    Split of the CLAHE grid into blocks of cells for a number of threads
+
+    A block has to be equalized together with the cells around it, which
+    its edge pixels are interpolated with, so small blocks repeat a lot of
+    work. The split chosen minimizes the cells the busiest thread handles.
+
+    Returns:
+        Tuple of the (start, end) cell rows and cell columns of the blocks
+    """
+    def with_halo(start, end):
+        return end - start + (start > 0) + (end < grid)
+
+    best = None
+    for row_parts in range(1, grid + 1):
+        for column_parts in range(1, grid + 1):
+            rows, columns = _split(grid, row_parts), _split(grid, column_parts)
+            largest = max(with_halo(*r) for r in rows) * max(with_halo(*c) for c in columns)
+            cost = -(-len(rows) * len(columns) // threads) * largest
+            if best is None or cost < best[0]:
+                best = (cost, rows, columns)
+    return best[1], best[2]
+
+def clahe_tiled(gray, tiling, grid=CLAHE_GRID):
+    """
+    Equalize an image as the CLAHE_GRID CLAHE of the pipeline context does,
+    block by block
+
+    OpenCV pads images whose size isn't a multiple of the grid (mirroring the
+    last rows and columns) and equalizes each cell with its own histogram,
+    interpolating between neighboring cells. A block of whole cells plus one
+    cell around it therefore equalizes exactly like the full frame, up to
+    rounding of the interpolation weights.
+
+    Args:
+        gray: Grayscale image
+        tiling: Tiling settings (only the thread count matters)
+        grid: Cells per side of the CLAHE grid
+
+    Returns:
+        Equalized image
+    """
+    height, width = gray.shape
+    if height % grid == 0 and width % grid == 0:
+        pad_y = pad_x = 0
+    else:
+        pad_y, pad_x = grid - height % grid, grid - width % grid
+    cell_h, cell_w = (height + pad_y) // grid, (width + pad_x) // grid
+
+    rows, columns = clahe_blocks(tiling.threads, grid)
+    if len(rows) * len(columns) == 1 or min(cell_h, cell_w) <= max(pad_y, pad_x):
+        return get_context().clahe.apply(gray)
+
+    result = np.empty_like(gray)
+
+    def run(block):
+        (row0, row1), (col0, col1) = block
+        # Cells of the block and the ring of cells around it
+        halo_row0, halo_row1 = max(0, row0 - 1), min(grid, row1 + 1)
+        halo_col0, halo_col1 = max(0, col0 - 1), min(grid, col1 + 1)
+        crop = gray[halo_row0 * cell_h:halo_row1 * cell_h, halo_col0 * cell_w:halo_col1 * cell_w]
+        # Blocks at the bottom or right edge are padded as OpenCV pads the frame
+        missing_y = (halo_row1 - halo_row0) * cell_h - crop.shape[0]
+        missing_x = (halo_col1 - halo_col0) * cell_w - crop.shape[1]
+        if missing_y or missing_x:
+            crop = cv2.copyMakeBorder(crop, 0, missing_y, 0, missing_x, cv2.BORDER_REFLECT_101)
+
+        clahe = get_context().partial_clahe(halo_col1 - halo_col0, halo_row1 - halo_row0)
+        equalized = clahe.apply(crop)
+
+        y0, y1 = row0 * cell_h, min(height, row1 * cell_h)
+        x0, x1 = col0 * cell_w, min(width, col1 * cell_w)
+        top, left = halo_row0 * cell_h, halo_col0 * cell_w
+        result[y0:y1, x0:x1] = equalized[y0 - top:y1 - top, x0 - left:x1 - left]
+
+    map_tiles(run, [(r, c) for r in rows for c in columns], tiling.threads)
+    return result
+
+def label_tile(mask):
+    """Connected components of a tile of a binary mask, for TiledComponents"""
+    _, labels, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(mask, 8, cv2.CV_32S, cv2.CCL_GRANA)
+    return labels, stats[1:]
+
+class TiledComponents:
+    """
+    Connected components (8-connectivity) of a binary mask, labelled tile
+    by tile.
+
+    Components cut by tile seams are merged, so areas (changed pixels) and
+    bounding boxes describe the same regions as labelling the whole mask.
+    """
+
+    def __init__(self, grid, labelled):
+        """
+        Args:
+            grid: Rows of tiles the mask was split into (see tile_grid)
+            labelled: label_tile() result of every tile, row by row
+        """
+        tiles = [tile for row in grid for tile in row]
+        self._tiles = tiles
+        self._labels = [labels for labels, _ in labelled]
+
+        # Components get global numbers: bases[t] + label - 1 in tile t
+        counts = np.array([len(stats) for _, stats in labelled])
+        self._bases = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        self._tile_of = np.repeat(np.arange(len(tiles)), counts)
+        stats = np.concatenate([stats for _, stats in labelled]) if counts.sum() else np.empty((0, 5), np.int32)
+        offsets = np.repeat(np.array([(x0, y0) for y0, _, x0, _ in tiles]).reshape(-1, 2), counts, axis=0)
+        self._piece_boxes = np.column_stack([
+            stats[:, 0] + offsets[:, 0], stats[:, 1] + offsets[:, 1],
+            stats[:, 0] + offsets[:, 0] + stats[:, 2], stats[:, 1] + offsets[:, 1] + stats[:, 3]
+        ]) if len(stats) else np.empty((0, 4), np.int64)
+
+        roots = self._merge_seams(grid, len(stats))
+        regions, self._region_of = np.unique(roots, return_inverse=True)
+        count = len(regions)
+        # Pieces of each region: _pieces[_first_piece[k]:_first_piece[k + 1]]
+        self._pieces = np.argsort(self._region_of, kind='stable')
+        self._first_piece = np.searchsorted(self._region_of[self._pieces], np.arange(count + 1))
+
+        self.areas = np.bincount(self._region_of, weights=stats[:, cv2.CC_STAT_AREA], minlength=count).astype(np.int64)
+        box = np.empty((count, 4), np.int64)
+        box[:, :2] = np.iinfo(np.int64).max
+        box[:, 2:] = -1
+        for column, reduce in ((0, np.minimum), (1, np.minimum), (2, np.maximum), (3, np.maximum)):
+            reduce.at(box[:, column], self._region_of, self._piece_boxes[:, column])
+        # (x, y, width, height) of each region
+        self.boxes = np.column_stack([box[:, 0], box[:, 1], box[:, 2] - box[:, 0], box[:, 3] - box[:, 1]])
+
+    @classmethod
+    def of(cls, mask, tiling):
+        """Label a binary mask tile by tile"""
+        grid = tile_grid(mask.shape, tiling.tile_size)
+        tiles = [tile for row in grid for tile in row]
+        return cls(grid, map_tiles(lambda t: label_tile(mask[t[0]:t[1], t[2]:t[3]]), tiles, tiling.threads))
+
+    def __len__(self):
+        return len(self.areas)
+
+    def _merge_seams(self, grid, count):
+        """Root component of every component once the pieces touching across seams are joined"""
+        index = {}
+        for r, row in enumerate(grid):
+            for c in range(len(row)):
+                index[(r, c)] = len(index)
+
+        pairs = []
+
+        def touching(a, tile_a, b, tile_b):
+            # Edge pixels (tile labels, 0 for background) of two neighboring
+            # tiles; each pixel of a touches its counterpart in b and the
+            # two pixels next to it
+            if not a.any() or not b.any():
+                return
+            for shift in (-1, 0, 1):
+                aa = a[max(0, -shift):len(a) - max(0, shift)]
+                bb = b[max(0, shift):len(b) - max(0, -shift)]
+                both = (aa > 0) & (bb > 0)
+                if both.any():
+                    pairs.append(np.column_stack([
+                        aa[both] - 1 + self._bases[tile_a], bb[both] - 1 + self._bases[tile_b]
+                    ]))
+
+        for (r, c), t in index.items():
+            labels = self._labels[t]
+            right, below = index.get((r, c + 1)), index.get((r + 1, c))
+            if right is not None:
+                touching(labels[:, -1], t, self._labels[right][:, 0], right)
+            if below is not None:
+                touching(labels[-1, :], t, self._labels[below][0, :], below)
+            # Tiles meeting at a corner touch diagonally
+            for corner, column in (((r + 1, c + 1), -1), ((r + 1, c - 1), 0)):
+                other = index.get(corner)
+                if other is not None:
+                    touching(labels[-1:, column], t, self._labels[other][:1, -1 - column], other)
+
+        roots = np.arange(count)
+        if not pairs or not sum(len(p) for p in pairs):
+            return roots
+
+        parent = {}
+
+        def find(i):
+            root = i
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while i != root:
+                parent[i], i = root, parent[i]
+            return root
+
+        for a, b in np.unique(np.concatenate(pairs), axis=0).tolist():
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+        for i in parent:
+            roots[i] = find(i)
+        return roots
+
+    def mask(self, region):
+        """Binary mask of one region, cropped to its bounding box"""
+        x, y, width, height = self.boxes[region]
+        crop = np.zeros((height, width), np.uint8)
+        for piece in self._pieces[self._first_piece[region]:self._first_piece[region + 1]]:
+            tile = self._tile_of[piece]
+            tile_y, _, tile_x, _ = self._tiles[tile]
+            x0, y0, x1, y1 = self._piece_boxes[piece]
+            labels = self._labels[tile][y0 - tile_y:y1 - tile_y, x0 - tile_x:x1 - tile_x]
+            crop[y0 - y:y1 - y, x0 - x:x1 - x][labels == piece - self._bases[tile] + 1] = 255
+        return crop
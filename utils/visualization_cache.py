@@ -0,0 +1,81 @@
+import os
+import hashlib
+import tempfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+class VisualizationCache:
+    """
+    On-disk cache of encoded comparison visualizations.
+
+    Each rendering is keyed by comparison ID, format and quality and by the
+    version of what it is drawn from (see content_version), so it can be
+    cached indefinitely: re-deriving a comparison's images or changes
+    gives it new keys rather than serving a stale rendering.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def content_version(baseline_hash, image_hash, changes):
+        """
+        Short digest of what a comparison's rendering is drawn from
+
+        Args:
+            baseline_hash: ImageStore hash of the baseline image
+            image_hash: ImageStore hash of the compared image
+            changes: The comparison's changes as stored (JSON text)
+        """
+        digest = hashlib.sha1()
+        for part in (baseline_hash or '', image_hash or '', changes or ''):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()[:16]
+
+    def path_for(self, comparison_id, version, image_format, quality):
+        """Get the on-disk path of a rendering"""
+        # Shard by thousands so directories stay small
+        return os.path.join(
+            self.root,
+            str(comparison_id // 1000),
+            f'{comparison_id}-{version}-q{quality}.{image_format}'
+        )
+
+    def etag(self, comparison_id, version, image_format, quality):
+        """Strong ETag identifying a rendering"""
+        return f'viz-{comparison_id}-{version}-{image_format}-q{quality}'
+
+    def get(self, comparison_id, version, image_format, quality):
+        """
+        Look up a cached rendering
+
+        Returns:
+            Path of the cached file, or None if it hasn't been rendered yet
+        """
+        path = self.path_for(comparison_id, version, image_format, quality)
+        return path if os.path.exists(path) else None
+
+    def put(self, comparison_id, version, image_format, quality, data):
+        """
+        Cache an encoded rendering
+
+        Returns:
+            Path of the cached file
+        """
+        path = self.path_for(comparison_id, version, image_format, quality)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see partial images
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
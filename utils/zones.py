@@ -0,0 +1,87 @@
+import json
+import logging
+from collections import namedtuple
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+# Monitored zones of a location: polygons to include and to exclude, each a
+# tuple of (x, y) points given as fractions of the frame's width and height
+# so they apply at any resolution. Without include polygons the whole frame
+# is monitored, except for the excluded polygons.
+Zones = namedtuple('Zones', ['include', 'exclude'])
+
+def parse_zones(data):
+    """
+    Validate zones given as {"include": [polygon, ...], "exclude": [...]}
+
+    Args:
+        data: Dictionary of polygon lists, each polygon a list of at least
+            three [x, y] points with coordinates between 0 and 1
+
+    Returns:
+        Zones, or None when there are no polygons (the whole frame)
+
+    Raises:
+        ValueError: If the zones are malformed
+    """
+    if not data:
+        return None
+    if not isinstance(data, dict) or set(data) - {'include', 'exclude'}:
+        raise ValueError("Zones must be an object with 'include' and 'exclude' polygon lists")
+
+    parsed = []
+    for key in ('include', 'exclude'):
+        polygons = data.get(key) or []
+        if not isinstance(polygons, list):
+            raise ValueError(f"'{key}' must be a list of polygons")
+
+        result = []
+        for polygon in polygons:
+            if not isinstance(polygon, list) or len(polygon) < 3:
+                raise ValueError(f"Every '{key}' polygon needs at least three points")
+            points = []
+            for point in polygon:
+                if not isinstance(point, (list, tuple)) or len(point) != 2 or not all(
+                        isinstance(v, (int, float)) and not isinstance(v, bool) and 0 <= v <= 1 for v in point):
+                    raise ValueError('Polygon points must be [x, y] fractions of the frame between 0 and 1')
+                points.append((float(point[0]), float(point[1])))
+            result.append(tuple(points))
+        parsed.append(tuple(result))
+
+    zones = Zones(*parsed)
+    return zones if zones.include or zones.exclude else None
+
+@lru_cache(maxsize=256)
+def load_zones(text):
+    """Zones stored as JSON (LocationProfile.zones), parsed once per distinct value"""
+    return parse_zones(json.loads(text)) if text else None
+
+def zones_data(zones):
+    """JSON-ready form of Zones, as accepted by parse_zones"""
+    return {key: [[list(point) for point in polygon] for polygon in polygons]
+            for key, polygons in zones._asdict().items()}
+
+def rasterize_zones(zones, size, include=True):
+    """
+    Draw the monitored area of a frame
+
+    Args:
+        zones: Zones of the frame's location
+        size: (width, height) of the frame
+        include: Whether the include polygons limit the area; otherwise only
+            the excluded polygons are left out
+
+    Returns:
+        Grayscale PIL image, 255 where monitored and 0 elsewhere
+    """
+    width, height = size
+    limited = include and zones.include
+    image = Image.new('L', size, 0 if limited else 255)
+    draw = ImageDraw.Draw(image)
+    for polygons, fill in ((zones.include if limited else (), 255), (zones.exclude, 0)):
+        for polygon in polygons:
+            draw.polygon([(x * width, y * height) for x, y in polygon], fill=fill)
+    return image